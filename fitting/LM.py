@@ -2,7 +2,19 @@
 
 # module import.
 from scipy.optimize import least_squares
-from numpy import finfo, float64
+from numpy import (
+    abs as np_abs,
+    diag,
+    finfo,
+    float64,
+    isfinite,
+    array,
+    maximum,
+    outer,
+    vstack,
+    where
+)
+from numpy.linalg import LinAlgError, cholesky, inv
 
 
 # FIXME: https://rstudio-pubs-static.s3.amazonaws.com/226794_fdae25636b9b484896930dba386356ae.html make sure to use proper scaling when fitting?
@@ -11,7 +23,13 @@ def run_levenberg_marquardt(
         model,
         y_obs,
         y_err,
-        parameter_bounds
+        parameter_bounds,
+        model_batch=None,
+        pool=None,
+        verbose=2,
+        return_cost=False,
+        jacobian_updates='finite difference',
+        stall_tolerance=0.01
     ):
     """run the Levenberg-Marquardt least squares algorithm on the RADEX
     model for the initial parameter estimates supplied by the global
@@ -31,16 +49,63 @@ def run_levenberg_marquardt(
         
         y_err (numpy.array): line strength uncertaintiesfrom the user
         supplied data file to be used in calculating the residuals.
+        
+        parameter_bounds (tuple): lower and upper bounds of the parameters.
+        
+        model_batch (function, optional): batched RADEX model,
+        "AlgorithmHelpers.RADEX_model_batch()", used to evaluate all
+        finite difference steps of the Jacobian at once. Defaults to None
+        (scipy's sequential 2-point Jacobian).
+        
+        pool (multiprocessing.Pool, optional): pool "model_batch"
+        distributes the Jacobian steps over. Defaults to None.
+        
+        verbose (int): verbosity of "scipy.optimize.least_squares()".
+        Defaults to 2.
+        
+        return_cost (bool): also return the final cost. Defaults to False.
+        
+        jacobian_updates (str): 'finite difference' (a new finite
+        difference Jacobian every iteration) -OR- 'broyden' (rank-one
+        Broyden updates of the last Jacobian, only refreshed by finite
+        differences when an iteration reduced the cost by less than
+        "stall_tolerance" or after ndim updates). Defaults to 'finite
+        difference'.
+        
+        stall_tolerance (float): relative cost reduction below which the
+        Broyden Jacobian is refreshed. Defaults to 0.01.
 
 
     Return:
         numpy.array: the refined parameter estimates to be subject to
-        an MCMC run.
+        an MCMC run (and the final cost if "return_cost").
     """
     
     norm = y_obs.max()
     y_obs_norm = y_obs / norm
     
+    def normalised_residuals(y_RADEX):
+        """residuals of (a batch of) SpectralRadex outputs compared with the
+        observed data from the user supplied data file.
+
+        Args:
+            y_RADEX (numpy.array): line strengths of one RADEX model, or
+            (N, n_lines) of several.
+            
+
+        Returns:
+            numpy.array: the residuals, either with the inclusion of
+            uncertainties or not.
+        """
+        
+        y_RADEX_normalised = y_RADEX / norm
+        if y_err.all() == 1:
+            return y_RADEX_normalised - y_obs_norm
+        else:
+            return (y_RADEX_normalised - y_obs_norm) / y_err
+
+        return
+
     def residuals(parameters_to_optimize):
         """a function to calculate the residuals of SpectralRadex
         output compared with the observed data from the user supplied
@@ -56,13 +121,88 @@ def run_levenberg_marquardt(
             the inclusion of uncertainties or not.
         """
         
-        y_RADEX_normalised = model(parameters_to_optimize) / norm
-        if y_err.all() == 1:
-            return y_RADEX_normalised - y_obs_norm
+        return normalised_residuals(model(parameters_to_optimize))
+
+    def jacobian(parameters_to_optimize):
+        """forward difference Jacobian of the residuals with the steps of
+        scipy's '2-point' scheme, but with all steps calculated as one
+        batch (in parallel, or vectorized by the 'numpy' solver) instead
+        of one after the other. The unperturbed model was just calculated
+        for the residuals and comes from the model cache.
+
+        Args:
+            parameters_to_optimize (numpy.array): current parameters.
+            
+
+        Returns:
+            numpy.array: (n_lines, ndim) Jacobian of the residuals.
+        """
+        
+        steps = relative_step * where(parameters_to_optimize >= 0, 1.0,
+                                      -1.0) * maximum(
+            1.0, np_abs(parameters_to_optimize)
+        )
+        # step backwards from the upper bound, like scipy.
+        steps = where(parameters_to_optimize + steps > parameter_bounds[1],
+                      -steps, steps)
+        stepped_parameters = parameters_to_optimize + diag(steps)
+        # the exactly representable steps.
+        steps = stepped_parameters.diagonal() - parameters_to_optimize
+        
+        if model_batch is None:
+            y_RADEX_batch = array([model(parameters) for parameters in
+                                   vstack([parameters_to_optimize,
+                                           stepped_parameters])])
         else:
-            return (y_RADEX_normalised - y_obs_norm) / y_err
+            y_RADEX_batch = model_batch(
+                vstack([parameters_to_optimize, stepped_parameters]), pool
+            )
+        residuals_batch = normalised_residuals(y_RADEX_batch)
+        
+        return ((residuals_batch[1:] - residuals_batch[0]) / steps[:, None]).T
 
-        return
+    # the last Jacobian and where it was evaluated, for the Broyden
+    # updates.
+    broyden = {'parameters':None, 'residuals':None, 'cost':None,
+               'jacobian':None, 'updates':0, 'refreshes':0}
+
+    def broyden_jacobian(parameters_to_optimize):
+        """rank-one (Broyden) update of the previous Jacobian with the
+        change of the residuals over the last step, a finite difference
+        Jacobian if the last step made little progress.
+
+        Args:
+            parameters_to_optimize (numpy.array): current parameters.
+            
+
+        Returns:
+            numpy.array: (n_lines, ndim) Jacobian of the residuals.
+        """
+        
+        # from the model cache, the residuals were just calculated here.
+        current_residuals = residuals(parameters_to_optimize)
+        current_cost = 0.5 * (current_residuals**2).sum()
+        
+        if (broyden['jacobian'] is None or
+                broyden['updates'] >= parameters_to_optimize.shape[0] or
+                broyden['cost'] - current_cost <
+                stall_tolerance * broyden['cost']):
+            current_jacobian = jacobian(parameters_to_optimize)
+            broyden['refreshes'] += 1
+            broyden['updates'] = 0
+        else:
+            step = parameters_to_optimize - broyden['parameters']
+            current_jacobian = broyden['jacobian'] + outer(
+                current_residuals - broyden['residuals'] -
+                broyden['jacobian'] @ step, step
+            ) / (step @ step)
+            broyden['updates'] += 1
+        
+        broyden.update(parameters=parameters_to_optimize.copy(),
+                       residuals=current_residuals, cost=current_cost,
+                       jacobian=current_jacobian)
+        
+        return current_jacobian
 
     # FIXME: I don't actually know what halve of the parameters I passed
     # here really do so start from a simpler fitting again when I know the
@@ -73,14 +213,186 @@ def run_levenberg_marquardt(
     # method='trf' seems fine though since 'lm' does not handle bounds.
     
     machine_epsilon10 = 1e4*finfo(float64).eps
+    relative_step = finfo(float64).eps**0.5
+    if jacobian_updates == 'broyden':
+        jac = broyden_jacobian
+    elif model_batch is None:
+        jac = '2-point'
+    else:
+        jac = jacobian
     ls_solution = least_squares(
-        residuals, parameter_estimates, method='trf', loss='cauchy',
+        residuals, parameter_estimates, jac=jac,
+        method='trf', loss='cauchy',
         f_scale=0.17, bounds=parameter_bounds, ftol=machine_epsilon10,
-        gtol=machine_epsilon10, xtol=machine_epsilon10, verbose=2
+        gtol=machine_epsilon10, xtol=machine_epsilon10, verbose=verbose
     )
     # ls_solution = least_squares(
     #     residuals, parameter_estimates, method='trf',
     #     bounds=parameter_bounds, verbose=2
     # )
     
+    if verbose and jacobian_updates == 'broyden':
+        ndim = len(parameter_estimates)
+        print(f"Broyden Jacobian: {broyden['refreshes']} of " +
+              f"{ls_solution.njev} Jacobians by finite differences, " +
+              f"{ls_solution.nfev + ndim * broyden['refreshes']} RADEX " +
+              "models instead of " +
+              f"{ls_solution.nfev + ndim * ls_solution.njev}.")
+    
+    if return_cost:
+        return ls_solution.x, ls_solution.cost
+    
     return ls_solution.x
+
+
+def least_squares_covariance(
+        parameters,
+        model,
+        y_obs,
+        y_err,
+        parameter_bounds,
+        model_batch=None,
+        pool=None
+    ):
+    """approximate covariance (J^T J)^-1 of the parameters at the
+    Levenberg-Marquardt optimum, with J the Jacobian of the residuals
+    (y_RADEX - y_obs) / y_err of the MCMC likelihood. The Jacobian
+    "least_squares()" returns is not used, it belongs to the normalised
+    residuals and is modified by the robust (cauchy) loss.
+
+    Args:
+        parameters (numpy.array): the refined parameter estimates.
+        
+        model (function): RADEX model calculated with SpectralRadex.
+        
+        y_obs (numpy.array): observed line strengths.
+        
+        y_err (numpy.array): observed line strength uncertainties.
+        
+        parameter_bounds (tuple): lower and upper bounds of the parameters.
+        
+        model_batch (function, optional): batched RADEX model, see
+        "run_levenberg_marquardt()". Defaults to None.
+        
+        pool (multiprocessing.Pool, optional): pool "model_batch"
+        distributes the Jacobian steps over. Defaults to None.
+
+
+    Return:
+        numpy.array: (ndim, ndim) covariance, None if J^T J is singular
+        (a parameter the lines do not constrain) or RADEX failed.
+    """
+    
+    # forward difference steps as in "run_levenberg_marquardt()".
+    steps = finfo(float64).eps**0.5 * where(parameters >= 0, 1.0, -1.0) * \
+        maximum(1.0, np_abs(parameters))
+    steps = where(parameters + steps > parameter_bounds[1], -steps, steps)
+    stepped_parameters = parameters + diag(steps)
+    steps = stepped_parameters.diagonal() - parameters
+    
+    if model_batch is None:
+        y_RADEX_batch = array([model(parameters_to_model) for parameters_to_model
+                               in vstack([parameters, stepped_parameters])])
+    else:
+        y_RADEX_batch = model_batch(vstack([parameters, stepped_parameters]),
+                                    pool)
+    residuals_batch = (y_RADEX_batch - y_obs) / y_err
+    jacobian = ((residuals_batch[1:] - residuals_batch[0]) / steps[:, None]).T
+    
+    try:
+        covariance = inv(jacobian.T @ jacobian)
+        # positive definite.
+        cholesky(covariance)
+    except LinAlgError:
+        return None
+    if not isfinite(covariance).all():
+        return None
+    
+    return covariance
+
+
+def levenberg_marquardt_task(arguments):
+    """a single (silent) Levenberg-Marquardt run of a multi-start, as a
+    pool task.
+
+    Args:
+        arguments (tuple): the positional arguments of
+        "run_levenberg_marquardt()" up to "model_batch", followed by
+        "jacobian_updates".
+        
+
+    Returns:
+        tuple: the refined parameter estimates and the final cost.
+    """
+    
+    *arguments, jacobian_updates = arguments
+    
+    return run_levenberg_marquardt(*arguments, verbose=0, return_cost=True,
+                                   jacobian_updates=jacobian_updates)
+
+
+def run_multistart_levenberg_marquardt(
+        parameter_estimates_2d,
+        model,
+        y_obs,
+        y_err,
+        parameter_bounds,
+        model_batch=None,
+        pool=None,
+        distinct_tolerance=0.01,
+        jacobian_updates='finite difference'
+    ):
+    """run the Levenberg-Marquardt least squares algorithm from several
+    initial parameter estimates (e.g. the best well-separated grid points
+    of the global search) at once, one start per pool worker, to not get
+    stuck in the local minimum nearest to a single start.
+
+    Args:
+        parameter_estimates_2d (numpy.array): (k, ndim) parameter
+        estimates obtained via the global search algorithm.
+        
+        model (function): RADEX model calculated with SpectralRadex.
+        
+        y_obs (numpy.array): observed line strengths, see
+        "run_levenberg_marquardt()".
+        
+        y_err (numpy.array): observed line strength uncertainties.
+        
+        parameter_bounds (tuple): lower and upper bounds of the parameters.
+        
+        model_batch (function, optional): batched RADEX model for the
+        Jacobian of every start, see "run_levenberg_marquardt()". Defaults
+        to None.
+        
+        pool (multiprocessing.Pool, optional): pool the starts are
+        distributed over. Defaults to None (one after the other).
+        
+        distinct_tolerance (float): solutions that differ less than this
+        in every log10(parameter) are the same local minimum. Defaults to
+        0.01.
+        
+        jacobian_updates (str): see "run_levenberg_marquardt()". Defaults
+        to 'finite difference'.
+
+
+    Return:
+        numpy.array, list[tuple]: the refined parameter estimates with the
+        lowest cost and all distinct local minima found as (parameter
+        estimates, cost), the lowest cost first.
+    """
+    
+    tasks = [(parameter_estimates, model, y_obs, y_err, parameter_bounds,
+              model_batch, jacobian_updates)
+             for parameter_estimates in parameter_estimates_2d]
+    if pool is None:
+        solutions = list(map(levenberg_marquardt_task, tasks))
+    else:
+        solutions = pool.map(levenberg_marquardt_task, tasks)
+    
+    local_minima = []
+    for solution, cost in sorted(solutions, key=lambda solution: solution[1]):
+        if all(np_abs(solution - other).max() > distinct_tolerance
+               for other, _ in local_minima):
+            local_minima += [(solution, cost)]
+    
+    return local_minima[0][0], local_minima
@@ -8,8 +8,18 @@ from emcee.moves import (
 )
 from emcee import EnsembleSampler
 from multiprocessing import Pool, cpu_count
+from numpy import abs as np_abs, clip, eye, inf, std
+from numpy.linalg import LinAlgError, cholesky
 from numpy.random import randn
 
+# relative imports
+from .chain_backend import ChainBackend
+from .delayed_acceptance import (
+    DelayedAcceptanceDESnookerMove,
+    DelayedAcceptanceStretchMove,
+    DelayedAcceptanceDEMove,
+)
+
 
 # required/suggested by emcee when using automatic parallelization done by
 # numpy using MKL linear algebra for instance to disable it and let
@@ -19,6 +29,176 @@ import os
 os.environ["OMP_NUM_THREADS"] = "1"
 
 
+def initial_walker_positions(initial_parameters, number_of_walkers,
+                             covariance=None, bounds=None, max_redraws=100):
+    """initial walker positions around the best parameter estimates, drawn
+    from the Gaussian approximation of the posterior with the covariance of
+    the Levenberg-Marquardt optimum (see "least_squares_covariance()"), so
+    the ensemble starts about as wide as the posterior. A fixed Gaussian
+    "ball" of width 1e-3 if there is no (positive definite) covariance.
+    Walkers outside the bounds are redrawn, the ones still outside after
+    "max_redraws" draws are clipped to the bounds.
+
+    Args:
+        initial_parameters (nd.array): best parameter estimates.
+
+        number_of_walkers (int): number of walkers.
+
+        covariance (nd.array, optional): (ndim, ndim) covariance of the
+        parameters. Defaults to None (the fixed ball).
+
+        bounds (tuple, optional): lower and upper bounds of the parameters
+        (the prior). Defaults to None.
+
+        max_redraws (int): see above. Defaults to 100.
+
+
+    Returns:
+        nd.array: (number_of_walkers, ndim) walker positions.
+    """
+
+    ndim = initial_parameters.shape[0]
+    # (ndim, ndim) matrix that maps standard normal draws on the Gaussian.
+    scale = None
+    if covariance is not None:
+        try:
+            scale = cholesky(covariance).T
+        except LinAlgError:
+            pass
+    if scale is None:
+        print("No covariance of the parameters, initializing the walkers " +
+              "in a fixed Gaussian ball.")
+        scale = 1e-3 * eye(ndim)
+
+    pos = initial_parameters + randn(number_of_walkers, ndim) @ scale
+    if bounds is None:
+        return pos
+
+    for _ in range(max_redraws):
+        outside = ((pos < bounds[0]) | (pos > bounds[1])).any(axis=1)
+        if not outside.any():
+            break
+        pos[outside] = initial_parameters + \
+            randn(outside.sum(), ndim) @ scale
+
+    return clip(pos, bounds[0], bounds[1])
+
+
+def burn_in(sampler, initial_state, max_steps, block_steps=25,
+            tolerance=0.25):
+    """run the burn-in until the log probabilities of the walkers are
+    stationary: the mean log probability of the last block of
+    "block_steps" steps differs less than "tolerance" times their standard
+    deviation from the mean of the block before, or "max_steps" steps were
+    taken. The burn-in is stored in the chain, the number of steps to
+    discard is returned instead.
+
+    Args:
+        sampler (emcee.EnsembleSampler): the sampler, empty or with the
+        first steps of an interrupted burn-in.
+
+        initial_state (nd.array or emcee.State): walker positions to start
+        from.
+
+        max_steps (int): maximum number of burn-in steps.
+
+        block_steps (int): number of steps per block. Defaults to 25.
+
+        tolerance (float): see above. Defaults to 0.25.
+
+
+    Returns:
+        emcee.State, int: state of the walkers at the end of the burn-in
+        and number of steps to discard, the two stationary blocks are kept.
+    """
+
+    state = initial_state
+    previous_mean = None
+    block_end = 0
+    while block_end < max_steps:
+        block_end = min(block_end + block_steps, max_steps)
+        # the blocks completed before an interruption (resumed) are only
+        # checked again, so the burn-in ends where it would have.
+        if sampler.iteration < block_end:
+            state = sampler.run_mcmc(state, block_end - sampler.iteration,
+                                     progress=True)
+        log_probabilities = sampler.get_log_prob()[
+            max(block_end - block_steps, 0):block_end
+        ]
+        block_mean = log_probabilities.mean()
+        if (previous_mean is not None and
+                abs(block_mean - previous_mean) <
+                tolerance * std(log_probabilities)):
+            return state, block_end - 2 * block_steps
+        previous_mean = block_mean
+
+    print(f"WARNING: the log probabilities are not stationary after the " +
+          f"maximum of {max_steps} burn-in steps.")
+
+    return state, sampler.iteration
+
+
+def sample_until_converged(sampler, initial_state, max_steps,
+                           check_interval=100, autocorrelation_multiple=50,
+                           autocorrelation_tolerance=0.01, discard=0):
+    """run the sampler until the chain is converged according to its
+    integrated autocorrelation time tau, see
+    https://emcee.readthedocs.io/en/stable/tutorials/monitor/. Every
+    "check_interval" steps tau is estimated, the chain is converged once it
+    is longer than "autocorrelation_multiple" * tau and tau changed by less
+    than "autocorrelation_tolerance" (relative) since the last estimate,
+    for every parameter. So at least 2 * "check_interval" steps are taken.
+
+    Args:
+        sampler (emcee.EnsembleSampler): the sampler.
+
+        initial_state (nd.array or emcee.State): walker positions to start
+        from.
+
+        max_steps (int): maximum number of steps, also when not converged.
+
+        check_interval (int): number of steps between the estimates of tau.
+        Defaults to 100.
+
+        autocorrelation_multiple (float): required chain length in units of
+        tau. Defaults to 50.
+
+        autocorrelation_tolerance (float): required relative stability of
+        tau. Defaults to 0.01.
+
+        discard (int): number of burn-in steps at the start of the chain,
+        not counted. Defaults to 0.
+
+
+    Returns:
+        bool, nd.array: whether the chain converged and the last estimate
+        of tau of every parameter.
+    """
+
+    previous_tau = inf
+    tau = None
+    for _ in sampler.sample(initial_state, iterations=max_steps,
+                            progress=True):
+        chain_length = sampler.iteration - discard
+        if chain_length % check_interval:
+            continue
+
+        # tol=0: the estimate is wanted even when the chain is still too
+        # short for a reliable one.
+        tau = sampler.get_autocorr_time(discard=discard, tol=0)
+        converged = ((chain_length > autocorrelation_multiple * tau) &
+                     (np_abs(previous_tau - tau) <
+                      autocorrelation_tolerance * tau)).all()
+        previous_tau = tau
+        if converged:
+            return True, tau
+
+    if tau is None or (sampler.iteration - discard) % check_interval:
+        tau = sampler.get_autocorr_time(discard=discard, tol=0)
+
+    return False, tau
+
+
 # FIXME: set walkers as multiple of cpu_count()?
 def run_monte_carlo(initial_parameters,
                     log_probability_function,
@@ -26,7 +206,17 @@ def run_monte_carlo(initial_parameters,
                     number_of_steps=500,
                     number_of_burnin_steps=100,
                     number_of_walker_steps=500,
-                    core_count=cpu_count()):
+                    core_count=cpu_count(),
+                    surrogate_log_probability=None,
+                    pool=None,
+                    vectorize=False,
+                    convergence_check_interval=None,
+                    autocorrelation_multiple=50,
+                    autocorrelation_tolerance=0.01,
+                    burn_in_block=25,
+                    initial_covariance=None,
+                    parameter_bounds=None,
+                    backend=None):
     """
     Args:
         initial_parameters (nd.array): initial parameters obtained by prior
@@ -38,53 +228,201 @@ def run_monte_carlo(initial_parameters,
         
         number_of_steps (int): number of steps. Defaults to 500.
         
-        number_of_burnin_steps (int): number of burnin steps. Defaults to 100.
+        number_of_burnin_steps (int): number of burnin steps, the maximum
+        number with an adaptive burn-in. Defaults to 100.
         
         number_of_walker_steps (int): number of walker steps. Defaults to 200.
         
-        core_count (int): number of processors. Defaults to cpu_count().
+        core_count (int): number of processors, 1 runs the chain in this
+        process without a pool (e.g. for a cheap emulated likelihood).
+        Defaults to cpu_count().
+        
+        surrogate_log_probability (function, optional): cheap vectorized
+        approximation of the posterior (e.g. "EmulatedLogProbability"). If
+        given, proposals are screened with it first and only the survivors
+        are evaluated with "log_probability_function" (delayed acceptance).
+        Defaults to None.
+        
+        pool (multiprocessing.Pool, optional): pool (e.g. of a shared
+        "WorkerPool") the walkers are evaluated on regardless of
+        "core_count", it is left running. Defaults to None (a pool of
+        "core_count" processes for the MCMC only).
+        
+        vectorize (bool): "log_probability_function" takes the whole
+        (nwalkers, ndim) ensemble at once (e.g.
+        "AlgorithmHelpers.log_probability_batch()") and distributes it
+        itself, emcee's "vectorize=True". No pool is used by emcee then.
+        Defaults to False.
+        
+        convergence_check_interval (int, optional): if set, the chain runs
+        until it is converged according to its autocorrelation time (see
+        "sample_until_converged()", checked every this many steps) and
+        "number_of_walker_steps" is the maximum number of steps. Defaults
+        to None (always "number_of_walker_steps" steps).
+        
+        autocorrelation_multiple (float): see "sample_until_converged()".
+        Defaults to 50.
+        
+        autocorrelation_tolerance (float): see "sample_until_converged()".
+        Defaults to 0.01.
+        
+        burn_in_block (int, optional): the burn-in ends once the log
+        probabilities are stationary, checked every this many steps, see
+        "burn_in()". Defaults to 25 (None: always "number_of_burnin_steps"
+        steps).
+        
+        initial_covariance (nd.array, optional): (ndim, ndim) covariance of
+        the parameters at the best initial parameters (e.g.
+        "least_squares_covariance()"), the walkers start from this Gaussian
+        approximation of the posterior. Defaults to None (a fixed Gaussian
+        ball of width 1e-3), also used if it is not positive definite.
+        
+        parameter_bounds (tuple, optional): lower and upper bounds of the
+        parameters (the prior), the initial walkers are kept within.
+        Defaults to None.
+        
+        backend (ChainBackend, optional): on-disk backend every step is
+        appended to, the initial parameters and covariance are stored in
+        its attributes. If it holds an interrupted chain, the run resumes
+        after its last completed step (in the burn-in or the production)
+        with the random state restored, the initial walker positions are
+        not used then. Defaults to None (the chain is kept in memory).
         
 
     Returns:
-        EnsambleSampler, int: emcee sampler object and number of parameters.
+        EnsambleSampler, int, int: emcee sampler object, number of
+        parameters and number of burn-in steps at the start of the chain
+        every consumer of the chain has to discard.
     """
 
-    # Initialize the walkers in a Gaussian "ball" around the best initial
-    # parameter estimates found by prior algorithms in the chain.
-    pos = initial_parameters + 1e-3 * randn(number_of_walkers,
-                                            initial_parameters.shape[0])
+    # Initialize the walkers in a Gaussian around the best initial parameter
+    # estimates found by prior algorithms in the chain.
+    pos = initial_walker_positions(initial_parameters, number_of_walkers,
+                                   initial_covariance, parameter_bounds)
     nwalkers, ndim = pos.shape
 
     # run the MCMC algorithm.
-    with Pool(processes=core_count) as pool:
+    own_pool = pool is None and core_count > 1 and not vectorize
+    if own_pool:
+        pool = Pool(processes=core_count)
+    elif vectorize:
+        pool = None
+    try:
         # FIXME: figure out the best set of moves for all molecules?
+        if surrogate_log_probability is None:
+            moves = [(StretchMove(a=3), 0.7),
+                     (DEMove(), 0.2),
+                     (DESnookerMove(), 0.1),]
+        else:
+            moves = [
+                (DelayedAcceptanceStretchMove(surrogate_log_probability,
+                                              a=3), 0.7),
+                (DelayedAcceptanceDEMove(surrogate_log_probability), 0.2),
+                (DelayedAcceptanceDESnookerMove(surrogate_log_probability),
+                 0.1),
+            ]
         sampler = EnsembleSampler(
             nwalkers, ndim, log_probability_function, pool=pool,
-            moves=[(StretchMove(a=3), 0.7),
-                   (DEMove(), 0.2),
-                   (DESnookerMove(), 0.1),]
+            moves=[(move, weight) for move, weight in moves],
+            vectorize=vectorize, backend=backend
         )
         
         # sampler.run_mcmc(pos, number_of_steps, progress=True)
         
-        print(f"Burning in chain for {number_of_burnin_steps} steps")
-        sampler.run_mcmc(pos, number_of_burnin_steps, store=False,
-                         progress=True)
-        sampler.reset()
-        print(f"running {number_of_walker_steps} steps to determine parameter" +
-              " uncertianties and correlations.")
-        sampler.run_mcmc(pos, number_of_walker_steps, progress=True)
+        # where the burn-in ended and if the production finished, of the
+        # interrupted run if resumed.
+        attributes = (backend.attributes
+                      if isinstance(backend, ChainBackend) else {})
+        # the starting point of the chain, so a resumed run does not have
+        # to find it again.
+        if (isinstance(backend, ChainBackend) and
+                'initial_parameters' not in attributes):
+            backend.update_attributes(
+                initial_parameters=[float(value)
+                                    for value in initial_parameters],
+                initial_covariance=(None if initial_covariance is None
+                                    else initial_covariance.tolist())
+            )
+        if sampler.iteration > 0:
+            print(f"Resuming the chain after {sampler.iteration} completed " +
+                  "steps.")
+            state = sampler.get_last_sample()
+        else:
+            state = pos
         
-        # TODO: check for chain convergence, https://emcee.readthedocs.io/en/stable/tutorials/autocorr/#autocorr
-        # It should already be at the optimal parameters, estimated from the
-        # prior algorithms, so it should already be converged?
+        # the burn-in stays in the chain, the production continues from the
+        # state it ended in.
+        if 'discard' in attributes:
+            discard = attributes['discard']
+            burn_in_steps = attributes['burn_in_steps']
+        elif burn_in_block is None:
+            print(f"Burning in chain for {number_of_burnin_steps} steps")
+            if number_of_burnin_steps > sampler.iteration:
+                state = sampler.run_mcmc(
+                    state, number_of_burnin_steps - sampler.iteration,
+                    progress=True
+                )
+            discard = number_of_burnin_steps
+            burn_in_steps = sampler.iteration
+        else:
+            print("Burning in chain until the log probabilities are " +
+                  f"stationary (at most {number_of_burnin_steps} steps)")
+            state, discard = burn_in(sampler, state, number_of_burnin_steps,
+                                     burn_in_block)
+            burn_in_steps = sampler.iteration
+            print(f"Burn-in: discarding the first {discard} of " +
+                  f"{sampler.iteration} steps.")
+        if isinstance(backend, ChainBackend):
+            backend.update_attributes(discard=discard,
+                                      burn_in_steps=burn_in_steps)
+        # production steps still to take.
+        remaining_steps = number_of_walker_steps - (sampler.iteration -
+                                                    burn_in_steps)
         
-        # FIXME: separate burnin and uncertainty sampling?
-        # # calculate burnin chain.
-        # idk = sampler.run_mcmc(pos, number_of_burnin_steps, progress=True)
-
-        # # calculate walker (uncertainties?) chain.
-        # sampler.run_mcmc(idk[???], number_of_walker_steps, progress=True)
+        if attributes.get('completed', False):
+            print("The chain was already completed.")
+        elif convergence_check_interval is None:
+            print(f"running {remaining_steps} steps to determine " +
+                  "parameter uncertianties and correlations.")
+            if remaining_steps > 0:
+                sampler.run_mcmc(state, remaining_steps, progress=True)
+        else:
+            print("running until converged (at most " +
+                  f"{remaining_steps} steps) to determine parameter" +
+                  " uncertianties and correlations.")
+            converged, tau = sample_until_converged(
+                sampler, state, remaining_steps,
+                convergence_check_interval, autocorrelation_multiple,
+                autocorrelation_tolerance, discard
+            )
+            tau_string = ", ".join(f"{tau_i:.1f}" for tau_i in tau)
+            if converged:
+                print("Chain converged after " +
+                      f"{sampler.iteration - discard} steps, " +
+                      f"autocorrelation times: {tau_string}.")
+            else:
+                print(f"WARNING: chain not converged after " +
+                      f"{sampler.iteration - discard} steps (needs more than " +
+                      f"{autocorrelation_multiple} autocorrelation times " +
+                      f"that changed less than {autocorrelation_tolerance:.0%}" +
+                      f"), autocorrelation times: {tau_string}. The " +
+                      "uncertainty estimates may be unreliable.")
+        if isinstance(backend, ChainBackend):
+            backend.update_attributes(completed=True)
+        
+        if surrogate_log_probability is not None:
+            number_of_proposals = sum(move.number_of_proposals
+                                      for move, _ in moves)
+            number_of_exact = sum(move.number_of_exact for move, _ in moves)
+            number_of_accepted = sum(move.number_of_accepted
+                                     for move, _ in moves)
+            print(f"delayed acceptance: {number_of_exact} of " +
+                  f"{number_of_proposals} proposals evaluated with RADEX, " +
+                  f"{number_of_accepted} accepted.")
+        
+    finally:
+        if own_pool:
+            pool.terminate()
     
-    return sampler, ndim
+    return sampler, ndim, discard
 
@@ -1,5 +1,14 @@
 from .find_initial_guess import *
 from .fitting_helper_functions import *
-from .global_search import *
+from .chain_backend import *
+from .emulator import *
+from .escape_probability import *
+from .grid_library import *
+from .delayed_acceptance import *
 from .LM import *
 from .MCMC import *
+from .model_cache import *
+from .model_store import *
+from .particle_swarm import *
+from .warm_start import *
+from .worker_pool import *
\ No newline at end of file
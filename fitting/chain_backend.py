@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+# module imports
+from pathlib import Path
+import json
+import os
+import pickle
+
+from emcee.backends import Backend
+from numpy import float64, memmap, zeros
+
+
+class ChainBackend(Backend):
+    def __init__(self, directory):
+        """emcee backend that appends every step of the chain to binary
+        files on disk while the sampler runs, instead of keeping the whole
+        chain in memory until it is saved at the end. A killed run (OOM,
+        preemption, Ctrl-C) is resumed from the last completed step with
+        the random state of the sampler restored, by creating a new
+        EnsembleSampler with a ChainBackend of the same directory. The
+        chain is read back through memory maps, so memory stays bounded for
+        very long chains.
+
+        Files in the directory:
+            chain.bin: (iteration, nwalkers, ndim) walker positions.
+            log_prob.bin: (iteration, nwalkers) log probabilities.
+            checkpoint.pkl: number of completed steps, accepted proposals
+            per walker and random state of the sampler after the last one.
+            description.json: shape of the ensemble and the attributes of
+            the run (e.g. the burn-in steps, see "update_attributes()").
+
+        Args:
+            directory (str): directory of the chain, created if needed. An
+            existing chain in it is loaded.
+
+
+        Returns:
+            None
+        """
+
+        super().__init__(dtype=float64)
+        self.path = Path(directory)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.chain_path = self.path / 'chain.bin'
+        self.log_prob_path = self.path / 'log_prob.bin'
+        self.checkpoint_path = self.path / 'checkpoint.pkl'
+        self.description_path = self.path / 'description.json'
+        self.attributes = {}
+        self.blobs = None
+
+        if self.checkpoint_path.exists():
+            description = json.loads(self.description_path.read_text())
+            self.nwalkers = description['nwalkers']
+            self.ndim = description['ndim']
+            self.attributes = description['attributes']
+            with open(self.checkpoint_path, 'rb') as checkpoint_file:
+                checkpoint = pickle.load(checkpoint_file)
+            self.iteration = checkpoint['iteration']
+            self.accepted = checkpoint['accepted']
+            self.random_state = checkpoint['random_state']
+            # a step the run was killed in the middle of is not part of the
+            # chain.
+            self.truncate()
+            self.initialized = True
+
+        return
+
+
+    def reset(self, nwalkers, ndim):
+        """start a new (empty) chain in the directory, called by the
+        EnsembleSampler of a new run.
+
+        Args:
+            nwalkers (int): number of walkers.
+
+            ndim (int): number of parameters.
+
+
+        Returns:
+            None
+        """
+
+        self.nwalkers = int(nwalkers)
+        self.ndim = int(ndim)
+        self.iteration = 0
+        self.accepted = zeros(self.nwalkers, dtype=self.dtype)
+        self.random_state = None
+        self.attributes = {}
+        self.truncate()
+        self.write_description()
+        self.write_checkpoint()
+        self.initialized = True
+
+        return
+
+
+    def truncate(self):
+        """cut the chain files to the completed steps.
+
+        Returns:
+            None
+        """
+
+        for path, step_size in [(self.chain_path, self.nwalkers * self.ndim),
+                                (self.log_prob_path, self.nwalkers)]:
+            with open(path, 'ab') as chain_file:
+                chain_file.truncate(self.iteration * step_size *
+                                    self.dtype().itemsize)
+
+        return
+
+
+    def write_description(self):
+        """write the shape of the ensemble and the attributes of the run.
+
+        Returns:
+            None
+        """
+
+        temporary_path = self.description_path.with_suffix('.tmp')
+        temporary_path.write_text(json.dumps(
+            {'nwalkers':self.nwalkers, 'ndim':self.ndim,
+             'attributes':self.attributes}, indent=4
+        ))
+        os.replace(temporary_path, self.description_path)
+
+        return
+
+
+    def write_checkpoint(self):
+        """write the number of completed steps, the accepted proposals and
+        the random state. Replaces the previous checkpoint at once, so it
+        always belongs to completely written steps.
+
+        Returns:
+            None
+        """
+
+        temporary_path = self.checkpoint_path.with_suffix('.tmp')
+        with open(temporary_path, 'wb') as checkpoint_file:
+            pickle.dump({'iteration':self.iteration,
+                         'accepted':self.accepted,
+                         'random_state':self.random_state}, checkpoint_file)
+        os.replace(temporary_path, self.checkpoint_path)
+
+        return
+
+
+    def update_attributes(self, **attributes):
+        """store attributes of the run with the chain (e.g. where the
+        burn-in ended), so a resumed run continues in the right stage.
+
+        Args:
+            **attributes: JSON serializable attributes.
+
+
+        Returns:
+            None
+        """
+
+        self.attributes.update(attributes)
+        self.write_description()
+
+        return
+
+
+    @property
+    def chain(self):
+        """(iteration, nwalkers, ndim) memory map of the walker positions."""
+        if self.iteration == 0:
+            return zeros((0, self.nwalkers, self.ndim), dtype=self.dtype)
+        return memmap(self.chain_path, dtype=self.dtype, mode='r',
+                      shape=(self.iteration, self.nwalkers, self.ndim))
+
+
+    @property
+    def log_prob(self):
+        """(iteration, nwalkers) memory map of the log probabilities."""
+        if self.iteration == 0:
+            return zeros((0, self.nwalkers), dtype=self.dtype)
+        return memmap(self.log_prob_path, dtype=self.dtype, mode='r',
+                      shape=(self.iteration, self.nwalkers))
+
+
+    def grow(self, ngrow, blobs):
+        """nothing to allocate, the steps are appended to the files.
+
+        Args:
+            ngrow (int): number of steps the sampler is about to take.
+
+            blobs: blobs of the log probability function, not supported.
+
+
+        Returns:
+            None
+        """
+
+        if blobs is not None:
+            raise ValueError("The ChainBackend does not store blobs.")
+
+        return
+
+
+    def save_step(self, state, accepted):
+        """append a step to the chain files, then checkpoint it.
+
+        Args:
+            state (emcee.State): state of the ensemble after the step.
+
+            accepted (nd.array): whether the proposal of every walker was
+            accepted.
+
+
+        Returns:
+            None
+        """
+
+        self._check(state, accepted)
+
+        with open(self.chain_path, 'ab') as chain_file:
+            chain_file.write(state.coords.astype(self.dtype).tobytes())
+        with open(self.log_prob_path, 'ab') as log_prob_file:
+            log_prob_file.write(state.log_prob.astype(self.dtype).tobytes())
+        self.accepted = self.accepted + accepted
+        self.random_state = state.random_state
+        self.iteration += 1
+        self.write_checkpoint()
+
+        return
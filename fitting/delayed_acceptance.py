@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# module imports
+from emcee.moves import DEMove, DESnookerMove, StretchMove
+from emcee.state import State
+from numpy import arange, full, inf, isfinite, log, where, zeros
+
+
+class DelayedAcceptance:
+    def __init__(self, surrogate_log_probability, *args, **kwargs):
+        """two-stage (delayed) acceptance for emcee's red-blue moves,
+        Christen & Fox (2005). Proposals are first accepted or rejected
+        with a cheap surrogate of the posterior (e.g. the RADEX emulator),
+        including the move's own proposal factor. Only the survivors are
+        evaluated with the exact posterior and accepted with probability
+        min(1, [p(q) p*(x)] / [p(x) p*(q)]), which corrects for the
+        surrogate so the exact posterior is preserved.
+
+        To be combined with a "RedBlueMove" subclass, see
+        "DelayedAcceptanceStretchMove" etc. below.
+
+        Args:
+            surrogate_log_probability (function): cheap approximation of the
+            log posterior, called with an (N, ndim) array and returning
+            (N,) log probabilities.
+
+            *args, **kwargs: passed on to the red-blue move.
+
+
+        Returns:
+            None
+        """
+
+        self.surrogate_log_probability = surrogate_log_probability
+        self.number_of_proposals       = 0
+        self.number_of_exact           = 0
+        self.number_of_accepted        = 0
+        super().__init__(*args, **kwargs)
+
+        return
+
+
+    def propose(self, model, state):
+        """"RedBlueMove.propose()" with the surrogate screening stage
+        before the exact log probabilities are computed.
+
+        Args:
+            model (emcee.model.Model): sampler model, supplies the exact
+            log probability function and the random number generator.
+
+            state (emcee.State): current state of the walkers.
+
+
+        Returns:
+            emcee.State, nd.array: the new state and which walkers accepted
+            their proposal.
+        """
+
+        nwalkers, ndim = state.coords.shape
+        if nwalkers < 2 * ndim and not self.live_dangerously:
+            raise RuntimeError("It is unadvisable to use a red-blue move " +
+                               "with fewer walkers than twice the number " +
+                               "of dimensions.")
+
+        self.setup(state.coords)
+
+        # split the ensemble in half and iterate over these two halves.
+        accepted = zeros(nwalkers, dtype=bool)
+        all_inds = arange(nwalkers)
+        inds = all_inds % self.nsplits
+        if self.randomize_split:
+            model.random.shuffle(inds)
+        for split in range(self.nsplits):
+            S1 = inds == split
+
+            sets = [state.coords[inds == j] for j in range(self.nsplits)]
+            s = sets[split]
+            c = sets[:split] + sets[split + 1:]
+
+            q, factors = self.get_proposal(s, c, model.random)
+
+            # first stage: screen the proposals with the surrogate. Walkers
+            # where the surrogate itself is not finite (e.g. next to a
+            # failed emulator grid model) could never pass it, they skip
+            # the screening and are accepted with the exact Metropolis
+            # ratio instead.
+            surrogate_current  = self.surrogate_log_probability(s)
+            surrogate_proposed = self.surrogate_log_probability(q)
+            unscreened = ~isfinite(surrogate_current)
+            surrogate_diff = zeros(len(q))
+            surrogate_diff[~unscreened] = (surrogate_proposed[~unscreened] -
+                                           surrogate_current[~unscreened])
+            screened = unscreened | (
+                isfinite(surrogate_proposed) &
+                (factors + surrogate_diff > log(model.random.rand(len(q))))
+            )
+
+            # the rejected proposals keep an exact log probability of -inf.
+            surrogate_diff[~screened] = 0.0
+
+            # second stage: exact log probabilities of the survivors only.
+            new_log_probs = full(len(q), -inf)
+            if screened.any():
+                new_log_probs[screened], _ = model.compute_log_prob_fn(
+                    q[screened]
+                )
+            exact_diff = new_log_probs - state.log_prob[S1]
+            accepted[all_inds[S1]] = screened & (
+                exact_diff - surrogate_diff + where(unscreened, factors, 0) >
+                log(model.random.rand(len(q)))
+            )
+
+            self.number_of_proposals += len(q)
+            self.number_of_exact     += int(screened.sum())
+            self.number_of_accepted  += int(accepted[S1].sum())
+
+            new_state = State(q, log_prob=new_log_probs)
+            state = self.update(state, new_state, accepted, S1)
+
+        return state, accepted
+
+
+class DelayedAcceptanceStretchMove(DelayedAcceptance, StretchMove):
+    """"StretchMove" with delayed acceptance, see "DelayedAcceptance"."""
+
+
+class DelayedAcceptanceDEMove(DelayedAcceptance, DEMove):
+    """"DEMove" with delayed acceptance, see "DelayedAcceptance"."""
+
+
+class DelayedAcceptanceDESnookerMove(DelayedAcceptance, DESnookerMove):
+    """"DESnookerMove" with delayed acceptance, see "DelayedAcceptance"."""
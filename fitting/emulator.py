@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+
+# module imports
+from contextlib import nullcontext
+from hashlib import sha1
+from pathlib import Path
+import json
+
+from multiprocessing import Pool, cpu_count
+from numpy import (
+    abs as np_abs,
+    array,
+    atleast_2d,
+    inf,
+    isfinite,
+    linspace,
+    load,
+    log10,
+    meshgrid,
+    median,
+    nan,
+    percentile,
+    savez,
+    where
+)
+from numpy.random import default_rng
+from scipy.interpolate import RegularGridInterpolator
+
+# relative imports
+from .model_store import molfile_hash
+
+
+class RADEXEmulator:
+    def __init__(self, grid_axes, line_strengths):
+        """interpolating emulator of RADEX, built from a regular grid of
+        models in log10(fit parameters) space. Lines that are positive on
+        the whole grid are interpolated in log10(line strength), the others
+        (e.g. masing or absorption lines) linearly. Models RADEX failed to
+        calculate are NaN on the grid, the emulated line strengths of every
+        point whose grid cell has such a node are NaN as well.
+
+        Args:
+            grid_axes (list[nd.array]): log10 grid points of every fit
+            parameter.
+
+            line_strengths (nd.array): (*grid shape, n_lines_total) RADEX
+            line strengths of all lines on the grid (NaN for failed
+            models).
+
+
+        Returns:
+            None
+        """
+
+        self.grid_axes      = [array(axis, dtype=float) for axis in grid_axes]
+        self.line_strengths = line_strengths
+        # the failed models do not decide whether a line is positive.
+        self.positive_lines = (
+            (line_strengths > 0) | ~isfinite(line_strengths)
+        ).reshape(-1, line_strengths.shape[-1]).all(axis=0)
+
+        interpolated_values = line_strengths.copy()
+        interpolated_values[..., self.positive_lines] = log10(
+            line_strengths[..., self.positive_lines]
+        )
+        self.interpolator = RegularGridInterpolator(
+            self.grid_axes, interpolated_values, method='linear',
+            bounds_error=False, fill_value=None
+        )
+
+        return
+
+
+    def line_strengths_batch(self, fit_parameters_values_2d):
+        """emulated line strengths of all lines.
+
+        Args:
+            fit_parameters_values_2d (nd.array): (N, ndim) log10 values of
+            the fit parameters.
+
+
+        Returns:
+            nd.array: (N, n_lines_total) emulated line strengths, NaN next
+            to a failed grid model.
+        """
+
+        interpolated = self.interpolator(fit_parameters_values_2d)
+        interpolated[..., self.positive_lines] = 10.0**interpolated[
+            ..., self.positive_lines
+        ]
+
+        return interpolated
+
+
+    def save(self, emulator_file):
+        """save the emulator grid (".npz").
+
+        Args:
+            emulator_file (str): file location of the emulator grid.
+
+
+        Returns:
+            None
+        """
+
+        Path(emulator_file).parent.mkdir(parents=True, exist_ok=True)
+        savez(emulator_file, *self.grid_axes,
+              line_strengths=self.line_strengths)
+
+        return
+
+
+    @classmethod
+    def load(cls, emulator_file):
+        """load an emulator grid saved with "save()".
+
+        Args:
+            emulator_file (str): file location of the emulator grid.
+
+
+        Returns:
+            RADEXEmulator: the emulator.
+        """
+
+        with load(emulator_file) as emulator_grid:
+            grid_axes = [emulator_grid[f'arr_{i}']
+                         for i in range(len(emulator_grid.files) - 1)]
+            return cls(grid_axes, emulator_grid['line_strengths'])
+
+
+class EmulatedLogProbability:
+    def __init__(self, alg_help, emulator):
+        """vectorized log posterior with the RADEX emulator in place of
+        exact RADEX models, e.g. the cheap surrogate of the delayed
+        acceptance MCMC moves.
+
+        Args:
+            alg_help (AlgorithmHelpers): fitting constants.
+
+            emulator (RADEXEmulator): the emulator.
+
+
+        Returns:
+            None
+        """
+
+        self.alg_help = alg_help
+        self.emulator = emulator
+
+        return
+
+
+    def __call__(self, fit_parameters_values_2d):
+        """emulated logarithm of the probability distribution.
+
+        Args:
+            fit_parameters_values_2d (nd.array): (N, ndim) log10 values of
+            the fit parameters.
+
+
+        Returns:
+            nd.array: (N,) emulated log probabilities, "-inf" next to a
+            failed grid model.
+        """
+
+        fit_parameters_values_2d = atleast_2d(fit_parameters_values_2d)
+        log_probability = self.alg_help.log_prior_batch(
+            fit_parameters_values_2d
+        )
+        within_limits = isfinite(log_probability)
+        if within_limits.any():
+            y_emulated = self.emulator.line_strengths_batch(
+                fit_parameters_values_2d[within_limits]
+            )[:, self.alg_help.matching_lines]
+            log_likelihood = self.alg_help.log_likelihood_batch(y_emulated)
+            log_probability[within_limits] += where(isfinite(log_likelihood),
+                                                    log_likelihood, -inf)
+
+        return log_probability
+
+
+def emulator_file_name(alg_help, points_per_dimension):
+    """name of the saved emulator grid, a hash of everything the grid
+    depends on: the molfile contents, constant parameters, units, fit
+    parameters, their bounds and the grid resolution.
+
+    Args:
+        alg_help (AlgorithmHelpers): fitting constants.
+
+        points_per_dimension (int): number of grid points per parameter.
+
+
+    Returns:
+        str: file name of the emulator grid.
+    """
+
+    description = {
+        'molfile_sha1':molfile_hash(alg_help.parameters['molfile']),
+        'constant_parameters':{
+            name:value for name, value in sorted(alg_help.parameters.items())
+            if name not in alg_help.fit_parameters_names and
+            name != 'molfile'
+        },
+        'fit_parameters_names':list(alg_help.fit_parameters_names),
+        'units':alg_help.unit_key,
+        'bounds_low':list(alg_help.bounds_low),
+        'bounds_upp':list(alg_help.bounds_upp),
+        'points_per_dimension':int(points_per_dimension),
+        # grids saved before the failed models were kept as NaN (0 instead)
+        # are not reused.
+        'failed_models':'nan'
+    }
+    description_json = json.dumps(description, sort_keys=True, default=float)
+
+    return f'emulator_{sha1(description_json.encode()).hexdigest()}.npz'
+
+
+def build_emulator(alg_help, points_per_dimension=12, directory=None,
+                   core_count=cpu_count(), pool=None):
+    """build (or load a previously built) RADEX emulator on a regular grid
+    spanning the bounds of the fit parameters in log10 space. The grid
+    models are calculated in parallel through
+    "AlgorithmHelpers.RADEX_line_strengths_batch()", so they are also
+    read from and written to the model store.
+
+    Args:
+        alg_help (AlgorithmHelpers): fitting constants.
+
+        points_per_dimension (int): number of grid points per parameter.
+        Defaults to 12.
+
+        directory (str, optional): directory the emulator grid is saved to
+        and loaded from. Defaults to None (not saved).
+
+        core_count (int): number of processors. Defaults to cpu_count().
+
+        pool (multiprocessing.Pool, optional): pool (e.g. of a shared
+        "WorkerPool") the grid models are distributed over. Defaults to
+        None (a pool of "core_count" processes for the grid only).
+
+
+    Returns:
+        RADEXEmulator: the emulator.
+    """
+
+    if directory is not None:
+        emulator_file = Path(directory) / emulator_file_name(
+            alg_help, points_per_dimension
+        )
+        if emulator_file.exists():
+            print(f"Loading RADEX emulator grid '{emulator_file}'.")
+            return RADEXEmulator.load(emulator_file)
+
+    grid_axes = [linspace(low, upp, points_per_dimension)
+                 for low, upp in zip(alg_help.bounds_low,
+                                     alg_help.bounds_upp)]
+    grid_shape = tuple(len(axis) for axis in grid_axes)
+    grid_points = array(meshgrid(*grid_axes, indexing='ij')).reshape(
+        len(grid_axes), -1
+    ).T
+
+    print(f"Building RADEX emulator grid of {grid_points.shape[0]} models.")
+    with (nullcontext(pool) if pool is not None
+          else Pool(processes=core_count)) as pool:
+        line_strengths = alg_help.RADEX_line_strengths_batch(grid_points,
+                                                             pool)
+
+    # the failed models stay NaN, the emulator rejects the points next to
+    # them instead of interpolating made up line strengths.
+    failed = ~isfinite(line_strengths).all(axis=1)
+    if failed.any():
+        print(f"WARNING: RADEX failed for {failed.sum()} of the " +
+              f"{grid_points.shape[0]} emulator grid models, the posterior " +
+              "is -inf in their grid cells. Failed grid points (log10(" +
+              ", ".join(alg_help.fit_parameters_names) + ")):")
+        for grid_point in grid_points[failed]:
+            print("    " + ", ".join(f"{value:.3f}" for value in grid_point))
+    line_strengths[failed] = nan
+    emulator = RADEXEmulator(grid_axes, line_strengths.reshape(
+        grid_shape + (line_strengths.shape[-1],)
+    ))
+
+    if directory is not None:
+        emulator.save(emulator_file)
+        print(f"RADEX emulator grid saved to '{emulator_file}'.")
+
+    return emulator
+
+
+def emulator_accuracy_report(alg_help, emulator, samples):
+    """compare the emulator with exact RADEX models for the matching lines,
+    both relative to the exact line strengths and in units of the
+    observed uncertainties (the latter is what matters for the
+    likelihood).
+
+    Args:
+        alg_help (AlgorithmHelpers): fitting constants.
+
+        emulator (RADEXEmulator): the emulator.
+
+        samples (nd.array): (N, ndim) log10 fit parameters to compare at,
+        e.g. held-out points or posterior samples.
+
+
+    Returns:
+        dict: median, 95th percentile and maximum relative errors and
+        errors in units of the observed uncertainties.
+    """
+
+    exact = alg_help.RADEX_model_batch(samples)
+    emulated = emulator.line_strengths_batch(samples)[
+        :, alg_help.matching_lines
+    ]
+    # points next to a failed emulator grid model are rejected, not
+    # emulated.
+    compared = isfinite(exact).all(axis=1) & isfinite(emulated).all(axis=1)
+    exact, emulated = exact[compared], emulated[compared]
+
+    relative_error = np_abs(emulated - exact) / where(exact != 0,
+                                                      np_abs(exact), 1.0)
+    sigma_error = np_abs(emulated - exact) / alg_help.y_err
+
+    return {
+        'number_of_samples':int(compared.sum()),
+        'median_relative_error':float(median(relative_error)),
+        'p95_relative_error':float(percentile(relative_error, 95)),
+        'max_relative_error':float(relative_error.max()),
+        'median_sigma_error':float(median(sigma_error)),
+        'p95_sigma_error':float(percentile(sigma_error, 95)),
+        'max_sigma_error':float(sigma_error.max())
+    }
+
+
+def held_out_points(alg_help, number_of_points=50, seed=None):
+    """uniformly drawn points within the bounds of the fit parameters,
+    which (almost surely) do not coincide with the emulator grid.
+
+    Args:
+        alg_help (AlgorithmHelpers): fitting constants.
+
+        number_of_points (int): number of points. Defaults to 50.
+
+        seed (int, optional): seed of the random number generator.
+        Defaults to None.
+
+
+    Returns:
+        nd.array: (number_of_points, ndim) log10 fit parameters.
+    """
+
+    return default_rng(seed).uniform(
+        alg_help.bounds_low, alg_help.bounds_upp,
+        size=(number_of_points, len(alg_help.bounds_low))
+    )
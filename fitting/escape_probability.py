@@ -0,0 +1,846 @@
+#!/usr/bin/env python3
+
+# module imports
+from numpy import (
+    abs as np_abs,
+    arange,
+    array,
+    asarray,
+    atleast_2d,
+    broadcast_to,
+    clip,
+    concatenate,
+    empty,
+    errstate,
+    exp,
+    full,
+    inf,
+    isfinite,
+    log,
+    maximum,
+    median,
+    minimum,
+    nan,
+    ones,
+    percentile,
+    pi,
+    searchsorted,
+    sqrt,
+    unique,
+    where,
+    zeros
+)
+from numpy import add as np_add
+from numpy.linalg import solve
+
+# relative imports
+from user_input.lamda_molecule import load_lamda_molecule
+
+
+# physical constants as used by RADEX (cgs).
+hplanck = 6.6260963e-27  # [erg s]
+clight  = 2.99792458e10  # [cm/s]
+kboltz  = 1.3806505e-16  # [erg/K]
+
+fk    = hplanck * clight / kboltz  # [K cm]
+thc   = 2.0 * hplanck * clight     # [erg cm]
+fgaus = 1.0645 * 8.0 * pi          # gaussian line profile factor.
+
+# RADEX iteration settings.
+minimum_population   = 1.0e-20
+convergence_criteria = 1.0e-6
+minimum_iterations   = 10
+# a warm started model is already close to convergence.
+warm_start_iterations = 2
+
+# LAMDA collision partner ids and their SpectralRadex parameter names.
+collision_partner_names = {
+    1:'h2', 2:'p-h2', 3:'o-h2', 4:'e-', 5:'h', 6:'he', 7:'h+'
+}
+
+
+def uniform_sphere_escape_probability(tau):
+    """escape probability of a uniform sphere, Osterbrock (1974).
+
+    Args:
+        tau (nd.array): line optical depths.
+
+
+    Returns:
+        nd.array: escape probabilities.
+    """
+
+    taur = tau / 2.0
+    with errstate(all='ignore'):
+        return where(
+            np_abs(taur) < 0.1,
+            1.0 - 0.75 * taur + taur**2 / 2.5 - taur**3 / 6.0 +
+            taur**4 / 17.5,
+            where(
+                np_abs(taur) > 50.0,
+                0.75 / taur,
+                0.75 / taur * (1.0 - 1.0 / (2.0 * taur**2) +
+                               (1.0 / taur + 1.0 / (2.0 * taur**2)) *
+                               exp(-2.0 * taur))
+            )
+        )
+
+
+def lvg_escape_probability(tau):
+    """escape probability of an expanding sphere (LVG), de Jong et al.
+    (1980).
+
+    Args:
+        tau (nd.array): line optical depths.
+
+
+    Returns:
+        nd.array: escape probabilities.
+    """
+
+    taur = tau / 2.0
+    with errstate(all='ignore'):
+        return where(
+            np_abs(taur) < 0.01,
+            1.0,
+            where(
+                np_abs(taur) < 7.0,
+                2.0 * (1.0 - exp(-2.34 * taur)) / (4.68 * taur),
+                2.0 / (taur * 4.0 * sqrt(log(taur / sqrt(pi))))
+            )
+        )
+
+
+def slab_escape_probability(tau):
+    """escape probability of a plane parallel slab, de Jong, Chu &
+    Dalgarno (1975).
+
+    Args:
+        tau (nd.array): line optical depths.
+
+
+    Returns:
+        nd.array: escape probabilities.
+    """
+
+    with errstate(all='ignore'):
+        return where(
+            np_abs(3.0 * tau) < 0.1,
+            1.0 - 1.5 * (tau + tau**2),
+            where(
+                np_abs(3.0 * tau) > 50.0,
+                1.0 / (3.0 * tau),
+                (1.0 - exp(-3.0 * tau)) / (3.0 * tau)
+            )
+        )
+
+
+# RADEX geometry ("method") numbers and their escape probabilities.
+escape_probabilities = {
+    1:uniform_sphere_escape_probability,
+    2:lvg_escape_probability,
+    3:slab_escape_probability
+}
+
+
+def line_escape_probability(tau, geometry):
+    """RADEX escape probability of line photons, only evaluating the
+    geometries that are present.
+
+    Args:
+        tau (nd.array): (N, n_lines) line optical depths.
+
+        geometry (nd.array[int]): (N, 1) 1 (uniform sphere), 2 (LVG,
+        expanding sphere) -OR- 3 (plane parallel slab).
+
+
+    Returns:
+        nd.array: (N, n_lines) escape probabilities.
+    """
+
+    geometry = geometry[:, 0]
+    first_geometry = geometry[0] if geometry.shape[0] else 1
+    if (geometry == first_geometry).all():
+        return escape_probabilities[first_geometry](tau)
+
+    beta = empty(tau.shape)
+    for geometry_id, escape_probability in escape_probabilities.items():
+        selected = geometry == geometry_id
+        if selected.any():
+            beta[selected] = escape_probability(tau[selected])
+
+    return beta
+
+
+def interpolation_weights(temperatures, tkin):
+    """indices and weights of linear interpolation in temperature, kept
+    constant outside the tabulated temperatures, as RADEX interpolates the
+    collision rate coefficients.
+
+    Args:
+        temperatures (nd.array): (n_temperatures,) tabulated temperatures
+        [K].
+
+        tkin (nd.array): (N,) kinetic temperatures [K].
+
+
+    Returns:
+        nd.array, nd.array, nd.array: (N,) indices of the tabulated
+        temperature below and above and (N,) weights of the one above.
+    """
+
+    if temperatures.shape[0] == 1:
+        below = zeros(tkin.shape[0], dtype=int)
+        return below, below, zeros(tkin.shape[0])
+
+    tkin_clipped = clip(tkin, temperatures[0], temperatures[-1])
+    above = clip(searchsorted(temperatures, tkin_clipped), 1,
+                 temperatures.shape[0] - 1)
+    weight = ((tkin_clipped - temperatures[above - 1]) /
+              (temperatures[above] - temperatures[above - 1]))
+
+    return above - 1, above, weight
+
+
+def planck(wavenumber, temperature):
+    """blackbody intensity in RADEX units (thc * nu^3 / (exp(fk nu/T) - 1)),
+    0 where fk nu / T >= 160.
+
+    Args:
+        wavenumber (nd.array): line wavenumbers [cm^-1].
+
+        temperature (nd.array): (excitation) temperatures [K].
+
+
+    Returns:
+        nd.array: intensities.
+    """
+
+    with errstate(all='ignore'):
+        hnu = fk * wavenumber / temperature
+        return where(hnu >= 160.0, 0.0,
+                     thc * wavenumber**3 / (exp(minimum(hnu, 160.0)) - 1.0))
+
+
+class EscapeProbabilitySolver:
+    def __init__(self, molfile, chunk_size=2048, maximum_iterations=10_000,
+                 tkin_range=None):
+        """pure NumPy implementation of the RADEX escape probability
+        iteration (van der Tak et al. 2007) that solves the statistical
+        equilibrium of a whole batch of models at once: the rate matrices
+        of all models are stacked and solved with a single batched
+        "numpy.linalg.solve()" per iteration.
+
+        The iteration follows RADEX (optically thin start, under-relaxed
+        excitation temperatures and populations, convergence of the lines
+        with tau > 0.01 to 1e-6). Validated against SpectralRadex (CO,
+        HCO+, CS and HCN, all three geometries, 200 random models each with
+        tkin 10-1000 K, cdmol 1e12-1e16 cm^-2 and n(H2) 1e2-1e7 cm^-3),
+        comparing lines brighter than 1e-6 times the brightest line of the
+        model: the median relative difference is 1e-7 (CO) to 3e-4 (HCN)
+        and 78-100% of the models agree to better than 1%. The others are
+        strongly masing or very optically thick (tau > ~1e3) models, for
+        which RADEX itself does not converge to a stable solution either,
+        see "solver_accuracy_report()".
+
+        Args:
+            molfile (str): file location on system of molecular file.
+
+            chunk_size (int): number of models solved at once, limits the
+            memory of the stacked rate matrices. Defaults to 2048.
+
+            maximum_iterations (int): models that did not converge after
+            this many iterations are returned as NaN. Defaults to 10000.
+
+            tkin_range (tuple[float], optional): kinetic temperatures [K]
+            the models are expected in (e.g. the bounds of a fit kinetic
+            temperature), the collision rate table covers this range and
+            is extended if a model falls outside of it. Defaults to None
+            (all tabulated temperatures of the molfile).
+
+
+        Returns:
+            None
+        """
+
+        self.molfile            = molfile
+        self.molecule           = load_lamda_molecule(molfile)
+        self.chunk_size         = chunk_size
+        self.maximum_iterations = maximum_iterations
+        self.tkin_range         = tkin_range
+
+        molecule = self.molecule
+        self.number_of_levels = molecule.number_of_levels
+        self.upper            = molecule.upper
+        self.lower            = molecule.lower
+        self.einstein_A       = molecule.einstein_A
+        self.weights          = molecule.weights
+        self.wavenumbers      = (molecule.energies[self.upper] -
+                                 molecule.energies[self.lower])
+        self.weight_ratios    = self.weights[self.upper] / self.weights[
+            self.lower
+        ]
+
+        # upward/downward level energy differences and weight ratios of
+        # every level pair, for detailed balance of the collision rates.
+        energies = molecule.energies
+        self.energy_differences = energies[None, :] - energies[:, None]
+        self.weight_matrix      = self.weights[None, :] / self.weights[
+            :, None
+        ]
+
+        self.collision_partners = molecule.collision_partners
+        # built on first use, see "collision_rate_table()".
+        self.rate_table = None
+
+        return
+
+
+    def __getstate__(self):
+        """only the settings are pickled (e.g. with "AlgorithmHelpers" for
+        every MCMC pool task), the molecule is taken from the parsed
+        molecules of the receiving process, see "load_lamda_molecule()".
+
+        Returns:
+            tuple: molfile, chunk size, maximum number of iterations and
+            kinetic temperature range.
+        """
+
+        return (self.molfile, self.chunk_size, self.maximum_iterations,
+                self.tkin_range)
+
+
+    def __setstate__(self, state):
+        """rebuild the solver from the pickled settings.
+
+        Args:
+            state (tuple): see "__getstate__()".
+
+
+        Returns:
+            None
+        """
+
+        self.__init__(*state)
+
+        return
+
+
+    def partner_densities(self, tkin, densities):
+        """volume densities of the collision partners in the molfile. As in
+        RADEX, a total H2 density is split into para- and ortho-H2 with the
+        thermal ortho-to-para ratio if the molfile only has para/ortho-H2
+        rates and no para/ortho-H2 densities are given, and para- plus
+        ortho-H2 densities are used as H2 density if the molfile only has
+        H2 rates.
+
+        Args:
+            tkin (nd.array): (N,) kinetic temperatures [K].
+
+            densities (dict): (N,) volume densities [cm^-3] of every
+            collision partner, by SpectralRadex parameter name.
+
+
+        Returns:
+            dict: (N,) volume densities by LAMDA collision partner id.
+        """
+
+        partners = self.collision_partners
+        zero = zeros(tkin.shape[0])
+        densities = {partner_id:densities.get(name, zero) + zero
+                     for partner_id, name in collision_partner_names.items()}
+
+        if 1 not in partners and (2 in partners or 3 in partners):
+            split = (densities[2] == 0) & (densities[3] == 0)
+            ortho_para = minimum(3.0, 9.0 * exp(-170.6 / tkin))
+            densities[2] = where(split, densities[1] / (ortho_para + 1.0),
+                                 densities[2])
+            densities[3] = where(split,
+                                 densities[1] / (1.0 + 1.0 / ortho_para),
+                                 densities[3])
+        elif 1 in partners and 2 not in partners and 3 not in partners:
+            densities[1] = where(densities[1] == 0,
+                                 densities[2] + densities[3], densities[1])
+
+        return {partner_id:densities[partner_id] for partner_id in partners}
+
+
+    def collision_rate_table(self, tkin_low, tkin_high):
+        """downward collision rate coefficients of every collision partner
+        at the union of the tabulated temperatures of all partners, for
+        the (flattened) rate matrix positions of any partner.
+        Interpolating this table linearly gives exactly the rates RADEX
+        interpolates from the molfile, as every partner's rates are linear
+        in between its own (and therefore also the union) temperatures.
+
+        Only the temperatures needed for (tkin_low, tkin_high) are kept.
+
+        Args:
+            tkin_low (float): lowest kinetic temperature [K].
+
+            tkin_high (float): highest kinetic temperature [K].
+
+
+        Returns:
+            dict: the temperatures [K], the range of kinetic temperatures
+            [K] the table is exact for, the collision partner ids, the
+            flattened (upper, lower) rate matrix positions and the
+            (n_partners, n_temperatures, n_positions) rate coefficients
+            [cm^3 s^-1].
+        """
+
+        partners = self.collision_partners
+        tabulated = unique(concatenate(
+            [partner['temperatures'] for partner in partners.values()]
+        ))
+        # the tabulated temperatures bracketing the range, outside of all
+        # tabulated temperatures the rates are constant.
+        first = max(searchsorted(tabulated, tkin_low, side='right') - 1, 0)
+        last  = min(searchsorted(tabulated, tkin_high, side='left'),
+                    tabulated.shape[0] - 1)
+        temperatures = tabulated[first:last + 1]
+        covered = (-inf if first == 0 else temperatures[0],
+                   inf if last == tabulated.shape[0] - 1 else temperatures[-1])
+
+        partner_ids = sorted(partners)
+        flat_index, inverse = unique(concatenate(
+            [partners[partner_id]['upper'] * self.number_of_levels +
+             partners[partner_id]['lower'] for partner_id in partner_ids]
+        ), return_inverse=True)
+
+        rates = zeros((len(partner_ids), temperatures.shape[0],
+                       flat_index.shape[0]))
+        start = 0
+        for i, partner_id in enumerate(partner_ids):
+            partner = partners[partner_id]
+            positions = inverse[start:start + partner['upper'].shape[0]]
+            start += partner['upper'].shape[0]
+            below, above, weight = interpolation_weights(
+                partner['temperatures'], temperatures
+            )
+            # duplicate transitions (e.g. hyperfine components) accumulate.
+            np_add.at(rates[i], (slice(None), positions),
+                      partner['rates'][:, below].T * (1.0 - weight[:, None]) +
+                      partner['rates'][:, above].T * weight[:, None])
+
+        return {'temperatures':temperatures, 'covered':covered,
+                'partner_ids':partner_ids, 'flat_index':flat_index,
+                'rates':rates}
+
+
+    def collision_rates(self, tkin, densities):
+        """collision rate matrices, rates interpolated linearly in
+        temperature (and kept constant outside the tabulated temperatures)
+        as in RADEX, through a single lookup in the precomputed
+        "collision_rate_table()".
+
+        Args:
+            tkin (nd.array): (N,) kinetic temperatures [K].
+
+            densities (dict): (N,) volume densities [cm^-3] of every
+            collision partner, by SpectralRadex parameter name.
+
+
+        Returns:
+            nd.array: (N, n_levels, n_levels) collision rates [s^-1] from
+            level i (axis 1) to level j (axis 2).
+        """
+
+        table = self.rate_table
+        if (table is None or tkin.min() < table['covered'][0] or
+                tkin.max() > table['covered'][1]):
+            tkin_low, tkin_high = (
+                (tkin.min(), tkin.max()) if self.tkin_range is None
+                else self.tkin_range
+            )
+            table = self.rate_table = self.collision_rate_table(
+                min(tkin_low, tkin.min()), max(tkin_high, tkin.max())
+            )
+
+        number_of_models = tkin.shape[0]
+        below, above, weight = interpolation_weights(table['temperatures'],
+                                                     tkin)
+
+        partner_densities = self.partner_densities(tkin, densities)
+        table_rates = zeros((number_of_models, table['flat_index'].shape[0]))
+        for i, partner_id in enumerate(table['partner_ids']):
+            density = partner_densities[partner_id]
+            # e.g. the electron rates of a molfile when only H2 is given.
+            if not density.any():
+                continue
+            table_rates += density[:, None] * (
+                table['rates'][i, below] * (1.0 - weight[:, None]) +
+                table['rates'][i, above] * weight[:, None]
+            )
+
+        rates = zeros((number_of_models,
+                       self.number_of_levels * self.number_of_levels))
+        rates[:, table['flat_index']] = table_rates
+        downward = rates.reshape(number_of_models, self.number_of_levels,
+                                 self.number_of_levels)
+        # detailed balance for the upward rates.
+        with errstate(over='ignore'):
+            upward = downward.transpose(0, 2, 1) * self.weight_matrix * exp(
+                -fk * self.energy_differences[None, :, :] *
+                (self.energy_differences[None, :, :] > 0) / tkin[:, None, None]
+            )
+
+        return where(self.energy_differences[None, :, :] > 0, upward,
+                     downward)
+
+
+    def solve(self, tkin, cdmol, densities, tbg, linewidth, geometry,
+              initial_populations=None):
+        """solve the statistical equilibrium of a batch of models.
+
+        Args:
+            tkin (nd.array): (N,) kinetic temperatures [K].
+
+            cdmol (nd.array): (N,) column densities [cm^-2].
+
+            densities (dict): (N,) volume densities [cm^-3] of every
+            collision partner, by SpectralRadex parameter name.
+
+            tbg (nd.array): (N,) background (blackbody) temperatures [K].
+
+            linewidth (nd.array): (N,) line widths (FWHM) [km/s].
+
+            geometry (nd.array[int]): (N,) 1 (uniform sphere), 2 (LVG)
+            -OR- 3 (slab).
+
+            initial_populations (nd.array, optional): (N, n_levels) level
+            populations to start the iteration from (e.g. a converged
+            solution of a nearby model), NaN rows start from the optically
+            thin solution as RADEX does. Defaults to None.
+
+
+        Returns:
+            dict: (N, n_levels) level populations, (N, n_lines) excitation
+            temperatures, optical depths and background intensities, (N,)
+            booleans indicating which models converged and (N,) number of
+            iterations.
+        """
+
+        number_of_models = tkin.shape[0]
+        if (tbg <= 0).any():
+            raise ValueError("Only a blackbody background (tbg > 0) is " +
+                             "supported by the escape probability solver.")
+
+        collision_rates = self.collision_rates(tkin, densities)
+        collision_out   = collision_rates.sum(axis=2)
+        column_per_dv   = cdmol / (linewidth * 1.0e5)
+        background      = planck(self.wavenumbers[None, :], tbg[:, None])
+        geometry        = geometry[:, None]
+
+        nlev  = self.number_of_levels
+        upper = self.upper
+        lower = self.lower
+        levels = arange(nlev)
+        tau_factor = self.einstein_A / (fgaus * self.wavenumbers**3)
+
+        populations     = zeros((number_of_models, nlev))
+        populations_old = zeros((number_of_models, nlev))
+        tex             = zeros((number_of_models, self.upper.shape[0]))
+        tau             = zeros((number_of_models, self.upper.shape[0]))
+        converged       = full(number_of_models, False)
+        iterations      = zeros(number_of_models, dtype=int)
+        solved          = full(number_of_models, False)
+        required_iterations = full(number_of_models, minimum_iterations)
+
+        # warm start: the radiation field (excitation temperatures and
+        # optical depths) of the starting populations takes the place of
+        # the optically thin start, the under-relaxation only starts from
+        # the first populations solved for.
+        if initial_populations is not None:
+            warm = isfinite(initial_populations).all(axis=1)
+            pop_upper = initial_populations[warm][:, upper]
+            pop_lower = initial_populations[warm][:, lower]
+            with errstate(all='ignore'):
+                tex[warm] = where(
+                    (pop_upper <= minimum_population) |
+                    (pop_lower <= minimum_population),
+                    tbg[warm, None],
+                    fk * self.wavenumbers / log(
+                        pop_lower * self.weight_ratios / pop_upper
+                    )
+                )
+            tau[warm] = column_per_dv[warm, None] * (
+                pop_lower * self.weight_ratios - pop_upper
+            ) * tau_factor
+            iterations[warm]          = 1
+            required_iterations[warm] = warm_start_iterations
+
+        # models still iterating.
+        active = arange(number_of_models)
+        for _ in range(self.maximum_iterations):
+            # optically thin start (only the background radiation) for the
+            # models that are not warm started.
+            first = iterations[active] == 0
+            beta = line_escape_probability(tau[active], geometry[active])
+            with errstate(all='ignore'):
+                mean_intensity = where(
+                    first[:, None],
+                    background[active],
+                    background[active] * beta + (1.0 - beta) *
+                    planck(self.wavenumbers, tex[active])
+                )
+            occupation = mean_intensity / (thc * self.wavenumbers**3)
+
+            # rate matrix, rows are the levels populated, columns the
+            # levels depopulated (RADEX's "yrate").
+            rate_matrix = -collision_rates[active].transpose(0, 2, 1)
+            rate_matrix[:, levels, levels] = collision_out[active]
+            stimulated_down = self.einstein_A * (1.0 + occupation)
+            stimulated_up   = self.einstein_A * self.weight_ratios * occupation
+            np_add.at(rate_matrix, (slice(None), upper, upper),
+                      stimulated_down)
+            np_add.at(rate_matrix, (slice(None), lower, lower),
+                      stimulated_up)
+            np_add.at(rate_matrix, (slice(None), upper, lower),
+                      -stimulated_up)
+            np_add.at(rate_matrix, (slice(None), lower, upper),
+                      -stimulated_down)
+
+            # replace the last equation by the normalization.
+            rate_matrix[:, -1, :] = 1.0
+            right_hand_side = zeros((active.shape[0], nlev))
+            right_hand_side[:, -1] = 1.0
+            new_populations = maximum(
+                solve(rate_matrix, right_hand_side[..., None])[..., 0],
+                minimum_population
+            )
+            unsolved = ~solved[active]
+            populations_old[active[unsolved]] = new_populations[unsolved]
+            solved[active] = True
+
+            # excitation temperatures and optical depths.
+            pop_upper = new_populations[:, upper]
+            pop_lower = new_populations[:, lower]
+            with errstate(all='ignore'):
+                new_tex = fk * self.wavenumbers / log(
+                    pop_lower * self.weight_ratios / pop_upper
+                )
+            unresolved = ((pop_upper <= minimum_population) |
+                          (pop_lower <= minimum_population))
+            new_tex = where(
+                unresolved,
+                where(first[:, None], tbg[active, None], tex[active]),
+                new_tex
+            )
+            old_tex = where(first[:, None], new_tex, tex[active])
+
+            thick = tau[active] > 0.01
+            with errstate(all='ignore'):
+                relative_change = np_abs((new_tex - old_tex) / new_tex)
+            number_thick = thick.sum(axis=1)
+            total_change = where(thick, relative_change, 0.0).sum(axis=1)
+
+            # under-relaxation of the excitation temperatures and
+            # populations after the first iteration.
+            tex[active] = where(unsolved[:, None], new_tex,
+                                0.5 * (new_tex + old_tex))
+            tau[active] = column_per_dv[active, None] * (
+                pop_lower * self.weight_ratios - pop_upper
+            ) * tau_factor
+            new_populations = (0.3 * populations_old[active] +
+                               0.7 * new_populations)
+            populations[active]     = new_populations
+            populations_old[active] = new_populations
+
+            with errstate(invalid='ignore'):
+                done = (number_thick == 0) | (
+                    total_change / maximum(number_thick, 1) <
+                    convergence_criteria
+                )
+            done &= iterations[active] >= required_iterations[active]
+            iterations[active] += 1
+            done |= ~isfinite(populations[active]).all(axis=1)
+            converged[active[done]] = isfinite(
+                populations[active[done]]
+            ).all(axis=1)
+            active = active[~done]
+            if active.shape[0] == 0:
+                break
+
+        return {
+            'populations':populations,
+            'tex':tex,
+            'tau':tau,
+            'background':background,
+            'converged':converged,
+            'iterations':iterations
+        }
+
+
+    def output(self, tkin, cdmol, densities, tbg, linewidth, geometry,
+               initial_populations=None):
+        """RADEX output of a batch of models, in chunks of "chunk_size".
+
+        Args:
+            see "solve()".
+
+
+        Returns:
+            nd.array, nd.array, nd.array: (N, 10, n_lines) output in the
+            rows of the (Spectral)RADEX output array: upper level energy
+            [K], frequency [GHz], wavelength [um], excitation temperature
+            [K], optical depth, T_R [K], upper and lower level populations,
+            flux [K km/s] and flux [erg/cm2/s], the (N, n_levels) level
+            populations and the (N,) number of iterations. NaN for models
+            that did not converge.
+        """
+
+        number_of_models = tkin.shape[0]
+        number_of_lines  = self.upper.shape[0]
+        radex_output = full((number_of_models, 10, number_of_lines), nan)
+        populations  = full((number_of_models, self.number_of_levels), nan)
+        iterations   = zeros(number_of_models, dtype=int)
+        frequencies  = self.molecule.frequencies
+
+        for start in range(0, number_of_models, self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            solution = self.solve(
+                tkin[chunk], cdmol[chunk],
+                {name:density[chunk] for name, density in densities.items()},
+                tbg[chunk], linewidth[chunk], geometry[chunk],
+                None if initial_populations is None
+                else initial_populations[chunk]
+            )
+            tex, tau = solution['tex'], solution['tau']
+
+            with errstate(all='ignore'):
+                source  = planck(self.wavenumbers, tex)
+                ftau    = where(np_abs(tau) <= 300.0,
+                                exp(-minimum(tau, 300.0)), 0.0)
+                t_r     = ((source - solution['background']) * (1.0 - ftau) /
+                           (thc * self.wavenumbers**2 / fk))
+
+            deltav = linewidth[chunk, None] * 1.0e5
+            chunk_output = array([
+                broadcast_to(fk * self.molecule.energies[self.upper],
+                             tex.shape),
+                broadcast_to(frequencies, tex.shape),
+                broadcast_to(clight / frequencies / 1.0e5, tex.shape),
+                tex,
+                tau,
+                t_r,
+                solution['populations'][:, self.upper],
+                solution['populations'][:, self.lower],
+                1.0645 * deltav * t_r / 1.0e5,
+                fgaus * kboltz * deltav * t_r * self.wavenumbers**3
+            ]).transpose(1, 0, 2)
+            chunk_output[~solution['converged']] = nan
+            radex_output[chunk] = chunk_output
+            populations[chunk][solution['converged']] = solution[
+                'populations'
+            ][solution['converged']]
+            iterations[chunk] = solution['iterations']
+
+        return radex_output, populations, iterations
+
+
+    def line_output_batch(self, parameters, fit_parameters_names,
+                          fit_parameters_values_2d, warm_start_store=None):
+        """RADEX output of the lines within (fmin, fmax) for a batch of
+        parameter vectors, the vectorized counterpart of running
+        SpectralRadex for every row.
+
+        Args:
+            parameters (dict): SpectralRadex input dictionary of the
+            constant parameters.
+
+            fit_parameters_names (list[str]): names of the fit parameters.
+
+            fit_parameters_values_2d (nd.array): (N, ndim) log10 values of
+            the fit parameters.
+
+            warm_start_store (WarmStartStore, optional): store of recent
+            solutions the models are started from (if one is near enough)
+            and that the converged models are added to. Defaults to None
+            (every model starts from the optically thin solution).
+
+
+        Returns:
+            nd.array: (N, 10, n_lines) output, see "output()".
+        """
+
+        fit_parameters_values_2d = atleast_2d(
+            asarray(fit_parameters_values_2d, dtype=float)
+        )
+        number_of_models = fit_parameters_values_2d.shape[0]
+        parameter_names = (['tkin', 'cdmol', 'tbg', 'linewidth', 'geometry'] +
+                           list(collision_partner_names.values()))
+        values = {name:ones(number_of_models) * float(parameters[name])
+                  for name in parameter_names
+                  if name not in fit_parameters_names and name in parameters}
+        for name, column in zip(fit_parameters_names,
+                                fit_parameters_values_2d.T):
+            values[name] = 10.0**column
+
+        frequencies = self.molecule.frequencies
+        in_range = ((frequencies > parameters['fmin']) &
+                    (frequencies < parameters['fmax']))
+
+        if warm_start_store is None:
+            initial_populations = None
+        else:
+            context = warm_start_store.context(
+                self.molfile, fit_parameters_names, parameters
+            )
+            initial_populations = warm_start_store.nearest(
+                context, fit_parameters_values_2d, self.number_of_levels
+            )
+
+        radex_output, populations, iterations = self.output(
+            values['tkin'], values['cdmol'],
+            {name:values[name] for name in collision_partner_names.values()
+             if name in values},
+            values['tbg'], values['linewidth'],
+            values['geometry'].astype(int), initial_populations
+        )
+
+        if warm_start_store is not None:
+            warm_start_store.add(context, fit_parameters_values_2d,
+                                 populations, initial_populations,
+                                 iterations)
+
+        return radex_output[..., in_range]
+
+
+def solver_accuracy_report(alg_help, samples):
+    """compare the escape probability solver with SpectralRadex for the
+    matching lines, ignoring lines fainter than 1e-6 times the brightest
+    line of the model.
+
+    Args:
+        alg_help (AlgorithmHelpers): fitting constants.
+
+        samples (nd.array): (N, ndim) log10 fit parameters to compare at,
+        e.g. "emulator.held_out_points()".
+
+
+    Returns:
+        dict: median, 95th percentile and maximum relative differences.
+    """
+
+    radex_output = alg_help.RADEX_model_batch(samples, solver='radex')
+    numpy_output = alg_help.RADEX_model_batch(samples, solver='numpy')
+    compared = (isfinite(radex_output).all(axis=1) &
+                isfinite(numpy_output).all(axis=1))
+    radex_output, numpy_output = radex_output[compared], numpy_output[compared]
+
+    significant = np_abs(radex_output) > 1.0e-6 * np_abs(radex_output).max(
+        axis=1, keepdims=True, initial=0.0
+    )
+    with errstate(all='ignore'):
+        relative_difference = (np_abs(numpy_output - radex_output) /
+                               np_abs(radex_output))[significant]
+    if relative_difference.shape[0] == 0:
+        relative_difference = zeros(1)
+
+    return {
+        'number_of_samples':int(compared.sum()),
+        'median_relative_error':float(median(relative_difference)),
+        'p95_relative_error':float(percentile(relative_difference, 95)),
+        'max_relative_error':float(relative_difference.max())
+    }
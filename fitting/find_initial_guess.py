@@ -15,22 +15,37 @@
 
 #%%
 # module imports
+from contextlib import nullcontext
+from itertools import product
 from numpy import (
-    concatenate,
+    abs as np_abs,
+    all as np_all,
+    append,
+    arange,
+    argpartition,
+    argsort,
+    ceil,
+    empty,
     geomspace,
+    isfinite,
     linspace,
     loadtxt,
-    append,
+    meshgrid,
     array,
-    where,
     log10,
-    full,
+    log2,
     ones,
-    ix_
+    prod,
+    round as np_round,
+    unravel_index,
+    vstack,
+    where
 )
-from spectralradex.radex import run_grid
+from numpy.random import default_rng
 from multiprocessing import cpu_count, Pool
-import warnings
+
+# relative imports
+from .particle_swarm import particle_swarm_search
 
 
 def data_file_extraction(user_data_file, uncertainty):
@@ -92,19 +107,301 @@ def chi_squared(y_fit, y_obs, y_err, uncertainty):
     return
 
 
+def well_separated_minima(chi2, grid_indices, number_of_points):
+    """the grid points with the lowest chi2 that are not neighbours of a
+    better one on the grid, so the points are not all in the same valley.
+
+    Args:
+        chi2 (numpy.array): (N,) chi2 of the grid points, NaN for models
+        RADEX failed to calculate.
+        
+        grid_indices (numpy.array): (N, ndim) positions of the grid points
+        in units of the grid spacing (e.g. their integer indices along
+        every grid axis), points less than 1 apart in every dimension are
+        neighbours.
+        
+        number_of_points (int): number of grid points to select.
+        
+
+    Returns:
+        list[int]: indices of the selected grid points, the lowest chi2
+        first.
+    """
+    
+    selected = []
+    # models RADEX failed to calculate have a NaN chi2.
+    for index in argsort(chi2)[:int(isfinite(chi2).sum())]:
+        if all(np_abs(grid_indices[index] - grid_indices[other]).max() > 1
+               for other in selected):
+            selected += [int(index)]
+            if len(selected) == number_of_points:
+                break
+    
+    return selected
+
+
+def streaming_grid_search(grid_axes, grid_chi2, number_of_points,
+                          chunk_size=4096, report=True):
+    """evaluate a dense grid chunk by chunk, keeping only a running
+    selection of the grid points with the lowest chi2, so the memory use
+    does not grow with the size of the grid (e.g. several fitted collision
+    partners). Every chunk is one "grid_chi2" batch, which distributes it
+    over the pool (or vectorizes it with the 'numpy' solver).
+
+    A grid point is only passed over by "well_separated_minima()" for a
+    better neighbour, of which it has at most 3^ndim - 1. The best
+    "number_of_points" * 3^ndim grid points therefore always contain the
+    same well-separated minima as the whole grid.
+
+    Args:
+        grid_axes (list[numpy.array]): log10 values of every grid axis.
+        
+        grid_chi2 (function): chi2 of a (N, ndim) array of grid points.
+        
+        number_of_points (int): number of well-separated minima to be
+        selected from the kept grid points.
+        
+        chunk_size (int): number of grid points per batch. Defaults to
+        4096.
+        
+        report (bool): print the progress and the best grid point so far
+        after every chunk, for grids of more than one chunk. Defaults to
+        True.
+        
+
+    Returns:
+        tuple: (M, ndim) the kept grid points, (M,) their chi2 and (M,
+        ndim) their integer indices along every grid axis.
+    """
+    
+    ndim = len(grid_axes)
+    grid_shape = [axis.shape[0] for axis in grid_axes]
+    number_of_grid_points = int(prod(grid_shape))
+    number_kept = number_of_points * 3**ndim
+    
+    kept_indices = empty((0, ndim), dtype=int)
+    kept_chi2 = empty(0)
+    for start in range(0, number_of_grid_points, chunk_size):
+        stop = min(start + chunk_size, number_of_grid_points)
+        chunk_indices = array(unravel_index(arange(start, stop),
+                                            grid_shape)).T
+        chunk_points = array([axis[index] for axis, index
+                              in zip(grid_axes, chunk_indices.T)]).T
+        chunk_chi2 = grid_chi2(chunk_points)
+        
+        # models RADEX failed to calculate (NaN) are never kept.
+        finite = isfinite(chunk_chi2)
+        kept_indices = vstack([kept_indices, chunk_indices[finite]])
+        kept_chi2 = append(kept_chi2, chunk_chi2[finite])
+        if kept_chi2.shape[0] > number_kept:
+            best = argpartition(kept_chi2, number_kept)[:number_kept]
+            kept_indices, kept_chi2 = kept_indices[best], kept_chi2[best]
+        
+        if report and number_of_grid_points > chunk_size:
+            if kept_chi2.shape[0] == 0:
+                best_so_far = "no successful models yet"
+            else:
+                best_index = kept_indices[kept_chi2.argmin()]
+                best_so_far = (
+                    f"best chi2 so far {kept_chi2.min():.5e} at log10(" +
+                    ", ".join(f"{axis[index]:.3f}" for axis, index
+                              in zip(grid_axes, best_index)) + ")"
+                )
+            print(f"grid: {stop}/{number_of_grid_points} models, " +
+                  best_so_far)
+    
+    kept_points = array([axis[index] for axis, index
+                         in zip(grid_axes, kept_indices.T)]).reshape(
+                             ndim, -1
+                         ).T
+    
+    return kept_points, kept_chi2, kept_indices
+
+
+def adaptive_grid_search(bounds_low, bounds_upp, grid_chi2,
+                         coarse_points=5, refined_cells=5, resolution=0.05,
+                         max_evaluations=None):
+    """coarse-to-fine grid search: a coarse grid over the bounds, after
+    which the cells of the best well-separated coarse grid points are each
+    repeatedly subdivided with half the grid spacing around their best
+    point so far, until the spacing reaches the target resolution in every
+    dimension or the evaluation budget is used up. Only the subdivided
+    cells are evaluated, so it scales much better with the number of fit
+    parameters than one dense grid.
+
+    NOTE: a minimum is only found if its coarse cell is among the
+    "refined_cells" best ones. That is not guaranteed when the chi2
+    surface has a valley narrower than the coarse spacing (e.g. the
+    degeneracy of tkin and cdmol of optically thick lines): the coarse
+    grid points next to it can all be worse than the ones of other cells.
+    Use a 'brute' grid or more refined cells (RefinedCells in the [GRID]
+    section of config.ini) when the fit parameters are strongly
+    degenerate.
+
+    Args:
+        bounds_low (numpy.array): (ndim,) lower bounds in log10.
+        
+        bounds_upp (numpy.array): (ndim,) upper bounds in log10.
+        
+        grid_chi2 (function): chi2 of a (N, ndim) array of grid points.
+        
+        coarse_points (int): number of coarse grid points per dimension,
+        the bounds themselves are excluded. Defaults to 5.
+        
+        refined_cells (int): number of best well-separated coarse grid
+        points whose cells are subdivided. Defaults to 5.
+        
+        resolution (float): target grid spacing in log10. Defaults to 0.05.
+        
+        max_evaluations (int, optional): maximum total number of grid
+        points evaluated. Defaults to None (until the target resolution).
+        
+
+    Returns:
+        tuple: (N, ndim) evaluated grid points, (N,) their chi2 and (N,
+        ndim) their positions in units of the coarse grid spacing.
+    """
+    
+    bounds_low = array(bounds_low, dtype=float)
+    bounds_upp = array(bounds_upp, dtype=float)
+    ndim = bounds_low.shape[0]
+    coarse_spacing = (bounds_upp - bounds_low) / (coarse_points + 1)
+    
+    grid_points = array(meshgrid(
+        *[linspace(low, upp, coarse_points + 2)[1:-1]
+          for low, upp in zip(bounds_low, bounds_upp)],
+        indexing='ij'
+    )).reshape(ndim, -1).T
+    chi2 = grid_chi2(grid_points)
+    evaluated = set(map(tuple, np_round(grid_points, 10)))
+    
+    # the neighbours of a grid point on a grid with the current spacing.
+    offsets = array(list(product([-1, 0, 1], repeat=ndim)))
+    offsets = offsets[np_abs(offsets).sum(axis=1) > 0]
+    
+    # every one of the best well-separated cells of the coarse grid is
+    # refined on its own: at every level around the best point found so far
+    # within one coarse grid spacing of it. The refinement of the best
+    # coarse cell can not take over the other cells, a narrow valley (e.g.
+    # the tkin-cdmol degeneracy) that only shows up at a finer spacing
+    # keeps being refined.
+    cells = grid_points[well_separated_minima(
+        chi2, grid_points / coarse_spacing, refined_cells
+    )] / coarse_spacing
+    
+    spacing = coarse_spacing
+    while (spacing > resolution).any():
+        if (max_evaluations is not None and
+                grid_points.shape[0] >= max_evaluations):
+            break
+        
+        spacing = where(spacing > resolution, spacing / 2, spacing)
+        centres = []
+        for cell in cells:
+            in_cell = np_all(
+                np_abs(grid_points / coarse_spacing - cell) <= 1 + 1e-9,
+                axis=1
+            ) & isfinite(chi2)
+            if in_cell.any():
+                centres += [grid_points[in_cell][chi2[in_cell].argmin()]]
+        # the cells in order of their coarse chi2, so an evaluation budget
+        # is spent on the best cells first.
+        new_points = []
+        for point in np_round(
+            (array(centres)[:, None, :] + offsets[None, :, :] *
+             spacing).reshape(-1, ndim), 10
+        ):
+            if (np_all((point > bounds_low) & (point < bounds_upp)) and
+                    tuple(point) not in evaluated):
+                evaluated.add(tuple(point))
+                new_points += [point]
+        new_points = array(new_points).reshape(-1, ndim)
+        if max_evaluations is not None:
+            new_points = new_points[:max_evaluations - grid_points.shape[0]]
+        if new_points.shape[0] == 0:
+            continue
+        
+        chi2 = append(chi2, grid_chi2(new_points))
+        grid_points = vstack([grid_points, new_points])
+    
+    return grid_points, chi2, grid_points / coarse_spacing
+
+
+def space_filling_points(bounds_low, bounds_upp, number_of_points,
+                         method='sobol', seed=None):
+    """quasi-random points filling the bounds evenly, so the number of
+    models is set directly instead of by the number of grid axes.
+
+    Args:
+        bounds_low (numpy.array): (ndim,) lower bounds in log10.
+        
+        bounds_upp (numpy.array): (ndim,) upper bounds in log10.
+        
+        number_of_points (int): number of points.
+        
+        method (str): a scrambled 'sobol' sequence -OR- a latin hypercube
+        ('lhs'). Defaults to 'sobol'.
+        
+        seed (int, optional): seed of the scrambling/random permutations.
+        Defaults to None.
+        
+
+    Returns:
+        numpy.array: (number_of_points, ndim) points in log10.
+    """
+    
+    bounds_low = array(bounds_low, dtype=float)
+    bounds_upp = array(bounds_upp, dtype=float)
+    ndim = bounds_low.shape[0]
+    
+    if method == 'sobol':
+        # NOTE: scipy.stats.qmc requires scipy >= 1.7.
+        try:
+            from scipy.stats.qmc import Sobol
+        except ImportError:
+            raise ImportError("Sobol sampling requires scipy >= 1.7, " +
+                              "use 'lhs' sampling instead.")
+        # a whole power of 2 keeps the balance properties of the sequence.
+        unit_points = Sobol(ndim, seed=seed).random_base2(
+            int(ceil(log2(number_of_points)))
+        )[:number_of_points]
+    else:
+        rng = default_rng(seed)
+        # one point in every one of the "number_of_points" strata of every
+        # dimension, randomly paired up across the dimensions.
+        unit_points = array([
+            rng.permutation(number_of_points) for _ in range(ndim)
+        ]).T + rng.uniform(size=(number_of_points, ndim))
+        unit_points /= number_of_points
+    
+    return bounds_low + unit_points * (bounds_upp - bounds_low)
+
+
 def find_initial_parameter_guesses(kinetic_temperature, column_density,
                                    voldens, volume_density,
-                                   constant_parameters,
-                                   core_count=cpu_count()):
+                                   constant_parameters, model_batch,
+                                   fit_parameters_names,
+                                   core_count=cpu_count(),
+                                   solver=None,
+                                   number_of_estimates=1,
+                                   search='brute',
+                                   max_evaluations=None,
+                                   resolution=0.05,
+                                   refined_cells=5,
+                                   seed=None,
+                                   grid_library=None,
+                                   line_indices=None,
+                                   pool=None):
     """calculate the initial parameter guesses to be used by MAGIX
     based on user supplied parameter fit information (bounds,
-    fit=True/False, observed data). This is done with spectralRadex's
-    grid running function that runs one (large) grid, from which the
-    parameter values with the lowest chi2 are chosen as initial
-    estimates. This global search method is not very optimized and is
-    sometimes referred to as the "brute method". Alternatives
-    would be the bees algorithm or particle swarm optimization amongst
-    other.
+    fit=True/False, observed data). This is done by running one (large)
+    grid of RADEX models, evaluated chunk by chunk (or an adaptive
+    coarse-to-fine grid), from which
+    the parameter values with the lowest chi2 are chosen as initial
+    estimates. This global search method is not
+    very optimized and is sometimes referred to as the "brute method".
+    Alternatives would be the bees algorithm or particle swarm optimization
+    amongst other.
 
     Args:
         summary = [name [str], value [float], (lim_low, lim_upp) [floats],
@@ -121,11 +418,66 @@ def find_initial_parameter_guesses(kinetic_temperature, column_density,
         constant_parameters (list): list of required constant parameters
         for spectralRadex and user data file information.
         
+        model_batch (function): batched RADEX model for the matching
+        lines, "AlgorithmHelpers.RADEX_model_batch()", which reads through
+        (and writes to) the model cache and store.
+        
+        fit_parameters_names (list[str]): names of the parameters to be
+        fit, in the order "model_batch" expects them.
+        
+        core_count (int): number of processors. Defaults to cpu_count().
+        
+        solver (str, optional): 'radex' (SpectralRadex, the grid is
+        distributed over a pool) -OR- 'numpy' (the vectorized escape
+        probability solver, the whole grid at once in this process).
+        Defaults to None (the solver "model_batch" uses by default).
+        
+        number_of_estimates (int): number of well-separated grid points
+        (not neighbours on the grid) with the lowest chi2 to return, e.g.
+        as starting points of a multi-start Levenberg-Marquardt. Defaults
+        to 1.
+        
+        search (str): one dense 'brute' grid -OR- an 'adaptive'
+        coarse-to-fine grid, see "adaptive_grid_search()" -OR- a particle
+        swarm ('pso'), see "particle_swarm_search()" -OR- a fixed number of
+        quasi-random 'sobol' or latin hypercube ('lhs') points, see
+        "space_filling_points()". Defaults to 'brute'.
+        
+        max_evaluations (int, optional): evaluation budget of the adaptive
+        grid, particle swarm and quasi-random points. Defaults to None
+        (until the target resolution, 1000 for the others).
+        
+        resolution (float): target grid spacing (log10) of the adaptive
+        grid. Defaults to 0.05.
+        
+        refined_cells (int): number of coarse grid cells the adaptive grid
+        subdivides. Defaults to 5.
+        
+        seed (int, optional): seed of the particle swarm and quasi-random
+        points. Defaults to None.
+
+        grid_library (GridLibrary, optional): library of precomputed grids.
+        If earlier 'brute' searches cover the bounds (see
+        "GridLibrary.covers()") the initial guesses are taken from it
+        without any RADEX calls, otherwise the search reads the points
+        already in the library from it and adds the new ones to it.
+        Defaults to None.
+
+        line_indices (list[int], optional): indices of the observed lines
+        in the molfile, required with a "grid_library". Defaults to None.
+
+        pool (multiprocessing.Pool, optional): pool (e.g. of a shared
+        "WorkerPool") the grid is distributed over with the 'radex'
+        solver. Defaults to None (a pool of "core_count" processes for the
+        grid search only).
+
 
     Returns:
-        list: list of lists of parameters that now contains the initial
-        parameter guesses for the values to be written to "parameters.xml"
-        for MAGIX.
+        numpy.array, str: (number_of_estimates, ndim) log10 of the initial
+        parameter guesses, in the order of "fit_parameters_names", the
+        lowest chi2 first (fewer if the grid has fewer well-separated
+        points), and the search method that was used ('library' if they
+        were taken from the "grid_library").
     """
     _, Tkin_value, Tkin_limits, Tkin_fit = kinetic_temperature
     _, cd_value, cd_limits, cd_fit     = column_density
@@ -133,18 +485,6 @@ def find_initial_parameter_guesses(kinetic_temperature, column_density,
      units, matching_index, user_datfile,
      uncertainties) = constant_parameters
 
-
-    # counting the number of parameters to fit (will later be used for
-    # masking spectralRadex output when comparing to observational data
-    # and when retreiving the best initial parameter guesses).
-    # excluding the volume densities for now (the next for loop accounts
-    # for those).
-    parameters_to_fit = [Tkin_fit, cd_fit]
-    number_of_parameters_to_fit = 0
-    for fit in parameters_to_fit:
-        if fit == True:
-            number_of_parameters_to_fit += 1
-
     Tkin_min, Tkin_max       = Tkin_limits
     cd_min, cd_max           = cd_limits
     voldens_min, voldens_max = voldens['min_max']
@@ -176,129 +516,111 @@ def find_initial_parameter_guesses(kinetic_temperature, column_density,
 
     # be sure to exclude the first and last point of the chosen limits
     # by taking endpoint=False and [1:] to exclude the starting point.
+    grid_axes = {}
     if Tkin_fit is True:
-        Tkin_grid = linspace(Tkin_min, Tkin_max,
-                             num_points_tkin + 1, endpoint=False)[1:]
-    else:
-        Tkin_grid = Tkin_value
+        grid_axes['tkin'] = linspace(Tkin_min, Tkin_max,
+                                     num_points_tkin + 1, endpoint=False)[1:]
 
     if cd_fit is True:
-        cd_grid = geomspace(cd_min, cd_max,
-                            num_points_cd + 1, endpoint=False)[1:]
-    else:
-        cd_grid = cd_value
-
+        grid_axes['cdmol'] = geomspace(cd_min, cd_max,
+                                       num_points_cd + 1, endpoint=False)[1:]
 
-    grid_guess_parameters = {}
     for collision_partner in voldens:
         # exclude the volume density bounds
-        if collision_partner is not 'min_max':
-            value, fit = voldens[collision_partner]
-            if fit is False:
-                grid_guess_parameters[collision_partner] = value
-            else:
-                number_of_parameters_to_fit += 1
-                grid_guess_parameters[collision_partner] = geomspace(
+        if collision_partner != 'min_max':
+            _, fit = voldens[collision_partner]
+            if fit is True:
+                grid_axes[collision_partner] = geomspace(
                     voldens_min, voldens_max, num_points_voldens + 1,
                     endpoint=False
                 )[1:]
 
-    grid_guess_parameters['tkin']      = Tkin_grid
-    grid_guess_parameters['cdmol']     = cd_grid
-    grid_guess_parameters['molfile']   = user_molfile
-    grid_guess_parameters['tbg']       = Tbg
-    grid_guess_parameters['linewidth'] = dv
-    grid_guess_parameters['fmin']      = freq_min
-    grid_guess_parameters['fmax']      = freq_max
-    grid_guess_parameters['geometry']  = geom
-    # print(grid_guess_parameters)
-
-    
-    # FIXME: use psutil.cpu_count(logical=True) instead?
-    pool = Pool(processes=core_count)
-
-    grid_output_DataFrame = run_grid(grid_guess_parameters,
-                                     target_value=units,
-                                     pool=pool)
-    # FIXME: instead of ".to_numpy()" use pandas dataframe namings for
-    # columns instead? might make code clearer but speed should not
-    # be an issue to begin with (see example in SpectralRadex code
-    # or in LM.py/MCMC.py).
-    grid_output = grid_output_DataFrame.to_numpy()
+    y_observed, y_uncertainties = data_file_extraction(user_datfile,
+                                                       uncertainties)
 
-    # "number_of_parameters_to_fit" accounts for the variable parameters
-    # used in the grid calculations (and also output) by spectralRadex
-    # and thus in need of removal when compared to user data.
-    grid_output_cut = grid_output[:,number_of_parameters_to_fit:]
+    def grid_chi2(grid_points):
+        """chi2 of a batch of grid points.
 
+        Args:
+            grid_points (numpy.array): (N, ndim) log10(parameters), in the
+            order of "fit_parameters_names".
+            
 
-    # only take the spectralRadex output for matching (observed) lines
-    # taken from the data file.
-    grid_output_to_compare = grid_output_cut[
-        ix_(full(grid_output_cut.shape[0], True), matching_index)
-    ]
+        Returns:
+            numpy.array: (N,) chi2, NaN for models RADEX failed to
+            calculate.
+        """
+        
+        grid_output_to_compare = model_batch(grid_points, pool, solver)
+        
+        # using '[None,:]' to "match" the dimensionality of
+        # 'grid_output_to_compare' and be able to easily vectorize the chi2
+        # calculation.
+        return chi_squared(grid_output_to_compare,
+                           y_observed[None,:], y_uncertainties[None,:],
+                           uncertainties)
+
+    limits = {'tkin':Tkin_limits, 'cdmol':cd_limits}
+    bounds = log10([limits.get(name, voldens['min_max'])
+                    for name in fit_parameters_names]).T
+    if grid_library is not None:
+        model_batch = grid_library.model_batch(units, line_indices)
+        search = 'library' if grid_library.covers(*bounds) else search
 
-    y_observed, y_uncertainties = data_file_extraction(user_datfile,
-                                                       uncertainties)
-    
-    # using '[None,:]' to "match" the dimensionality of
-    # 'grid_output_to_compare' and be able to easily vectorize the chi2
-    # calculation.
-    chi2 = chi_squared(grid_output_to_compare,
-                       y_observed[None,:], y_uncertainties[None,:],
-                       uncertainties)
-
-    min_chi2_index = int(where(chi2 == chi2.min())[0][0])
-
-    ## ignore UserWarning ##
-    # user warning is that irrelevant columns have the same name.
-    def usr():
-        warnings.warn("user warning", UserWarning)
-
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
-        usr()
-        grid_output_dict = grid_output_DataFrame.to_dict()
-    ## ignore UserWarning ##
-
-
-    global_parameter_estimates = array([])
-    if Tkin_fit == True:
-        global_tkin = grid_output_dict['tkin'][min_chi2_index]
-        global_parameter_estimates = append(
-            global_parameter_estimates, log10(global_tkin)
-        )
-        
-    if cd_fit == True:
-        global_cd = grid_output_dict['cdmol'][min_chi2_index]
-        global_parameter_estimates = append(
-            global_parameter_estimates, log10(global_cd)
-        )
-        
-
-    ## suppress deprecation warning ##
-    def depr():
-        warnings.warn("deprecated", DeprecationWarning)
-
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
-        depr()
-        # save the initial parameter guesses (vol_dens) to appropriate lists.
-        for collision_partner in volume_density:
-            col_partner_name, *_, col_partner_fit = collision_partner
-            if col_partner_fit == True:
-                collision_partner_index = int(
-                    where(
-                        array(volume_density).T[0] == col_partner_name
-                        )[0][0]
-                )
-                volume_density[collision_partner_index][1] = (
-                    grid_output_dict[col_partner_name][min_chi2_index]
-                )
-                global_vd = grid_output_dict[col_partner_name][min_chi2_index]
-                global_parameter_estimates = append(
-                    global_parameter_estimates, log10(global_vd)
-                )
-    ## suppress deprecation warning ##
+    # FIXME: use psutil.cpu_count(logical=True) instead?
+    with (nullcontext(pool) if (solver == 'numpy' or search == 'library' or
+                                pool is not None)
+          else Pool(processes=core_count)) as pool:
+        if search == 'library':
+            # the library already samples the bounds, no RADEX calls.
+            print("Initial parameter guesses taken from the grid library " +
+                  f"({grid_library.number_of_points()} points).")
+            global_parameter_estimates = grid_library.initial_guesses(
+                y_observed, y_uncertainties, uncertainties, units,
+                line_indices, *bounds, number_of_estimates
+            )
+        elif search == 'adaptive':
+            grid_points, chi2, grid_positions = adaptive_grid_search(
+                *bounds, grid_chi2, refined_cells=refined_cells,
+                resolution=resolution, max_evaluations=max_evaluations
+            )
+        elif search == 'pso':
+            grid_points, chi2, grid_positions = particle_swarm_search(
+                *bounds, grid_chi2, seed=seed,
+                max_evaluations=(1000 if max_evaluations is None
+                                 else max_evaluations)
+            )
+        elif search in ['sobol', 'lhs']:
+            grid_points = space_filling_points(
+                *bounds, 1000 if max_evaluations is None else max_evaluations,
+                search, seed
+            )
+            chi2 = grid_chi2(grid_points)
+            # in units of a sixth of the ranges, like the other searches.
+            grid_positions = (grid_points - bounds[0]) / (
+                (bounds[1] - bounds[0]) / 6.0
+            )
+        else:
+            # the grid axes in log10(parameters), in the order of
+            # "fit_parameters_names". Only the best grid points are kept.
+            grid_points, chi2, grid_positions = streaming_grid_search(
+                [log10(grid_axes[name]) for name in fit_parameters_names],
+                grid_chi2, number_of_estimates
+            )
+
+    if search != 'library':
+        best_indices = well_separated_minima(chi2, grid_positions,
+                                             number_of_estimates)
+        global_parameter_estimates = grid_points[best_indices]
+        if grid_library is not None:
+            grid_library.add_searched_bounds(*bounds, search)
+
+    # save the initial parameter guesses (vol_dens) to appropriate lists.
+    for collision_partner in volume_density:
+        col_partner_name, *_, col_partner_fit = collision_partner
+        if col_partner_fit == True:
+            collision_partner[1] = 10.0**global_parameter_estimates[
+                0, fit_parameters_names.index(col_partner_name)
+            ]
     
-    return global_parameter_estimates
\ No newline at end of file
+    return global_parameter_estimates, search
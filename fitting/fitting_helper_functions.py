@@ -3,12 +3,106 @@
 
 # module imports
 from numpy import (
+    asarray,
+    atleast_2d,
+    full,
     inf,
+    isfinite,
     log,
-    pi
+    nan,
+    pi,
+    where
 )
 from numpy import sum as np_sum
-from spectralradex.radex import run
+from spectralradex.radex import add_data_path, from_dict
+
+# relative imports
+from .escape_probability import EscapeProbabilitySolver
+from .model_cache import process_model_cache
+from .warm_start import process_warm_start_store
+from .worker_pool import worker_RADEX_all_lines
+from user_input.lamda_molecule import load_lamda_molecule
+
+
+# rows of the raw (Spectral)RADEX output array ("from_dict") that hold the
+# line frequencies and the supported line strength units. These are the
+# same columns "spectralradex.radex.run()" puts in its DataFrame.
+RADEX_OUTPUT_ROWS = {
+    'freq':1,
+    'T_R (K)':5,
+    'FLUX (K*km/s)':8,
+    'FLUX (erg/cm2/s)':9
+}
+
+
+def RADEX_line_strengths(parameters, unit_key):
+    """run (Spectral)RADEX once and return the line strengths of all lines
+    within (fmin, fmax), without building a pandas DataFrame. Mirrors
+    "spectralradex.radex.run()" but skips the DataFrame construction and
+    the quantum number decoding, which cost about as much as the radiative
+    transfer itself for small molecules like CO.
+
+    Args:
+        parameters (dict): SpectralRadex input dictionary.
+        
+        unit_key (str): line strength units to return => T_R (K) -OR-
+        FLUX (K*km/s) -OR- FLUX (erg/cm2/s).
+        
+
+    Returns:
+        nd.array: line strengths of all lines within (fmin, fmax), or None
+        if RADEX failed.
+    """
+    
+    parameters['molfile'] = add_data_path(parameters['molfile'])
+    success, number_of_lines, _, _, radex_output = from_dict(parameters)
+    if success != 1:
+        print("RADEX Failed, check RADEX error messages\nYour parameters " +
+              f"were:\n{parameters}")
+        return None
+
+    frequencies = radex_output[RADEX_OUTPUT_ROWS['freq'], :number_of_lines]
+    in_range = ((frequencies > parameters['fmin']) &
+                (frequencies < parameters['fmax']))
+
+    return radex_output[RADEX_OUTPUT_ROWS[unit_key], :number_of_lines][
+        in_range
+    ]
+
+
+# the line strength units, in the order of "RADEX_all_units()".
+LINE_STRENGTH_UNITS = ['T_R (K)', 'FLUX (K*km/s)', 'FLUX (erg/cm2/s)']
+
+
+def RADEX_all_units(arguments):
+    """run (Spectral)RADEX once and return the line strengths of all lines
+    of the molfile in all units, as a pool task.
+
+    Args:
+        arguments (tuple): SpectralRadex input dictionary of the constant
+        parameters, names and log10 values of the fit parameters and the
+        number of lines of the molfile.
+        
+
+    Returns:
+        nd.array: (3, n_lines_molfile) line strengths in the units of
+        "LINE_STRENGTH_UNITS" (NaN if RADEX failed).
+    """
+    
+    parameters, fit_parameters_names, fit_parameters_values, \
+        number_of_lines = arguments
+    parameters = dict(parameters, fmin=0.0, fmax=3.0e7)
+    parameters.update(zip(fit_parameters_names, 10.0**fit_parameters_values))
+    
+    success, radex_number_of_lines, _, _, radex_output = from_dict(
+        parameters
+    )
+    if success != 1 or radex_number_of_lines != number_of_lines:
+        return full((len(LINE_STRENGTH_UNITS), number_of_lines), nan)
+    
+    return radex_output[[RADEX_OUTPUT_ROWS[unit_key]
+                         for unit_key in LINE_STRENGTH_UNITS],
+                        :number_of_lines]
 
 
 class AlgorithmHelpers:
@@ -20,7 +114,9 @@ class AlgorithmHelpers:
                  bounds_upp,
                  constant_parameters,
                  matching_lines,
-                 fit_parameters_names):
+                 fit_parameters_names,
+                 model_store=None,
+                 solver='radex'):
         """constant variables/parameters required by the fitting
         algorithms but not necessarily able to be passed through outright.
 
@@ -38,8 +134,8 @@ class AlgorithmHelpers:
             
             unit_key (str): string of what units the user supplied data
             consists of => T_R (K) -OR- FLUX (K*km/s) -OR- FLUX (erg/cm2/s).
-            To be used in "RADEX_model()" as a "key" to slice SpectralRadex
-            output.
+            To be used in "RADEX_model_batch()" as a "key" to select the
+            SpectralRadex output row.
             
             bounds_low (numpy.array[float]): lower bounds of all parameters
             to be fit => [par_1_low, par_2_low, ..., par_n_low], to be used
@@ -63,6 +159,15 @@ class AlgorithmHelpers:
             SpectralRadex, of parameters to be fit. To be used in
             "RADEX_model()".
             
+            model_store (ModelStore, optional): on-disk store of RADEX
+            models shared across runs, read from and written to by
+            "RADEX_line_strengths_batch()". Defaults to None.
+            
+            solver (str): how RADEX models are calculated by default,
+            'radex' (SpectralRadex, one model per call) -OR- 'numpy' (the
+            vectorized "EscapeProbabilitySolver", all models of a batch at
+            once). Defaults to 'radex'.
+            
 
         Retrun:
             None
@@ -76,6 +181,27 @@ class AlgorithmHelpers:
         self.parameters            = constant_parameters
         self.matching_lines        = matching_lines
         self.fit_parameters_names  = fit_parameters_names
+
+        self.number_of_lines          = matching_lines.shape[0]
+        self.number_of_matching_lines = int(matching_lines.sum())
+
+        # resolve the molfile path once, so the model cache keys do not
+        # change after the first SpectralRadex call.
+        self.parameters['molfile'] = add_data_path(
+            self.parameters['molfile']
+        )
+
+        # an (optional) "RADEXEmulator" used by "log_likelihood()" instead
+        # of exact RADEX models.
+        self.emulator = None
+
+        self.solver = solver
+        # created on first use, see "RADEX_line_strengths_batch()".
+        self.escape_probability_solver = None
+
+        # buckets of the model store per solver, created on first use.
+        self.model_store         = model_store
+        self.model_store_buckets = {}
         
         return
         
@@ -92,6 +218,253 @@ class AlgorithmHelpers:
             nd.array: RADEX line strength output for matching lines.
         """
         
+        return self.RADEX_model_batch(fit_parameters_values)[0]
+
+
+    def RADEX_model_batch(self, fit_parameters_values_2d, pool=None,
+                          solver=None):
+        """Calculates RADEX models for a batch of parameter vectors, only
+        keeping the line strengths of the observed transitions. No pandas
+        DataFrame is built for any of the models.
+
+        Args:
+            fit_parameters_values_2d (nd.array): (N, ndim) array of which
+            every row contains the parameter values of the parameters to be
+            fit. A single (ndim,) parameter vector is treated as N = 1.
+            
+            pool (multiprocessing.Pool, optional): if supplied, the models
+            that have to be calculated are distributed over its processes.
+            Defaults to None.
+            
+            solver (str, optional): 'radex' -OR- 'numpy', see "__init__()".
+            Defaults to None (the solver set in "__init__()").
+            
+
+        Returns:
+            nd.array: (N, n_lines) RADEX line strength output for matching
+            lines.
+        """
+        
+        # cut (Spectral)RADEX output to match the user observed 
+        # lines, provided in the datafile.
+        return self.RADEX_line_strengths_batch(
+            fit_parameters_values_2d, pool, solver
+        )[:, self.matching_lines]
+
+
+    def RADEX_line_strengths_batch(self, fit_parameters_values_2d,
+                                   pool=None, solver=None):
+        """Calculates RADEX models for a batch of parameter vectors and
+        returns the line strengths of all lines. Models are taken from the
+        model cache of this process first, then from the model store (if
+        any), and only the remaining ones are calculated (with SpectralRadex
+        or the escape probability solver) and added to both.
+
+        Args:
+            fit_parameters_values_2d (nd.array): (N, ndim) array of which
+            every row contains the parameter values of the parameters to be
+            fit.
+            
+            pool (multiprocessing.Pool, optional): if supplied, the models
+            that have to be calculated are distributed over its processes.
+            Defaults to None. Not used by the 'numpy' solver, which
+            calculates all models at once in this process.
+            
+            solver (str, optional): 'radex' -OR- 'numpy', see "__init__()".
+            Defaults to None (the solver set in "__init__()").
+            
+
+        Returns:
+            nd.array: (N, n_lines_total) RADEX line strength output (NaN
+            for the models RADEX failed to calculate).
+        """
+        
+        if solver is None:
+            solver = self.solver
+        model_store_bucket = self.model_store_bucket(solver)
+
+        fit_parameters_values_2d = atleast_2d(
+            asarray(fit_parameters_values_2d, dtype=float)
+        )
+        line_strengths = full(
+            (fit_parameters_values_2d.shape[0], self.number_of_lines), nan
+        )
+
+        cache_keys = [
+            process_model_cache.key(self.fit_parameters_names,
+                                    fit_parameters_values, self.parameters,
+                                    self.unit_key, solver)
+            for fit_parameters_values in fit_parameters_values_2d
+        ]
+        to_calculate = []
+        for i, cache_key in enumerate(cache_keys):
+            cached_line_strengths = process_model_cache.get(cache_key)
+            if cached_line_strengths is None:
+                to_calculate += [i]
+            else:
+                line_strengths[i] = cached_line_strengths
+
+        if to_calculate and model_store_bucket is not None:
+            found, stored_line_strengths = model_store_bucket.lookup(
+                fit_parameters_values_2d[to_calculate]
+            )
+            for i, stored, found_i in zip(to_calculate,
+                                          stored_line_strengths, found):
+                if found_i:
+                    line_strengths[i] = stored
+                    process_model_cache.put(cache_keys[i], stored)
+            to_calculate = [i for i, found_i in zip(to_calculate, found)
+                            if not found_i]
+
+        if not to_calculate:
+            return line_strengths
+
+        if solver == 'numpy':
+            if self.escape_probability_solver is None:
+                self.escape_probability_solver = EscapeProbabilitySolver(
+                    self.parameters['molfile'],
+                    tkin_range=self.kinetic_temperature_range()
+                )
+            # NOTE: Fortran RADEX (SpectralRadex) always starts from the
+            # optically thin solution, only this solver can be warm started.
+            calculated = self.escape_probability_solver.line_output_batch(
+                self.parameters, self.fit_parameters_names,
+                fit_parameters_values_2d[to_calculate],
+                process_warm_start_store
+            )[:, RADEX_OUTPUT_ROWS[self.unit_key]]
+        elif pool is None:
+            calculated = list(map(self.RADEX_all_lines,
+                                  fit_parameters_values_2d[to_calculate]))
+        # the workers of a "WorkerPool" started with these fitting constants
+        # have them installed already, no need to pickle them every chunk.
+        elif getattr(pool, 'registered_alg_help', None) is self:
+            calculated = pool.map(worker_RADEX_all_lines,
+                                  fit_parameters_values_2d[to_calculate])
+        else:
+            calculated = pool.map(self.RADEX_all_lines,
+                                  fit_parameters_values_2d[to_calculate])
+        line_strengths[to_calculate] = calculated
+
+        if model_store_bucket is not None:
+            model_store_bucket.insert(
+                fit_parameters_values_2d[to_calculate],
+                line_strengths[to_calculate]
+            )
+        for i in to_calculate:
+            if isfinite(line_strengths[i]).all():
+                process_model_cache.put(cache_keys[i],
+                                        line_strengths[i].copy())
+
+        return line_strengths
+
+
+    def model_store_bucket(self, solver):
+        """bucket of the model store holding the models of a solver.
+
+        Args:
+            solver (str): 'radex' -OR- 'numpy'.
+            
+
+        Returns:
+            ModelStoreBucket: the bucket, None without a model store.
+        """
+        
+        if self.model_store is None:
+            return None
+        if solver not in self.model_store_buckets:
+            self.model_store_buckets[solver] = self.model_store.bucket(
+                self.parameters, self.fit_parameters_names, self.unit_key,
+                self.number_of_lines, solver
+            )
+        
+        return self.model_store_buckets[solver]
+
+
+    def RADEX_all_units_batch(self, fit_parameters_values_2d, pool=None,
+                              solver=None):
+        """Calculates RADEX models for a batch of parameter vectors and
+        returns the line strengths of all lines of the molfile (regardless
+        of fmin and fmax) in all units, e.g. for the "GridLibrary". These
+        are not read from or written to the model cache and store, which
+        hold the lines and units of this fit only.
+
+        Args:
+            fit_parameters_values_2d (nd.array): (N, ndim) log10 values of
+            the fit parameters.
+            
+            pool (multiprocessing.Pool, optional): see
+            "RADEX_line_strengths_batch()". Defaults to None.
+            
+            solver (str, optional): 'radex' -OR- 'numpy', see "__init__()".
+            Defaults to None (the solver set in "__init__()").
+            
+
+        Returns:
+            nd.array: (N, 3, n_lines_molfile) line strengths in the units of
+            "LINE_STRENGTH_UNITS" (NaN for failed models).
+        """
+        
+        if solver is None:
+            solver = self.solver
+        fit_parameters_values_2d = atleast_2d(
+            asarray(fit_parameters_values_2d, dtype=float)
+        )
+        
+        if solver == 'numpy':
+            if self.escape_probability_solver is None:
+                self.escape_probability_solver = EscapeProbabilitySolver(
+                    self.parameters['molfile'],
+                    tkin_range=self.kinetic_temperature_range()
+                )
+            return self.escape_probability_solver.line_output_batch(
+                dict(self.parameters, fmin=0.0, fmax=3.0e7),
+                self.fit_parameters_names, fit_parameters_values_2d,
+                process_warm_start_store
+            )[:, [RADEX_OUTPUT_ROWS[unit_key]
+                  for unit_key in LINE_STRENGTH_UNITS]]
+        
+        number_of_lines = load_lamda_molecule(
+            self.parameters['molfile']
+        ).number_of_lines
+        tasks = [(self.parameters, self.fit_parameters_names,
+                  fit_parameters_values, number_of_lines)
+                 for fit_parameters_values in fit_parameters_values_2d]
+        if pool is None:
+            return asarray(list(map(RADEX_all_units, tasks)))
+        
+        return asarray(pool.map(RADEX_all_units, tasks))
+
+
+    def kinetic_temperature_range(self):
+        """range of kinetic temperatures the models are calculated for,
+        the bounds if it is fit, e.g. for the collision rate table of the
+        "EscapeProbabilitySolver".
+
+        Returns:
+            tuple: lowest and highest kinetic temperature [K].
+        """
+
+        if 'tkin' in self.fit_parameters_names:
+            index = self.fit_parameters_names.index('tkin')
+            return (10.0**self.bounds_low[index], 10.0**self.bounds_upp[index])
+
+        return (self.parameters['tkin'], self.parameters['tkin'])
+
+
+    def RADEX_all_lines(self, fit_parameters_values):
+        """run a single RADEX model, used by "RADEX_line_strengths_batch()"
+        for every model that has to be calculated.
+
+        Args:
+            fit_parameters_values (nd.array): contains the parameter values
+            of the parameters to be fit.
+            
+
+        Returns:
+            nd.array: RADEX line strength output for all lines (NaN if
+            RADEX failed).
+        """
+        
         variable_parameters = {
             variable_parameter_name:variable_parameter_value
             for variable_parameter_name, variable_parameter_value
@@ -101,20 +474,16 @@ class AlgorithmHelpers:
         self.parameters.update(variable_parameters)
 
         # NOTE: if I use this to cut the output (for performance?), then
-        # "output_matching_observation" has to be reworked as well since it
+        # "RADEX_model_batch" has to be reworked as well since it
         # expects the full output.
         # output_limit = (
         #     self.matching_line_indeces[0] + self.matching_line_indeces[-1] + 1
         # )
-        radex_output = run(self.parameters)#.head(output_limit)
+        radex_output = RADEX_line_strengths(self.parameters, self.unit_key)
+        if radex_output is None:
+            return full(self.number_of_lines, nan)
 
-        # cut (Spectral)RADEX output to match the user observed 
-        # lines, provided in the datafile.
-        output_matching_observation = radex_output.loc[
-            self.matching_lines, self.unit_key
-        ].to_numpy()
-
-        return output_matching_observation
+        return radex_output
 
 
 ### MCMC functions only ###
@@ -122,7 +491,7 @@ class AlgorithmHelpers:
     # FIXME: optimize this for speed? define a residuals function?
     def log_likelihood(self, fit_parameters_values):
         """logarithm of the likelihood distribution over datasets
-        for the RADEX model.
+        for the RADEX model (or its emulator if one is set).
 
         Args:
             fit_parameters_values (numpy array): values of the variable
@@ -133,7 +502,15 @@ class AlgorithmHelpers:
             float: logarithm of the likelihood distribution.
         """
         
-        y_RADEX = self.RADEX_model(fit_parameters_values)
+        if self.emulator is None:
+            y_RADEX = self.RADEX_model(fit_parameters_values)
+        else:
+            y_RADEX = self.emulator.line_strengths_batch(
+                atleast_2d(fit_parameters_values)
+            )[0, self.matching_lines]
+            # next to a failed emulator grid model.
+            if not isfinite(y_RADEX).all():
+                return -inf
         
         return - 0.5 * (log(2 * pi) + np_sum(
             2 * log(self.y_err) + ( (self.y_obs - y_RADEX) / self.y_err )**2
@@ -141,6 +518,46 @@ class AlgorithmHelpers:
         )
 
 
+    def log_likelihood_batch(self, y_RADEX_2d):
+        """vectorized "log_likelihood()" for a batch of RADEX models.
+
+        Args:
+            y_RADEX_2d (nd.array): (N, n_lines) RADEX line strengths for
+            matching lines.
+        
+
+        Returns:
+            nd.array: (N,) logarithms of the likelihood distribution.
+        """
+        
+        return - 0.5 * (log(2 * pi) + np_sum(
+            2 * log(self.y_err) + ( (self.y_obs - y_RADEX_2d) / self.y_err )**2,
+            axis=1
+            )
+        )
+
+
+    def log_prior_batch(self, fit_parameters_values_2d):
+        """vectorized "log_prior()" for a batch of parameter vectors.
+
+        Args:
+            fit_parameters_values_2d (nd.array): (N, ndim) values of the
+            variable parameters to be fit in the MCMC algorithm.
+            
+
+        Returns:
+            nd.array: (N,) "-inf" (outside limits) or "0.0" (within
+            limits).
+        """
+        
+        within_limits = (
+            (fit_parameters_values_2d >= self.bounds_low) &
+            (fit_parameters_values_2d <= self.bounds_upp)
+        ).all(axis=1)
+        
+        return where(within_limits, 0.0, -inf)
+
+
     def log_prior(self, fit_parameters_values):
         """logarithm of the uniform prior that solely checks if the
         walkers from the MCMC chain are within the supplied limits.
@@ -191,4 +608,50 @@ class AlgorithmHelpers:
 
         return
 
+
+    def log_probability_batch(self, fit_parameters_values_2d, pool=None):
+        """vectorized "log_probability()" for the whole ensemble of walkers
+        (emcee's "vectorize=True"). The walkers outside the limits are
+        rejected with one comparison and the others are evaluated with one
+        "RADEX_model_batch()" call, distributed over the pool (SpectralRadex)
+        or all at once (the 'numpy' solver), or with the emulator if one is
+        set.
+
+        Args:
+            fit_parameters_values_2d (nd.array): (nwalkers, ndim) values of
+            the variable parameters to be fit in the MCMC algorithm.
+            
+            pool (multiprocessing.Pool, optional): see
+            "RADEX_model_batch()". Defaults to None.
+            
+
+        Returns:
+            nd.array: (nwalkers,) logarithms of the probability
+            distribution, "-inf" outside the limits and for the models RADEX
+            failed to calculate.
+        """
+        
+        fit_parameters_values_2d = atleast_2d(
+            asarray(fit_parameters_values_2d, dtype=float)
+        )
+        log_probabilities = self.log_prior_batch(fit_parameters_values_2d)
+        within_limits = isfinite(log_probabilities)
+        if not within_limits.any():
+            return log_probabilities
+        
+        if self.emulator is None:
+            y_RADEX_2d = self.RADEX_model_batch(
+                fit_parameters_values_2d[within_limits], pool
+            )
+        else:
+            y_RADEX_2d = self.emulator.line_strengths_batch(
+                fit_parameters_values_2d[within_limits]
+            )[:, self.matching_lines]
+        log_likelihoods = self.log_likelihood_batch(y_RADEX_2d)
+        # emcee does not accept NaN log probabilities.
+        log_probabilities[within_limits] += where(isfinite(log_likelihoods),
+                                                  log_likelihoods, -inf)
+        
+        return log_probabilities
+
 ### MCMC functions only ###
\ No newline at end of file
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+
+# module imports
+from hashlib import sha1
+from itertools import product
+from pathlib import Path
+import json
+
+from numpy import (
+    all as np_all,
+    any as np_any,
+    array,
+    asarray,
+    atleast_2d,
+    concatenate,
+    empty,
+    float64,
+    fromfile,
+    full,
+    isfinite,
+    memmap,
+    nan,
+    round as np_round,
+    zeros
+)
+# relative imports
+from .find_initial_guess import chi_squared, well_separated_minima
+from .fitting_helper_functions import LINE_STRENGTH_UNITS
+from .model_store import FileLock, molfile_hash
+
+
+# file names of the line strength columns, per unit.
+COLUMN_FILES = {
+    'T_R (K)':'T_R.bin',
+    'FLUX (K*km/s)':'flux_K_km_s.bin',
+    'FLUX (erg/cm2/s)':'flux_erg_cm2_s.bin'
+}
+
+
+class GridLibrary:
+    def __init__(self, directory, parameters, fit_parameters_names,
+                 number_of_lines, all_units_batch=None, solver='radex',
+                 decimals=12, coverage_cells=5, chunk_size=65536):
+        """on-disk library of precomputed RADEX grids, so the global search
+        of a new spectrum of the same molecule (and constant parameters)
+        gets its initial guesses without any RADEX calls.
+
+        Unlike the "ModelStore", which holds the matching lines in the
+        units of one fit, the library stores every line of the molfile in
+        all units. Every molfile/constant parameters/fit parameters/solver
+        combination gets its own directory, named after the hash of that
+        combination, with append-only binary columns of fixed size
+        records: "parameters.bin" holding the log10(fit parameters) and
+        one file per unit holding the line strengths of all lines. New
+        grid points are appended to it by "model_batch()".
+
+        Args:
+            directory (str): root directory of the library, created if
+            needed.
+
+            parameters (dict): SpectralRadex input, the entries of the fit
+            parameters and the frequency range are ignored.
+
+            fit_parameters_names (list[str]): names of the fit parameters.
+
+            number_of_lines (int): number of lines of the molfile.
+
+            all_units_batch (function, optional): RADEX models of all lines
+            in all units to extend the library with,
+            "AlgorithmHelpers.RADEX_all_units_batch()". Defaults to None
+            (the library is only read).
+
+            solver (str): solver the models are calculated with ('radex'
+            -OR- 'numpy'). Defaults to 'radex'.
+
+            decimals (int): number of decimals the log10(parameters) are
+            rounded to, to recognise points already in the library.
+            Defaults to 12.
+
+            coverage_cells (int): number of cells per fit parameter the
+            bounds are divided in by "covers()", for bounds covered by
+            several earlier searches together. Defaults to 5.
+
+            chunk_size (int): number of library points per chunk of the chi2
+            scan of "initial_guesses()". Defaults to 65536.
+
+
+        Returns:
+            None
+        """
+
+        self.fit_parameters_names = list(fit_parameters_names)
+        self.ndim                 = len(self.fit_parameters_names)
+        self.number_of_lines      = int(number_of_lines)
+        self.all_units_batch      = all_units_batch
+        self.decimals             = decimals
+        self.coverage_cells       = coverage_cells
+        self.chunk_size           = chunk_size
+
+        self.description = {
+            'molfile_sha1':molfile_hash(parameters['molfile']),
+            'constant_parameters':{
+                name:value for name, value in sorted(parameters.items())
+                if name not in self.fit_parameters_names and
+                name not in ['molfile', 'fmin', 'fmax']
+            },
+            'fit_parameters_names':self.fit_parameters_names,
+            'number_of_lines':self.number_of_lines,
+            'units':LINE_STRENGTH_UNITS,
+            'solver':solver
+        }
+        description_json = json.dumps(self.description, sort_keys=True,
+                                      default=float)
+        self.path = Path(directory) / sha1(
+            description_json.encode()
+        ).hexdigest()
+
+        self.parameters_path = self.path / 'parameters.bin'
+        self.lock_path       = self.path / 'library.lock'
+
+        # library points read so far and their rows, {rounded
+        # parameters:row}.
+        self.points = zeros((0, self.ndim))
+        self.rows   = {}
+
+        return
+
+
+    def number_of_points(self):
+        """number of points in the library. Only complete parameter records
+        are counted, the line strengths are always written before them.
+
+        Returns:
+            int: number of points.
+        """
+
+        try:
+            return self.parameters_path.stat().st_size // (8 * self.ndim)
+        except FileNotFoundError:
+            return 0
+
+
+    def refresh(self):
+        """read the points appended (by any process) since the last
+        refresh.
+
+        Returns:
+            None
+        """
+
+        number_of_points = self.number_of_points()
+        number_read = self.points.shape[0]
+        if number_of_points == number_read:
+            return
+
+        with open(self.parameters_path, 'rb') as parameters_file:
+            parameters_file.seek(8 * self.ndim * number_read)
+            new_points = fromfile(
+                parameters_file, dtype=float64,
+                count=self.ndim * (number_of_points - number_read)
+            ).reshape(-1, self.ndim)
+
+        for row, key in enumerate(new_points.tolist(), number_read):
+            self.rows.setdefault(tuple(key), row)
+        self.points = concatenate([self.points, new_points])
+
+        return
+
+
+    def column(self, unit_key):
+        """memory-mapped line strengths of all library points in a unit.
+
+        Args:
+            unit_key (str): line strength units, see "LINE_STRENGTH_UNITS".
+
+
+        Returns:
+            numpy.memmap: (n_points, n_lines) line strengths.
+        """
+
+        return memmap(self.path / COLUMN_FILES[unit_key], dtype=float64,
+                      mode='r',
+                      shape=(self.points.shape[0], self.number_of_lines))
+
+
+    def searched_bounds(self):
+        """bounds of the global searches the library was built by.
+
+        Returns:
+            list[dict]: 'bounds_low' and 'bounds_upp' (in log10) and the
+            'search' method of every search.
+        """
+
+        try:
+            searched_bounds = json.loads(
+                (self.path / 'searched_bounds.json').read_text()
+            )
+        except FileNotFoundError:
+            return []
+
+        # NOTE: libraries written before the search method was recorded
+        # hold bare (bounds_low, bounds_upp) pairs of any search, these
+        # are not trusted by "covers()".
+        return [search for search in searched_bounds
+                if isinstance(search, dict)]
+
+
+    def add_searched_bounds(self, bounds_low, bounds_upp, search):
+        """record that a global search over the bounds added its points to
+        the library, see "covers()".
+
+        Args:
+            bounds_low (numpy.array): (ndim,) lower bounds in log10.
+
+            bounds_upp (numpy.array): (ndim,) upper bounds in log10.
+
+            search (str): search method, see
+            "find_initial_parameter_guesses()".
+
+
+        Returns:
+            None
+        """
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        with FileLock(self.lock_path):
+            searched_bounds = self.searched_bounds() + [{
+                'bounds_low':list(map(float, bounds_low)),
+                'bounds_upp':list(map(float, bounds_upp)),
+                'search':search
+            }]
+            (self.path / 'searched_bounds.json').write_text(
+                json.dumps(searched_bounds)
+            )
+
+        return
+
+
+    def covers(self, bounds_low, bounds_upp):
+        """whether the library already samples the bounds densely: every
+        cell of a lattice of "coverage_cells" cells per fit parameter over
+        the bounds lies within the bounds of an earlier 'brute' search (so
+        also bounds within those of a single search). The points of the
+        other searches are clustered around the minima of the spectra they
+        were run for, the initial guesses of another spectrum can not be
+        taken from them.
+
+        Args:
+            bounds_low (numpy.array): (ndim,) lower bounds in log10.
+
+            bounds_upp (numpy.array): (ndim,) upper bounds in log10.
+
+
+        Returns:
+            bool: True if the library samples the bounds.
+        """
+
+        bounds_low = asarray(bounds_low, dtype=float)
+        bounds_upp = asarray(bounds_upp, dtype=float)
+        searched = [search for search in self.searched_bounds()
+                    if search['search'] == 'brute']
+        if not searched:
+            return False
+        searched_low = array([search['bounds_low'] for search in searched])
+        searched_upp = array([search['bounds_upp'] for search in searched])
+
+        cell_sizes = (bounds_upp - bounds_low) / self.coverage_cells
+        cells_low = bounds_low + array(list(product(
+            range(self.coverage_cells), repeat=self.ndim
+        ))) * cell_sizes
+        cells_upp = cells_low + cell_sizes
+        # (n_cells, n_searches) whether the cell lies within the search,
+        # up to rounding errors.
+        within = np_all(
+            (cells_low[:, None] >= searched_low[None] - 1e-9) &
+            (cells_upp[:, None] <= searched_upp[None] + 1e-9),
+            axis=2
+        )
+
+        return bool(np_any(within, axis=1).all())
+
+
+    def initial_guesses(self, y_obs, y_err, uncertainty, unit_key,
+                        line_indices, bounds_low, bounds_upp,
+                        number_of_estimates=1):
+        """the well-separated library points within the bounds with the
+        lowest chi2, calculated by scanning the library in chunks and only
+        reading the observed lines.
+
+        Args:
+            y_obs (numpy.array): observed line strengths.
+
+            y_err (numpy.array): observed line strength uncertainties.
+
+            uncertainty (str): are uncertainties included ('yes', 'no').
+
+            unit_key (str): line strength units of the observations.
+
+            line_indices (list[int]): indices of the observed lines in the
+            molfile.
+
+            bounds_low (numpy.array): (ndim,) lower bounds in log10.
+
+            bounds_upp (numpy.array): (ndim,) upper bounds in log10.
+
+            number_of_estimates (int): number of points to return, see
+            "well_separated_minima()". Defaults to 1.
+
+
+        Returns:
+            numpy.array: (number_of_estimates, ndim) log10 of the initial
+            parameter guesses, the lowest chi2 first.
+        """
+
+        self.refresh()
+        bounds_low = asarray(bounds_low, dtype=float)
+        bounds_upp = asarray(bounds_upp, dtype=float)
+        inside = np_all((self.points >= bounds_low) &
+                        (self.points <= bounds_upp), axis=1).nonzero()[0]
+
+        column = self.column(unit_key)
+        chi2 = empty(inside.shape[0])
+        for start in range(0, inside.shape[0], self.chunk_size):
+            rows = inside[start:start + self.chunk_size]
+            chi2[start:start + rows.shape[0]] = chi_squared(
+                column[rows][:, line_indices], y_obs[None,:], y_err[None,:],
+                uncertainty
+            )
+        del column
+
+        points = self.points[inside]
+        # in units of a sixth of the ranges, like the other global searches.
+        best_indices = well_separated_minima(
+            chi2, (points - bounds_low) / ((bounds_upp - bounds_low) / 6.0),
+            number_of_estimates
+        )
+
+        return points[best_indices]
+
+
+    def lookup(self, fit_parameters_values_2d, unit_key):
+        """look up points in the library.
+
+        Args:
+            fit_parameters_values_2d (nd.array): (N, ndim) log10 values of
+            the fit parameters.
+
+            unit_key (str): line strength units to return.
+
+
+        Returns:
+            nd.array, nd.array: (N,) booleans indicating which points were
+            found and the (N, n_lines) line strengths (NaN if not found).
+        """
+
+        self.refresh()
+        keys = np_round(atleast_2d(asarray(fit_parameters_values_2d,
+                                           dtype=float64)), self.decimals)
+        line_strengths = full((keys.shape[0], self.number_of_lines), nan)
+        rows = [self.rows.get(tuple(key)) for key in keys.tolist()]
+        found = asarray([row is not None for row in rows], dtype=bool)
+        if found.any():
+            column = self.column(unit_key)
+            line_strengths[found] = column[[row for row in rows
+                                            if row is not None]]
+            del column
+
+        return found, line_strengths
+
+
+    def insert(self, fit_parameters_values_2d, line_strengths_3d):
+        """append points to the library, skipping the ones that are already
+        in it or failed (non-finite line strengths).
+
+        Args:
+            fit_parameters_values_2d (nd.array): (N, ndim) log10 values of
+            the fit parameters.
+
+            line_strengths_3d (nd.array): (N, 3, n_lines) line strengths in
+            the units of "LINE_STRENGTH_UNITS".
+
+
+        Returns:
+            None
+        """
+
+        keys = np_round(atleast_2d(asarray(fit_parameters_values_2d,
+                                           dtype=float64)), self.decimals)
+        line_strengths_3d = asarray(line_strengths_3d, dtype=float64)
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        with FileLock(self.lock_path):
+            description_path = self.path / 'description.json'
+            if not description_path.exists():
+                description_path.write_text(
+                    json.dumps(self.description, sort_keys=True, indent=4,
+                               default=float)
+                )
+            self.refresh()
+
+            new, new_keys = [], set()
+            for i, key in enumerate(keys.tolist()):
+                key = tuple(key)
+                if (key not in self.rows and key not in new_keys and
+                        isfinite(line_strengths_3d[i]).all()):
+                    new_keys.add(key)
+                    new += [i]
+            if not new:
+                return
+
+            # NOTE: the columns are written before the parameters, so an
+            # interrupted write leaves no point without line strengths.
+            # Columns longer than the parameters and a partial parameter
+            # record (an interrupted write) are truncated first.
+            for unit_index, unit_key in enumerate(LINE_STRENGTH_UNITS):
+                with open(self.path / COLUMN_FILES[unit_key],
+                          'ab') as column_file:
+                    column_file.truncate(8 * self.number_of_lines *
+                                         self.points.shape[0])
+                    line_strengths_3d[new, unit_index].tofile(column_file)
+            with open(self.parameters_path, 'ab') as parameters_file:
+                parameters_file.truncate(8 * self.ndim *
+                                         self.points.shape[0])
+                keys[new].tofile(parameters_file)
+
+        self.refresh()
+
+        return
+
+
+    def model_batch(self, unit_key, line_indices):
+        """a batched RADEX model for "find_initial_parameter_guesses()"
+        that reads the points already in the library from it and appends
+        the calculated ones to it.
+
+        Args:
+            unit_key (str): line strength units to return.
+
+            line_indices (list[int]): indices of the lines to return in the
+            molfile.
+
+
+        Returns:
+            function: model_batch(fit_parameters_values_2d, pool=None,
+            solver=None), (N, n_lines_matching) line strengths.
+        """
+
+        def library_model_batch(fit_parameters_values_2d, pool=None,
+                                solver=None):
+            fit_parameters_values_2d = atleast_2d(
+                asarray(fit_parameters_values_2d, dtype=float)
+            )
+            found, line_strengths = self.lookup(fit_parameters_values_2d,
+                                                unit_key)
+            if not found.all():
+                calculated = self.all_units_batch(
+                    fit_parameters_values_2d[~found], pool, solver
+                )
+                self.insert(fit_parameters_values_2d[~found], calculated)
+                line_strengths[~found] = calculated[
+                    :, LINE_STRENGTH_UNITS.index(unit_key)
+                ]
+
+            return line_strengths[:, line_indices]
+
+        return library_model_batch
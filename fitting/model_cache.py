@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+# module imports
+from collections import OrderedDict
+from numpy import asarray, round as np_round
+
+
+# rough estimate of the bookkeeping (key tuple, OrderedDict node) that is
+# stored alongside every cached model, in bytes.
+ENTRY_OVERHEAD = 256
+
+
+class ModelCache:
+    def __init__(self, max_bytes=64 * 2**20, decimals=12):
+        """in-memory cache of RADEX model evaluations with a bounded memory
+        footprint. The least recently used models are evicted first once
+        the memory cap is reached.
+
+        Args:
+            max_bytes (int): memory cap of the cached models in bytes, 0
+            disables the cache. Defaults to 64 MiB.
+
+            decimals (int): number of decimals the log10(parameters) are
+            rounded to for the cache keys. This has to stay well below the
+            finite difference steps taken by the Levenberg-Marquardt
+            Jacobian estimate (~1e-8 relative), otherwise those steps would
+            hit the cached unperturbed model. Defaults to 12.
+
+
+        Returns:
+            None
+        """
+
+        self.max_bytes = max_bytes
+        self.decimals  = decimals
+        self.models    = OrderedDict()
+        self.nbytes    = 0
+        self.hits      = 0
+        self.misses    = 0
+
+        return
+
+
+    def key(self, fit_parameters_names, fit_parameters_values, parameters,
+            *extra):
+        """cache key of a RADEX model, made up of the molfile, the quantized
+        log10(parameters) to be fit and the constant parameters.
+
+        Args:
+            fit_parameters_names (list[str]): names of the fit parameters.
+
+            fit_parameters_values (nd.array): log10 values of the fit
+            parameters.
+
+            parameters (dict): SpectralRadex input, the entries of the fit
+            parameters are ignored.
+
+            extra: anything else the cached value depends on (e.g. units).
+
+
+        Returns:
+            tuple: hashable cache key.
+        """
+
+        constants = tuple(sorted(
+            (name, value) for name, value in parameters.items()
+            if name not in fit_parameters_names and name != 'molfile'
+        ))
+        quantized = tuple(
+            np_round(asarray(fit_parameters_values, dtype=float),
+                     self.decimals).tolist()
+        )
+
+        return (parameters['molfile'], tuple(fit_parameters_names),
+                quantized, constants) + extra
+
+
+    def get(self, key):
+        """retrieve a cached model and mark it as most recently used.
+
+        Args:
+            key (tuple): cache key, see "key()".
+
+
+        Returns:
+            cached model or None if it is not cached.
+        """
+
+        if self.max_bytes <= 0:
+            return None
+
+        try:
+            value, _ = self.models[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self.models.move_to_end(key)
+        self.hits += 1
+        return value
+
+
+    def put(self, key, value):
+        """store a model, evicting the least recently used models if the
+        memory cap is exceeded.
+
+        Args:
+            key (tuple): cache key, see "key()".
+
+            value (nd.array -OR- pd.DataFrame): model to store.
+
+
+        Returns:
+            None
+        """
+
+        if self.max_bytes <= 0:
+            return
+
+        if hasattr(value, 'memory_usage'):  # pandas DataFrame.
+            nbytes = int(value.memory_usage(deep=True).sum())
+        else:
+            nbytes = value.nbytes
+        nbytes += ENTRY_OVERHEAD
+        if nbytes > self.max_bytes:
+            return
+
+        if key in self.models:
+            self.nbytes -= self.models.pop(key)[1]
+        self.models[key] = (value, nbytes)
+        self.nbytes += nbytes
+        self.evict()
+
+        return
+
+
+    def evict(self):
+        """evict the least recently used models until the memory cap is
+        no longer exceeded.
+
+        Returns:
+            None
+        """
+
+        while self.models and self.nbytes > max(self.max_bytes, 0):
+            _, (_, evicted_nbytes) = self.models.popitem(last=False)
+            self.nbytes -= evicted_nbytes
+
+        return
+
+
+    def statistics(self):
+        """hit/miss counters and memory usage of the cache.
+
+        Returns:
+            dict: hits, misses, number of cached models and their memory
+            usage in bytes.
+        """
+
+        return {'hits':self.hits, 'misses':self.misses,
+                'models':len(self.models), 'bytes':self.nbytes}
+
+
+# one cache per process, so MCMC pool workers each have their own.
+process_model_cache = ModelCache()
+
+
+def configure_model_cache(max_bytes):
+    """set the memory cap of this process' model cache, evicting models
+    if it shrunk.
+
+    Args:
+        max_bytes (int): memory cap of the cached models in bytes, 0
+        disables the cache.
+
+
+    Returns:
+        ModelCache: the cache of this process.
+    """
+
+    process_model_cache.max_bytes = max_bytes
+    process_model_cache.evict()
+
+    return process_model_cache
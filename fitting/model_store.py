@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+
+# module imports
+from hashlib import sha1
+from pathlib import Path
+import json
+import os
+import shutil
+import uuid
+
+from numpy import (
+    asarray,
+    atleast_2d,
+    float64,
+    fromfile,
+    full,
+    isfinite,
+    memmap,
+    nan,
+    round as np_round
+)
+
+# NOTE: without fcntl (Windows) the store is only safe to use by a single
+# process at a time.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class FileLock:
+    def __init__(self, path, shared=False):
+        """advisory lock on a file, shared between processes on the same
+        machine (e.g. several ReverseRADEX runs at once).
+
+        Args:
+            path (Path): lock file, created if it does not exist.
+
+            shared (bool): take a shared instead of an exclusive lock.
+            Defaults to False.
+
+
+        Returns:
+            None
+        """
+
+        self.path   = path
+        self.shared = shared
+        self.file   = None
+
+        return
+
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self.file,
+                        fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+        return self
+
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        return False
+
+
+# molfile content hashes, to only re-hash a molfile when it changed.
+molfile_hashes = {}
+
+
+def molfile_hash(molfile):
+    """sha1 of the molfile contents, so a store entry is invalidated when
+    the molecular data changes but not when the file is moved.
+
+    Args:
+        molfile (str): file location on system of molecular file.
+
+
+    Returns:
+        str: hex digest of the molfile contents.
+    """
+
+    status = os.stat(molfile)
+    signature = (molfile, status.st_mtime_ns, status.st_size)
+    if signature not in molfile_hashes:
+        with open(molfile, 'rb') as molfile_contents:
+            molfile_hashes[signature] = sha1(
+                molfile_contents.read()
+            ).hexdigest()
+
+    return molfile_hashes[signature]
+
+
+class ModelStore:
+    def __init__(self, directory, max_bytes=2**30, decimals=12,
+                 size_check_interval=100):
+        """content-addressed on-disk store of RADEX model evaluations,
+        shared by consecutive runs and by several processes at once.
+
+        Every combination of molfile (contents), constant parameters, fit
+        parameters and units gets its own bucket directory, named after
+        the hash of that combination. A bucket consists of two append-only
+        binary files with fixed size records: "index.bin" holding the
+        (quantized) log10(fit parameters) and "values.bin" the line
+        strengths of all lines. Both can be memory-mapped, so a lookup only
+        reads the index and the rows that are actually found.
+
+        Args:
+            directory (str): directory of the store, created if needed.
+
+            max_bytes (int): size cap of the store in bytes, the least
+            recently used buckets are evicted first once it is exceeded.
+            Defaults to 1 GiB.
+
+            decimals (int): number of decimals the log10(parameters) are
+            rounded to, see "ModelCache". Defaults to 12.
+
+            size_check_interval (int): number of inserts after which the
+            size of the store is measured again, in between it is
+            estimated from the bytes written by this process. Defaults to
+            100.
+
+
+        Returns:
+            None
+        """
+
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.decimals  = decimals
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.lock_path = self.directory / 'store.lock'
+
+        # measuring the size stats every file of the store, so it is only
+        # done every "size_check_interval" inserts.
+        self.size_check_interval = size_check_interval
+        self.size_estimate       = None
+        self.inserts_since_check = 0
+
+        return
+
+
+    def bucket(self, parameters, fit_parameters_names, unit_key,
+               number_of_lines, solver='radex'):
+        """the bucket of models sharing the molfile, constant parameters,
+        fit parameters and units.
+
+        Args:
+            parameters (dict): SpectralRadex input, the entries of the fit
+            parameters are ignored.
+
+            fit_parameters_names (list[str]): names of the fit parameters.
+
+            unit_key (str): line strength units of the stored models.
+
+            number_of_lines (int): number of lines of every model.
+
+            solver (str): solver the models are calculated with ('radex'
+            -OR- 'numpy'). Defaults to 'radex'.
+
+
+        Returns:
+            ModelStoreBucket: bucket of the models.
+        """
+
+        description = {
+            'molfile_sha1':molfile_hash(parameters['molfile']),
+            'constant_parameters':{
+                name:value for name, value in sorted(parameters.items())
+                if name not in fit_parameters_names and name != 'molfile'
+            },
+            'fit_parameters_names':list(fit_parameters_names),
+            'units':unit_key,
+            'number_of_lines':int(number_of_lines),
+            'decimals':self.decimals,
+            'solver':solver
+        }
+        description_json = json.dumps(description, sort_keys=True,
+                                      default=float)
+        bucket_name = sha1(description_json.encode()).hexdigest()
+
+        return ModelStoreBucket(self, self.directory / bucket_name,
+                                description)
+
+
+    def size(self):
+        """total size of all buckets in bytes.
+
+        Returns:
+            int: size of the store.
+        """
+
+        return sum(path.stat().st_size
+                   for path in self.directory.glob('*/*.bin'))
+
+
+    def evict(self, keep=None):
+        """remove the least recently used buckets until the store no longer
+        exceeds its size cap.
+
+        Args:
+            keep (Path, optional): bucket directory that is never evicted
+            (i.e. the one being written to). Defaults to None.
+
+
+        Returns:
+            int: number of evicted buckets.
+        """
+
+        with FileLock(self.lock_path):
+            buckets = []
+            for bucket_path in self.directory.iterdir():
+                if not bucket_path.is_dir() or bucket_path == keep:
+                    continue
+                last_used = bucket_path / 'last_used'
+                buckets += [(
+                    last_used.stat().st_mtime if last_used.exists() else 0,
+                    bucket_path
+                )]
+
+            store_size = self.size()
+            number_evicted = 0
+            for _, bucket_path in sorted(buckets):
+                if store_size <= self.max_bytes:
+                    break
+                store_size -= sum(path.stat().st_size
+                                  for path in bucket_path.glob('*.bin'))
+                shutil.rmtree(bucket_path, ignore_errors=True)
+                number_evicted += 1
+
+        return number_evicted
+
+
+    def inserted(self, number_of_bytes, keep=None):
+        """update the size estimate after an insert and evict the least
+        recently used buckets once it exceeds the size cap.
+
+        Args:
+            number_of_bytes (int): bytes appended by the insert.
+
+            keep (Path, optional): bucket directory that is never evicted,
+            see "evict()". Defaults to None.
+
+
+        Returns:
+            None
+        """
+
+        self.inserts_since_check += 1
+        if (self.size_estimate is None or
+                self.inserts_since_check >= self.size_check_interval):
+            self.size_estimate       = self.size()
+            self.inserts_since_check = 0
+        else:
+            # other processes writing to the store are only accounted for
+            # at the next measurement.
+            self.size_estimate += number_of_bytes
+
+        if self.size_estimate > self.max_bytes:
+            self.evict(keep=keep)
+            self.size_estimate       = self.size()
+            self.inserts_since_check = 0
+
+        return
+
+
+class ModelStoreBucket:
+    def __init__(self, store, path, description):
+        """bucket of a "ModelStore", see "ModelStore.bucket()".
+
+        Args:
+            store (ModelStore): the store the bucket belongs to.
+
+            path (Path): bucket directory.
+
+            description (dict): what the models in the bucket share.
+
+
+        Returns:
+            None
+        """
+
+        self.store           = store
+        self.path            = path
+        self.description     = description
+        self.ndim            = len(description['fit_parameters_names'])
+        self.number_of_lines = description['number_of_lines']
+
+        self.index_path  = path / 'index.bin'
+        self.values_path = path / 'values.bin'
+        self.lock_path   = path / 'bucket.lock'
+
+        # index records read so far, {quantized parameters:row}, of the
+        # bucket with the random id written to "description.json" when it
+        # was created. A bucket that was evicted and created again by
+        # another process gets a new id, so its index is read again.
+        self.rows        = {}
+        self.number_read = 0
+        self.bucket_id   = None
+
+        return
+
+
+    def __getstate__(self):
+        # the index is rebuilt from disk by every process that uses the
+        # bucket, instead of being pickled along with it.
+        state = self.__dict__.copy()
+        state['rows']        = {}
+        state['number_read'] = 0
+        state['bucket_id']   = None
+        return state
+
+
+    def quantize(self, fit_parameters_values_2d):
+        """round log10(fit parameters) to the keys used in the index.
+
+        Args:
+            fit_parameters_values_2d (nd.array): (N, ndim) log10 values of
+            the fit parameters.
+
+
+        Returns:
+            nd.array: (N, ndim) index keys.
+        """
+
+        return np_round(
+            atleast_2d(asarray(fit_parameters_values_2d, dtype=float64)),
+            self.store.decimals
+        )
+
+
+    def number_of_records(self):
+        """number of models stored in the bucket. Only complete index
+        records are counted, the values are always written before the
+        index.
+
+        Returns:
+            int: number of models.
+        """
+
+        try:
+            return self.index_path.stat().st_size // (8 * self.ndim)
+        except FileNotFoundError:
+            return 0
+
+
+    def refresh(self):
+        """read the index records appended (by any process) since the last
+        refresh. Must be called with the bucket lock held.
+
+        Returns:
+            None
+        """
+
+        # raises FileNotFoundError if the bucket does not exist (anymore).
+        bucket_id = json.loads(
+            (self.path / 'description.json').read_text()
+        ).get('bucket_id')
+        number_of_records = self.number_of_records()
+        # the bucket was evicted (and possibly created again).
+        if bucket_id != self.bucket_id or number_of_records < self.number_read:
+            self.rows        = {}
+            self.number_read = 0
+            self.bucket_id   = bucket_id
+        if number_of_records == self.number_read:
+            return
+
+        with open(self.index_path, 'rb') as index_file:
+            index_file.seek(8 * self.ndim * self.number_read)
+            new_keys = fromfile(
+                index_file, dtype=float64,
+                count=self.ndim * (number_of_records - self.number_read)
+            ).reshape(-1, self.ndim)
+
+        for row, key in enumerate(new_keys.tolist(), self.number_read):
+            self.rows.setdefault(tuple(key), row)
+        self.number_read = number_of_records
+
+        return
+
+
+    def lookup(self, fit_parameters_values_2d):
+        """look up models in the bucket.
+
+        Args:
+            fit_parameters_values_2d (nd.array): (N, ndim) log10 values of
+            the fit parameters.
+
+
+        Returns:
+            nd.array, nd.array: (N,) booleans indicating which models were
+            found and the (N, n_lines) line strengths (NaN if not found).
+        """
+
+        keys = self.quantize(fit_parameters_values_2d)
+        line_strengths = full((keys.shape[0], self.number_of_lines), nan)
+        if not self.path.exists():
+            return full(keys.shape[0], False), line_strengths
+
+        try:
+            # shared locks, so no insert truncates and no eviction removes
+            # the files while they are read.
+            with FileLock(self.store.lock_path, shared=True), \
+                    FileLock(self.lock_path, shared=True):
+                self.refresh()
+                rows = [self.rows.get(tuple(key)) for key in keys.tolist()]
+                found = asarray([row is not None for row in rows])
+                if found.any():
+                    values = memmap(
+                        self.values_path, dtype=float64, mode='r',
+                        shape=(self.number_read, self.number_of_lines)
+                    )
+                    line_strengths[found] = values[
+                        [row for row in rows if row is not None]
+                    ]
+                    del values
+                    (self.path / 'last_used').touch()
+        except FileNotFoundError:  # evicted by another process.
+            self.rows        = {}
+            self.number_read = 0
+            self.bucket_id   = None
+            found = full(keys.shape[0], False)
+
+        return found, line_strengths
+
+
+    def insert(self, fit_parameters_values_2d, line_strengths_2d):
+        """append models to the bucket, skipping the ones that are already
+        stored or failed (non-finite line strengths).
+
+        Args:
+            fit_parameters_values_2d (nd.array): (N, ndim) log10 values of
+            the fit parameters.
+
+            line_strengths_2d (nd.array): (N, n_lines) line strengths.
+
+
+        Returns:
+            None
+        """
+
+        keys = self.quantize(fit_parameters_values_2d)
+        line_strengths_2d = atleast_2d(
+            asarray(line_strengths_2d, dtype=float64)
+        )
+
+        with FileLock(self.store.lock_path, shared=True):
+            self.path.mkdir(exist_ok=True)
+            with FileLock(self.lock_path):
+                description_path = self.path / 'description.json'
+                if not description_path.exists():
+                    description_path.write_text(json.dumps(
+                        dict(self.description, bucket_id=uuid.uuid4().hex),
+                        sort_keys=True, indent=4, default=float
+                    ))
+                self.refresh()
+
+                new = []
+                for i, key in enumerate(keys.tolist()):
+                    key = tuple(key)
+                    if (key not in self.rows and
+                            isfinite(line_strengths_2d[i]).all()):
+                        self.rows[key] = self.number_read + len(new)
+                        new += [i]
+
+                if new:
+                    # values first, so a complete index record always has
+                    # its values on disk. Values without an index record
+                    # and a partial index record (an interrupted write) are
+                    # truncated first, the rows are counted by the index.
+                    with open(self.values_path, 'ab') as values_file:
+                        values_file.truncate(8 * self.number_of_lines *
+                                             self.number_read)
+                        line_strengths_2d[new].tofile(values_file)
+                    with open(self.index_path, 'ab') as index_file:
+                        index_file.truncate(8 * self.ndim * self.number_read)
+                        keys[new].tofile(index_file)
+                    self.number_read += len(new)
+                (self.path / 'last_used').touch()
+
+        if new:
+            self.store.inserted(
+                8 * len(new) * (self.number_of_lines + self.ndim),
+                keep=self.path
+            )
+
+        return
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# module imports
+from numpy import (
+    array,
+    clip,
+    concatenate,
+    inf,
+    isfinite,
+    nan,
+    vstack,
+    where
+)
+from numpy.random import default_rng
+
+
+# constriction coefficients of Clerc & Kennedy (2002).
+INERTIA   = 0.7298
+COGNITIVE = 1.49618
+SOCIAL    = 1.49618
+
+
+def particle_swarm_search(bounds_low, bounds_upp, swarm_chi2,
+                          number_of_particles=20, max_evaluations=1000,
+                          stall_iterations=10, stall_tolerance=1e-3,
+                          seed=None):
+    """particle swarm optimization of the chi2 within the bounds, a global
+    search whose cost scales with the number of iterations instead of
+    exponentially with the number of fit parameters like a grid. The whole
+    swarm is evaluated as one batch every iteration, so "swarm_chi2" can
+    distribute it over a pool (or vectorize it with the 'numpy' solver).
+
+    Args:
+        bounds_low (numpy.array): (ndim,) lower bounds in log10.
+
+        bounds_upp (numpy.array): (ndim,) upper bounds in log10.
+
+        swarm_chi2 (function): chi2 of a (N, ndim) array of parameters, NaN
+        for models RADEX failed to calculate.
+
+        number_of_particles (int): swarm size. Defaults to 20.
+
+        max_evaluations (int): evaluation budget, the number of iterations
+        is at most max_evaluations // number_of_particles. Defaults to
+        1000.
+
+        stall_iterations (int): stop once the best chi2 has not improved
+        by more than "stall_tolerance" (relative) for this many
+        iterations. Defaults to 10.
+
+        stall_tolerance (float): see "stall_iterations". Defaults to 1e-3.
+
+        seed (int, optional): seed of the random number generator.
+        Defaults to None.
+
+
+    Returns:
+        tuple: (N, ndim) all evaluated parameters, (N,) their chi2 and (N,
+        ndim) their positions in units of a sixth of the parameter ranges
+        (the coarse spacing of "adaptive_grid_search()"), to select
+        well-separated minima from.
+    """
+
+    rng = default_rng(seed)
+    bounds_low = array(bounds_low, dtype=float)
+    bounds_upp = array(bounds_upp, dtype=float)
+    ranges = bounds_upp - bounds_low
+    ndim = bounds_low.shape[0]
+
+    positions  = rng.uniform(bounds_low, bounds_upp,
+                             size=(number_of_particles, ndim))
+    velocities = rng.uniform(-ranges, ranges,
+                             size=(number_of_particles, ndim)) / 2.0
+    chi2 = swarm_chi2(positions)
+    # failed models are never the best.
+    chi2 = where(isfinite(chi2), chi2, inf)
+    evaluated_positions, evaluated_chi2 = [positions], [chi2]
+
+    personal_best     = positions.copy()
+    personal_best_chi = chi2.copy()
+    global_best_chi   = personal_best_chi.min()
+    global_best       = personal_best[personal_best_chi.argmin()]
+
+    stalled = 0
+    for _ in range(max_evaluations // number_of_particles - 1):
+        cognitive = rng.uniform(size=(number_of_particles, ndim))
+        social    = rng.uniform(size=(number_of_particles, ndim))
+        velocities = (INERTIA * velocities +
+                      COGNITIVE * cognitive * (personal_best - positions) +
+                      SOCIAL * social * (global_best - positions))
+        velocities = clip(velocities, -ranges / 2.0, ranges / 2.0)
+        positions = positions + velocities
+        # particles leaving the bounds stop at them.
+        outside = (positions < bounds_low) | (positions > bounds_upp)
+        positions = clip(positions, bounds_low, bounds_upp)
+        velocities[outside] = 0.0
+
+        chi2 = swarm_chi2(positions)
+        chi2 = where(isfinite(chi2), chi2, inf)
+        evaluated_positions += [positions]
+        evaluated_chi2 += [chi2]
+
+        improved = chi2 < personal_best_chi
+        personal_best[improved]     = positions[improved]
+        personal_best_chi[improved] = chi2[improved]
+
+        if personal_best_chi.min() < global_best_chi * (1 - stall_tolerance):
+            stalled = 0
+        else:
+            stalled += 1
+        global_best_chi = personal_best_chi.min()
+        global_best     = personal_best[personal_best_chi.argmin()]
+        if stalled >= stall_iterations:
+            break
+
+    evaluated_positions = vstack(evaluated_positions)
+    # NaN again for the failed models, like the other global searches.
+    evaluated_chi2 = concatenate(evaluated_chi2)
+    evaluated_chi2[~isfinite(evaluated_chi2)] = nan
+
+    return (evaluated_positions, evaluated_chi2,
+            (evaluated_positions - bounds_low) / (ranges / 6.0))
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+# module imports
+from numpy import (
+    arange,
+    asarray,
+    atleast_2d,
+    full,
+    isfinite,
+    nan,
+    sqrt,
+    zeros
+)
+
+
+class WarmStartStore:
+    def __init__(self, max_solutions=256, max_distance=0.1,
+                 min_distance=1e-3):
+        """small nearest-neighbour store of recently converged level
+        populations of the escape probability solver, to start the
+        iteration of a new model from the populations of a nearby one
+        (e.g. the steps of the Levenberg-Marquardt iteration or the small
+        moves of converged MCMC walkers) instead of from the optically thin
+        solution.
+
+        Every molfile/constant parameters/fit parameters combination (the
+        "context") has its own ring buffer of the "max_solutions" most
+        recent solutions.
+
+        Args:
+            max_solutions (int): number of solutions kept per context, 0
+            disables warm starts. Defaults to 256.
+
+            max_distance (float): largest (euclidean) distance in
+            log10(fit parameters) a solution is used as starting point
+            for. Defaults to 0.1.
+
+            min_distance (float): models closer than this to the nearest
+            solution start from the same populations that solution started
+            from (the optically thin solution if it was not warm started).
+            Models started differently only agree to the convergence
+            criterion (~1e-6), which would swamp the tiny finite difference
+            steps of the Levenberg-Marquardt Jacobian. Defaults to 1e-3.
+
+
+        Returns:
+            None
+        """
+
+        self.max_solutions = max_solutions
+        self.max_distance  = max_distance
+        self.min_distance  = min_distance
+        self.contexts      = {}
+        self.hits          = 0
+        self.misses        = 0
+        self.iterations    = 0
+
+        return
+
+
+    def context(self, molfile, fit_parameters_names, parameters):
+        """key of the ring buffer of solutions that can be used for each
+        other, see "ModelCache.key()".
+
+        Args:
+            molfile (str): file location on system of molecular file.
+
+            fit_parameters_names (list[str]): names of the fit parameters.
+
+            parameters (dict): SpectralRadex input, the entries of the fit
+            parameters are ignored.
+
+
+        Returns:
+            tuple: hashable context key.
+        """
+
+        constants = tuple(sorted(
+            (name, value) for name, value in parameters.items()
+            if name not in fit_parameters_names and name != 'molfile'
+        ))
+
+        return (molfile, tuple(fit_parameters_names), constants)
+
+
+    def nearest(self, context, fit_parameters_values_2d, number_of_levels):
+        """starting populations for a batch of models.
+
+        Args:
+            context (tuple): see "context()".
+
+            fit_parameters_values_2d (nd.array): (N, ndim) log10 values of
+            the fit parameters.
+
+            number_of_levels (int): number of levels of the molecule.
+
+
+        Returns:
+            nd.array: (N, n_levels) populations of the nearest stored
+            solution (or the populations it started from, see
+            "min_distance"), NaN for the models that start from the
+            optically thin solution.
+        """
+
+        fit_parameters_values_2d = atleast_2d(
+            asarray(fit_parameters_values_2d, dtype=float)
+        )
+        number_of_models = fit_parameters_values_2d.shape[0]
+        initial_populations = full((number_of_models, number_of_levels), nan)
+
+        stored = self.contexts.get(context)
+        if self.max_solutions <= 0 or stored is None or stored['count'] == 0:
+            self.misses += number_of_models
+            return initial_populations
+
+        count = min(stored['count'], self.max_solutions)
+        distances = sqrt(((fit_parameters_values_2d[:, None, :] -
+                           stored['keys'][None, :count, :])**2).sum(axis=2))
+        nearest = distances.argmin(axis=1)
+        nearest_distances = distances[arange(number_of_models), nearest]
+        near = ((nearest_distances <= self.max_distance) &
+                (nearest_distances >= self.min_distance))
+        initial_populations[near] = stored['populations'][nearest[near]]
+        same_start = nearest_distances < self.min_distance
+        initial_populations[same_start] = stored['initial_populations'][
+            nearest[same_start]
+        ]
+
+        warm = isfinite(initial_populations).all(axis=1)
+        self.hits   += int(warm.sum())
+        self.misses += int((~warm).sum())
+
+        return initial_populations
+
+
+    def add(self, context, fit_parameters_values_2d, populations,
+            initial_populations=None, iterations=None):
+        """store converged solutions, overwriting the oldest ones.
+
+        Args:
+            context (tuple): see "context()".
+
+            fit_parameters_values_2d (nd.array): (N, ndim) log10 values of
+            the fit parameters.
+
+            populations (nd.array): (N, n_levels) level populations, rows
+            that are not finite (not converged) are skipped.
+
+            initial_populations (nd.array, optional): (N, n_levels)
+            populations the models started from, see "nearest()".
+            Defaults to None (all started from the optically thin
+            solution).
+
+            iterations (nd.array, optional): (N,) number of iterations the
+            models took, only counted for the statistics. Defaults to None.
+
+
+        Returns:
+            None
+        """
+
+        if iterations is not None:
+            self.iterations += int(iterations.sum())
+        if self.max_solutions <= 0:
+            return
+
+        fit_parameters_values_2d = atleast_2d(
+            asarray(fit_parameters_values_2d, dtype=float)
+        )
+        converged = isfinite(populations).all(axis=1)
+        if context not in self.contexts:
+            self.contexts[context] = {
+                'keys':zeros((self.max_solutions,
+                              fit_parameters_values_2d.shape[1])),
+                'populations':zeros((self.max_solutions,
+                                     populations.shape[1])),
+                'initial_populations':full((self.max_solutions,
+                                            populations.shape[1]), nan),
+                'count':0
+            }
+        stored = self.contexts[context]
+
+        # only the last "max_solutions" of a large batch are kept.
+        new = arange(fit_parameters_values_2d.shape[0])[converged][
+            -self.max_solutions:
+        ]
+        slots = (stored['count'] + arange(new.shape[0])) % self.max_solutions
+        stored['keys'][slots]        = fit_parameters_values_2d[new]
+        stored['populations'][slots] = populations[new]
+        stored['initial_populations'][slots] = (
+            nan if initial_populations is None else initial_populations[new]
+        )
+        stored['count'] += new.shape[0]
+
+        return
+
+
+    def statistics(self):
+        """warm start counters.
+
+        Returns:
+            dict: number of warm started (hits) and cold started (misses)
+            models and the total number of iterations of all models.
+        """
+
+        return {'hits':self.hits, 'misses':self.misses,
+                'iterations':self.iterations}
+
+
+# one store per process, so MCMC pool workers each have their own.
+process_warm_start_store = WarmStartStore()
+
+
+def configure_warm_start(max_solutions):
+    """set the number of solutions this process' warm start store keeps
+    per context.
+
+    Args:
+        max_solutions (int): number of solutions kept per context, 0
+        disables warm starts.
+
+
+    Returns:
+        WarmStartStore: the store of this process.
+    """
+
+    process_warm_start_store.max_solutions = max_solutions
+    process_warm_start_store.contexts      = {}
+
+    return process_warm_start_store
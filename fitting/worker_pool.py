@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+# module imports
+from multiprocessing import Pool, cpu_count
+import atexit
+import pickle
+
+from user_input.lamda_molecule import load_lamda_molecule
+
+
+# state installed once per worker process by "warm_up_worker()", so the
+# tasks only have to carry their parameter vectors.
+worker_state = {}
+
+
+def warm_up_worker(molfile, alg_help=None):
+    """pool initializer, parses the molfile (or reads its sidecar file)
+    once per worker instead of in the first task of every stage, and
+    installs the fitting constants in the worker registry.
+
+    Args:
+        molfile (str): file location on system of molecular file, None to
+        skip.
+
+        alg_help (AlgorithmHelpers, optional): fitting constants used by
+        "worker_log_probability()". Defaults to None.
+
+
+    Returns:
+        None
+    """
+
+    if molfile is not None:
+        load_lamda_molecule(molfile)
+    if alg_help is not None:
+        worker_state['alg_help'] = alg_help
+
+    return
+
+
+def worker_log_probability(fit_parameters_values):
+    """"AlgorithmHelpers.log_probability()" of the fitting constants in the
+    worker registry. Unlike the bound method, which pickles the whole
+    "AlgorithmHelpers" (observations, constant parameters, ...) along with
+    every chunk of walkers, only a reference to this function is sent.
+
+    Args:
+        fit_parameters_values (numpy array): values of the variable
+        parameters to be fit in the MCMC algorithm.
+
+
+    Returns:
+        float: logarithm of the probability distribution.
+    """
+
+    if 'alg_help' not in worker_state:
+        raise RuntimeError("No fitting constants installed in this " +
+                           "process, start the WorkerPool with alg_help.")
+
+    return worker_state['alg_help'].log_probability(fit_parameters_values)
+
+
+def worker_RADEX_all_lines(fit_parameters_values):
+    """"AlgorithmHelpers.RADEX_all_lines()" of the fitting constants in the
+    worker registry, see "worker_log_probability()".
+
+    Args:
+        fit_parameters_values (nd.array): contains the parameter values
+        of the parameters to be fit.
+
+
+    Returns:
+        nd.array: RADEX line strength output for all lines (NaN if RADEX
+        failed).
+    """
+
+    return worker_state['alg_help'].RADEX_all_lines(fit_parameters_values)
+
+
+def pool_map_bytes(function, iterable, processes):
+    """number of bytes "multiprocessing.Pool.map()" pickles to send a map
+    of the function over the iterable to the workers, with the chunk size
+    "map()" picks by default (the function is pickled with every chunk).
+
+    Args:
+        function (function): the mapped function.
+
+        iterable (list): the tasks.
+
+        processes (int): number of worker processes.
+
+
+    Returns:
+        int: bytes sent to the workers.
+    """
+
+    tasks = list(iterable)
+    chunk_size, extra = divmod(len(tasks), processes * 4)
+    if extra:
+        chunk_size += 1
+
+    return sum(len(pickle.dumps((function, tasks[start:start + chunk_size])))
+               for start in range(0, len(tasks), max(chunk_size, 1)))
+
+
+class WorkerPool:
+    def __init__(self, processes=cpu_count(), molfile=None, alg_help=None):
+        """one long-lived pool of worker processes, shared by the grid
+        search, Levenberg-Marquardt, MCMC, emulator and plotting stages
+        instead of every stage forking (and importing) its own. The pool
+        is only started on first use and shut down by "close()", at the
+        latest when the interpreter exits.
+
+        Args:
+            processes (int): number of worker processes. Defaults to
+            cpu_count().
+
+            molfile (str, optional): molfile every worker parses once when
+            it starts. Defaults to None.
+
+            alg_help (AlgorithmHelpers, optional): fitting constants every
+            worker installs once when it starts, for
+            "worker_log_probability()". Later changes to it (e.g. an
+            emulator) only reach the workers of a new pool. Defaults to
+            None.
+
+
+        Returns:
+            None
+        """
+
+        self.processes   = processes
+        self.alg_help    = alg_help
+        self.initializer = warm_up_worker
+        self.initargs    = (molfile, alg_help)
+        self._pool       = None
+
+        return
+
+
+    @property
+    def pool(self):
+        """the pool, started on first use.
+
+        Returns:
+            multiprocessing.Pool: the worker processes.
+        """
+
+        if self._pool is None:
+            self._pool = Pool(processes=self.processes,
+                              initializer=self.initializer,
+                              initargs=self.initargs)
+            # lets "AlgorithmHelpers.RADEX_line_strengths_batch()" map the
+            # registry functions instead of its bound methods over the pool.
+            self._pool.registered_alg_help = self.alg_help
+            atexit.register(self.close)
+
+        return self._pool
+
+
+    def close(self):
+        """shut the pool down, waiting for the running tasks to finish. The
+        next use of "pool" starts a new one.
+
+        Returns:
+            None
+        """
+
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            atexit.unregister(self.close)
+
+        return
+
+
+    def terminate(self):
+        """stop the pool immediately (e.g. after an error or interrupt).
+
+        Returns:
+            None
+        """
+
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            atexit.unregister(self.close)
+
+        return
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+        return False
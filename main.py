@@ -2,15 +2,25 @@
 #%% imports
 from configparser import ConfigParser
 from datetime import datetime, timedelta
+from functools import partial
+from multiprocessing import cpu_count
 from os import getcwd
 from pathlib import Path
 from time import time
 import argparse
 
 from numpy import append, array, full, log10
-
-from fitting import (AlgorithmHelpers, find_initial_parameter_guesses,
-                     run_levenberg_marquardt, run_monte_carlo)
+from numpy.random import randint
+
+from fitting import (AlgorithmHelpers, ChainBackend, EmulatedLogProbability,
+                     GridLibrary, ModelStore, WorkerPool, build_emulator,
+                     configure_model_cache, configure_warm_start,
+                     emulator_accuracy_report,
+                     find_initial_parameter_guesses, held_out_points,
+                     least_squares_covariance, pool_map_bytes,
+                     run_levenberg_marquardt, run_monte_carlo,
+                     run_multistart_levenberg_marquardt,
+                     solver_accuracy_report, worker_log_probability)
 from save_plot import Plotting, SaveResults
 from user_input import (ConstantParamaters, DataRetrieval,
                         VariableParamters,
@@ -28,7 +38,40 @@ parser = argparse.ArgumentParser(
     epilog=''
 )
 parser.add_argument('-config', default=None)
+# output directory of an interrupted run, its MCMC chain is continued from
+# the last completed step.
+parser.add_argument('--resume', default=None, metavar='output_dir')
 args = parser.parse_args()
+if (args.resume is not None and
+        not (Path(args.resume) / 'chain' / 'checkpoint.pkl').exists()):
+    raise FileNotFoundError(f"No MCMC chain to resume in {args.resume}.")
+# the chain stores the initial parameters (and covariance) it started from,
+# a resumed run continues it without repeating the steps before the MCMC.
+resumed_attributes = ({} if args.resume is None else
+                      ChainBackend(Path(args.resume) / 'chain').attributes)
+resume_MCMC = 'initial_parameters' in resumed_attributes
+
+
+def optional_setting(section, option, default):
+    """read an optional setting from config.ini, falling back on its
+    default value if no config is used or the option is not present.
+
+    Args:
+        section (str): config.ini section.
+        
+        option (str): option within the section.
+        
+        default: value used if the option is not set.
+        
+
+    Returns:
+        the (evaluated) setting.
+    """
+    
+    if args.config is None or not config.has_option(section, option):
+        return default
+    
+    return eval(config[section][option])
 
 
 if args.config is not None:
@@ -68,6 +111,81 @@ else:  #### Catch user input from terminal ####
     voldens  = input_variable.collision_densities_input()
 #### Catch user input from terminal ####
 
+# optional performance settings.
+model_section = 'MODEL'
+cache_size = optional_setting(model_section, 'CacheSize', 64)  # [MiB]
+model_cache = configure_model_cache(int(cache_size * 2**20))
+model_store_dir = optional_setting(model_section, 'ModelStore', None)
+model_store_size = optional_setting(model_section, 'ModelStoreSize', 1)  # [GiB]
+# SpectralRadex ('radex') -OR- the vectorized escape probability solver
+# ('numpy'), for the grid search and for all other models.
+model_solver = optional_setting(model_section, 'Solver', 'radex')
+grid_solver = optional_setting(model_section, 'GridSolver', model_solver)
+# number of recent solutions the 'numpy' solver starts nearby models from.
+warm_start_size = optional_setting(model_section, 'WarmStart', 256)
+warm_start_store = configure_warm_start(warm_start_size)
+if model_store_dir is None:
+    model_store = None
+else:
+    model_store = ModelStore(model_store_dir,
+                             max_bytes=int(model_store_size * 2**30))
+
+grid_section = 'GRID'
+# one dense 'brute' grid -OR- an 'adaptive' coarse-to-fine grid that only
+# subdivides the neighbourhoods of the best grid points -OR- a particle
+# swarm ('pso') -OR- a fixed number of quasi-random 'sobol' or latin
+# hypercube ('lhs') points.
+grid_search = optional_setting(grid_section, 'Search', 'brute')
+grid_max_evaluations = optional_setting(grid_section, 'MaxEvaluations', None)
+grid_resolution = optional_setting(grid_section, 'Resolution', 0.05)  # [dex]
+# number of coarse grid cells the adaptive grid subdivides.
+grid_refined_cells = optional_setting(grid_section, 'RefinedCells', 5)
+grid_seed = optional_setting(grid_section, 'Seed', None)
+# directory of the on-disk library of precomputed grids (all lines, all
+# units) that later runs on the same molecule take initial guesses from.
+grid_library_dir = optional_setting(grid_section, 'Library', None)
+
+LM_section = 'LM'
+# number of well-separated grid minima the Levenberg-Marquardt fit is
+# started from (in parallel), the best solution is kept.
+LM_starts = optional_setting(LM_section, 'Starts', 1)
+# a new finite difference Jacobian every iteration ('finite difference')
+# -OR- Broyden updates of the last one ('broyden').
+jacobian_updates = optional_setting(LM_section, 'JacobianUpdates',
+                                    'finite difference')
+
+mcmc_section = 'MCMC'
+# 'exact' RADEX models -OR- an interpolating RADEX 'emulator' -OR- exact
+# RADEX models for the proposals that pass the emulator first ('delayed').
+MCMC_mode = optional_setting(mcmc_section, 'Mode', 'exact')
+emulator_points = optional_setting(mcmc_section, 'EmulatorPoints', 12)
+emulator_dir = optional_setting(mcmc_section, 'EmulatorDirectory',
+                                getcwd() + '/output/emulators')
+# evaluate the whole ensemble of walkers with one batched model call every
+# step (emcee's vectorize=True) instead of one pool task per walker.
+MCMC_vectorize = optional_setting(mcmc_section, 'Vectorize', True)
+# number of production steps of the MCMC, the maximum when the chain runs
+# until it is converged: longer than "AutocorrelationMultiple" times the
+# autocorrelation time, estimated every "ConvergenceInterval" steps.
+MCMC_steps = optional_setting(mcmc_section, 'Steps', 500)
+convergence_interval = optional_setting(mcmc_section, 'ConvergenceInterval',
+                                        None)
+autocorrelation_multiple = optional_setting(mcmc_section,
+                                            'AutocorrelationMultiple', 50)
+autocorrelation_tolerance = optional_setting(mcmc_section,
+                                             'AutocorrelationTolerance', 0.01)
+# maximum number of burn-in steps, the burn-in ends once the log
+# probabilities are stationary (checked every "BurnInBlock" steps).
+burn_in_steps = optional_setting(mcmc_section, 'BurnInSteps', 100)
+burn_in_block = optional_setting(mcmc_section, 'BurnInBlock', 25)
+# start the walkers from the Gaussian approximation of the posterior at the
+# Levenberg-Marquardt optimum ('covariance') -OR- a fixed ball ('ball').
+walker_initialization = optional_setting(mcmc_section, 'WalkerInitialization',
+                                         'covariance')
+# save the chain as one compressed .npz (smaller, but not memory-mappable
+# when loaded) instead of .npy arrays.
+compress_output = optional_setting(mcmc_section, 'CompressOutput', False)
+
 # (matching) frequencies with molfile.
 freq_indices = data_retrieval.get_molfile_frequency_index(
     user_datfile, user_molfile
@@ -196,30 +314,7 @@ matching_lines = full(number_of_lines_total, False)
 matching_lines[matching_index] = True
 
 
-#%% ### start of main program ###
-start_time = time()
-
-#### global parameter search ####
-print("\nEstimating initial parameters.")
-# use the brute method global search to find initial estimates for
-# paremeters to be fit.
-cst_prms = [user_molfile, Tbg, dv, freq_min, freq_max, geom, units,
-            matching_index, user_datfile, uncertainties]
-global_parameter_estimates = find_initial_parameter_guesses(
-    temp_kin, coldens, voldens, vol_dens_summary, cst_prms
-)
-
-grid_time = time()
-grid_duration  = grid_time - start_time
-grid_duration_HHMMSS = str(timedelta(seconds=grid_duration)).rpartition('.')[0]
-print(f"Time elapsed: {grid_duration_HHMMSS}")
-print("Global parameter estimates resulting from brute " +
-      "(grid search) method:")
-for name, value in zip(fit_parameters_names, global_parameter_estimates):
-    print(f"log10({name}): {value:.5f}")
-
-
-#%% #### setting up Levenberg-Marquardt and MCMC parameters ####
+#%% #### setting up the global search, Levenberg-Marquardt and MCMC parameters ####
 alg_help = AlgorithmHelpers(
     y_observed,
     y_uncertainties,
@@ -228,33 +323,243 @@ alg_help = AlgorithmHelpers(
     lim_upp,
     constant_parameters,
     matching_lines,
-    fit_parameters_names
+    fit_parameters_names,
+    model_store=model_store,
+    solver=model_solver
 )
 
+if 'numpy' in [model_solver, grid_solver] and not resume_MCMC:
+    accuracy = solver_accuracy_report(alg_help,
+                                      held_out_points(alg_help, 20, seed=0))
+    print("Escape probability solver vs SpectralRadex at " +
+          f"{accuracy['number_of_samples']} held-out points (relative): " +
+          f"median {accuracy['median_relative_error']:.2e}, " +
+          f"95% {accuracy['p95_relative_error']:.2e}, " +
+          f"max {accuracy['max_relative_error']:.2e}")
+
+
+# one pool of worker processes for all stages, started on first use. Every
+# worker installs "alg_help" once, so the MCMC tasks only carry the walker
+# positions.
+worker_pool = WorkerPool(cpu_count(), molfile=alg_help.parameters['molfile'],
+                         alg_help=alg_help)
+
+
+#%% ### start of main program ###
+start_time = time()
+
+if resume_MCMC:
+    print(f"\nResuming the MCMC chain in {args.resume}, the global " +
+          "search and Levenberg-Marquardt fit are not repeated.")
+    initial_parameters = array(resumed_attributes['initial_parameters'])
+    initial_covariance = resumed_attributes['initial_covariance']
+    if initial_covariance is not None:
+        initial_covariance = array(initial_covariance)
+else:
+    #### global parameter search ####
+    print("\nEstimating initial parameters.")
+    # use the brute method global search to find initial estimates for
+    # paremeters to be fit.
+    cst_prms = [user_molfile, Tbg, dv, freq_min, freq_max, geom, units,
+                matching_index, user_datfile, uncertainties]
+    if grid_library_dir is None:
+        grid_library = None
+    else:
+        grid_library = GridLibrary(
+            grid_library_dir, constant_parameters, fit_parameters_names,
+            number_of_lines_total, alg_help.RADEX_all_units_batch,
+            grid_solver
+        )
+    global_parameter_estimates, search_method = \
+        find_initial_parameter_guesses(
+            temp_kin, coldens, voldens, vol_dens_summary, cst_prms,
+            alg_help.RADEX_model_batch, fit_parameters_names,
+            solver=grid_solver, number_of_estimates=LM_starts,
+            search=grid_search, max_evaluations=grid_max_evaluations,
+            resolution=grid_resolution, refined_cells=grid_refined_cells,
+            seed=grid_seed, grid_library=grid_library,
+            line_indices=freq_indices,
+            pool=None if grid_solver == 'numpy' else worker_pool.pool
+        )
+
+    grid_time = time()
+    grid_duration  = grid_time - start_time
+    grid_duration_HHMMSS = str(
+        timedelta(seconds=grid_duration)
+    ).rpartition('.')[0]
+    print(f"Time elapsed: {grid_duration_HHMMSS}")
+    print("Global parameter estimates resulting from the " +
+          f"'{search_method}' search method:")
+    for name, value in zip(fit_parameters_names,
+                           global_parameter_estimates[0]):
+        print(f"log10({name}): {value:.5f}")
+
 
 #%% #### Levenberg-Marquardt least squares to refine parameter estimates ####
-print("\nRefining parameter estimates.")
-initial_parameters = run_levenberg_marquardt(global_parameter_estimates,
-                                             alg_help.RADEX_model,
-                                             y_observed,
-                                             y_uncertainties,
-                                             bounds)
-
-LM_time = time()
-LM_duration  = LM_time - start_time
-LM_duration_HHMMSS = str(timedelta(seconds=LM_duration)).rpartition('.')[0]
-print(f"Time elapsed: {LM_duration_HHMMSS}")
-print("Refined parameter estimates resulting from Levenberg-Marquardt:")
-for name, value in zip(fit_parameters_names, initial_parameters):
-    print(f"log10({name}): {value:.5f}")
+if not resume_MCMC:
+    print("\nRefining parameter estimates.")
+    if global_parameter_estimates.shape[0] > 1:
+        # every start runs on its own worker (the 'numpy' solver still
+        # vectorizes the Jacobian steps of each start).
+        print("Starting from the " +
+              f"{global_parameter_estimates.shape[0]} best " +
+              "well-separated grid points.")
+        initial_parameters, local_minima = \
+            run_multistart_levenberg_marquardt(
+                global_parameter_estimates, alg_help.RADEX_model, y_observed,
+                y_uncertainties, bounds, alg_help.RADEX_model_batch,
+                worker_pool.pool, jacobian_updates=jacobian_updates
+            )
+        print(f"Distinct local minima found: {len(local_minima)}")
+        for local_minimum, cost in local_minima:
+            print(f"cost {cost:.5e}: log10(" +
+                  ", ".join(fit_parameters_names) + ") = " +
+                  ", ".join(f"{value:.5f}" for value in local_minimum))
+    # the finite difference steps of the Jacobian are calculated as one
+    # batch, distributed over a pool for SpectralRadex (the 'numpy' solver
+    # vectorizes them instead).
+    elif model_solver == 'numpy':
+        initial_parameters = run_levenberg_marquardt(
+            global_parameter_estimates[0], alg_help.RADEX_model, y_observed,
+            y_uncertainties, bounds, alg_help.RADEX_model_batch,
+            jacobian_updates=jacobian_updates
+        )
+    else:
+        initial_parameters = run_levenberg_marquardt(
+            global_parameter_estimates[0], alg_help.RADEX_model, y_observed,
+            y_uncertainties, bounds, alg_help.RADEX_model_batch,
+            worker_pool.pool, jacobian_updates=jacobian_updates
+        )
+
+    LM_time = time()
+    LM_duration  = LM_time - start_time
+    LM_duration_HHMMSS = str(
+        timedelta(seconds=LM_duration)
+    ).rpartition('.')[0]
+    print(f"Time elapsed: {LM_duration_HHMMSS}")
+    print("Refined parameter estimates resulting from Levenberg-Marquardt:")
+    for name, value in zip(fit_parameters_names, initial_parameters):
+        print(f"log10({name}): {value:.5f}")
+    cache_statistics = model_cache.statistics()
+    print(f"RADEX model cache: {cache_statistics['hits']} hits, " +
+          f"{cache_statistics['misses']} misses.")
+    if model_solver == 'numpy':
+        warm_start_statistics = warm_start_store.statistics()
+        number_of_models = (warm_start_statistics['hits'] +
+                            warm_start_statistics['misses'])
+        print("Warm started models: " +
+              f"{warm_start_statistics['hits']} of {number_of_models}, " +
+              f"{warm_start_statistics['iterations']} iterations in total.")
+
+if not resume_MCMC:
+    # Gaussian approximation of the posterior at the Levenberg-Marquardt
+    # optimum the MCMC walkers start from.
+    initial_covariance = None
+    if walker_initialization == 'covariance':
+        initial_covariance = least_squares_covariance(
+            initial_parameters, alg_help.RADEX_model, y_observed,
+            y_uncertainties, bounds, alg_help.RADEX_model_batch,
+            None if model_solver == 'numpy' else worker_pool.pool
+        )
+        if initial_covariance is None:
+            print("Levenberg-Marquardt covariance is singular.")
+        else:
+            print("Uncertainties from the Levenberg-Marquardt covariance:")
+            for name, variance in zip(fit_parameters_names,
+                                      initial_covariance.diagonal()):
+                print(f"log10({name}): {variance**0.5:.5f}")
 
 
 #%% #### MCMC for uncertainty estimates ####
-N = 500  # number of steps the MCMC algorithm takes.
+# create output directory before the MCMC, the chain is written to it while
+# it runs.
+if args.resume is None:
+    date_time = datetime.now().strftime("%Y.%m.%d-%H.%M.%S")
+    # FIXME: add filename of molecule + observations to output folder? (might become to long if the date_time is kept as well?)
+    cwd         = getcwd()
+    output_path = cwd + f'/output/{date_time}'
+    Path(output_path).mkdir(parents=True)
+else:
+    output_path = str(Path(args.resume).resolve())
+chain_backend = ChainBackend(output_path + '/chain')
+
+surrogate_log_probability = None
+if MCMC_mode in ['emulator', 'delayed']:
+    print("\nSetting up the RADEX emulator for the MCMC likelihood.")
+    emulator = build_emulator(alg_help, emulator_points, emulator_dir,
+                              pool=worker_pool.pool)
+    # already reported by the run that is resumed.
+    if not resume_MCMC:
+        accuracy = emulator_accuracy_report(
+            alg_help, emulator, held_out_points(alg_help, seed=0)
+        )
+        print(f"Emulator accuracy at {accuracy['number_of_samples']} " +
+              "held-out points (relative | in observed uncertainties): " +
+              f"median {accuracy['median_relative_error']:.2e} | " +
+              f"{accuracy['median_sigma_error']:.2e}, " +
+              f"95% {accuracy['p95_relative_error']:.2e} | " +
+              f"{accuracy['p95_sigma_error']:.2e}, " +
+              f"max {accuracy['max_relative_error']:.2e} | " +
+              f"{accuracy['max_sigma_error']:.2e}")
+    if MCMC_mode == 'emulator':
+        alg_help.emulator = emulator
+    else:
+        surrogate_log_probability = EmulatedLogProbability(alg_help,
+                                                           emulator)
+
+N = MCMC_steps  # number of steps the MCMC algorithm takes.
+number_of_walkers = 35
+if MCMC_vectorize:
+    # the walkers within the limits are distributed over the pool (or
+    # vectorized by the 'numpy' solver or the emulator).
+    log_probability_function = partial(
+        alg_help.log_probability_batch,
+        pool=None if MCMC_mode == 'emulator' else worker_pool.pool
+    )
+elif MCMC_mode == 'emulator':
+    log_probability_function = alg_help.log_probability
+else:
+    log_probability_function = worker_log_probability
+    # emcee evaluates the two halves of the ensemble with one pool map each
+    # every step.
+    walkers = [initial_parameters] * number_of_walkers
+    bytes_per_step = [
+        sum(pool_map_bytes(function, half, cpu_count())
+            for half in [walkers[::2], walkers[1::2]])
+        for function in [alg_help.log_probability, worker_log_probability]
+    ]
+    print("MCMC pool traffic per step: " +
+          f"{bytes_per_step[0]} bytes with the pickled AlgorithmHelpers, " +
+          f"{bytes_per_step[1]} bytes with the worker registry.")
 print("\nRunning MCMC for uncertainty estimates,")
-MCMC_output, ndim = run_monte_carlo(initial_parameters,
-                                    alg_help.log_probability,
-                                    number_of_steps=N)
+MCMC_output, ndim, MCMC_discard = run_monte_carlo(
+    initial_parameters, log_probability_function, number_of_steps=N,
+    number_of_walker_steps=N, number_of_walkers=number_of_walkers,
+    number_of_burnin_steps=burn_in_steps, burn_in_block=burn_in_block,
+    # the emulated likelihood is cheaper than sending it to a pool.
+    core_count=1 if MCMC_mode == 'emulator' else cpu_count(),
+    surrogate_log_probability=surrogate_log_probability,
+    pool=None if MCMC_mode == 'emulator' else worker_pool.pool,
+    vectorize=MCMC_vectorize, convergence_check_interval=convergence_interval,
+    autocorrelation_multiple=autocorrelation_multiple,
+    autocorrelation_tolerance=autocorrelation_tolerance,
+    initial_covariance=initial_covariance, parameter_bounds=bounds,
+    backend=chain_backend
+)
+
+if MCMC_mode == 'emulator':
+    # verify the emulated posterior with exact RADEX models.
+    alg_help.emulator = None
+    posterior_samples = MCMC_output.get_chain(discard=MCMC_discard,
+                                              flat=True)
+    accuracy = emulator_accuracy_report(
+        alg_help, emulator,
+        posterior_samples[randint(len(posterior_samples), size=20)]
+    )
+    print("Emulator accuracy at 20 posterior samples (in observed " +
+          f"uncertainties): median {accuracy['median_sigma_error']:.2e}, " +
+          f"95% {accuracy['p95_sigma_error']:.2e}, " +
+          f"max {accuracy['max_sigma_error']:.2e}")
 
 
 #%% ### end of main program ###
@@ -265,12 +570,6 @@ print(f"\nRun time of main program: {duration_HH_MM_SS}.")
 
 
 #%% ##### plotting and saving of results #####
-date_time = datetime.now().strftime("%Y.%m.%d-%H.%M.%S")
-# FIXME: add filename of molecule + observations to output folder? (might become to long if the date_time is kept as well?)
-# create output directory.
-cwd         = getcwd()
-output_path = cwd + f'/output/{date_time}'
-Path(output_path).mkdir(parents=True)
 
 
 ### saving ###
@@ -278,11 +577,12 @@ saving = SaveResults(
     MCMC_output,
     output_path,
     constant_parameters,
-    fit_parameters_names
+    fit_parameters_names,
+    discard=MCMC_discard
 )
 
 # saving MCMC ensamble.
-saving.save_MCMC_sampler()
+saving.save_MCMC_sampler(compress=compress_output)
 
 # saving RADEX.csv output and obtaining parameter medians.
 prms_50s, prms_MAP = saving.RADEX_for_optimal_parameters(
@@ -298,7 +598,8 @@ plot = Plotting(
     output_path,
     prms_50s,
     prms_MAP,
-    fit_parameters_names
+    fit_parameters_names,
+    discard=MCMC_discard
 )
 
 # Plotting and saving the corner plot.
@@ -307,10 +608,20 @@ plot.plot_corner()
 # Plotting the molecular spectrum.
 plot.plot_spectrum(
     units, y_observed, y_uncertainties, constant_parameters,
-    user_mol_frequencies
+    user_mol_frequencies, worker_pool.pool
 )
 ### plotting ###
 
+worker_pool.close()
+
+# NOTE: the MCMC pool workers each have their own model cache, these
+# counters only cover the main process (LM, saving and plotting).
+cache_statistics = model_cache.statistics()
+print(f"\nRADEX model cache: {cache_statistics['hits']} hits, " +
+      f"{cache_statistics['misses']} misses, " +
+      f"{cache_statistics['models']} models cached " +
+      f"({cache_statistics['bytes'] / 2**20:.1f} MiB).")
+
 
 print(f"\nResults saved to {output_path}.\n")
 
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 #relative imports
-from .save_plot_helper import RADEX_model_plot
+from .save_plot_helper import RADEX_model_plot, RADEX_model_plot_batch
 
 # module imports
 from matplotlib.pyplot import figure, show
@@ -18,7 +18,8 @@ class Plotting:
                  output_path,
                  parameter_50s,
                  parameter_MAP,
-                 fit_parameter_names):
+                 fit_parameter_names,
+                 discard=0):
         """class used for plotting.
 
         Args:            
@@ -30,6 +31,9 @@ class Plotting:
             
             fit_parameter_names (list): Names of fitted parameters.
 
+            discard (int): number of burn-in steps at the start of the
+            chain, see "run_monte_carlo()". Defaults to 0.
+
 
         Returns:
             None
@@ -40,6 +44,7 @@ class Plotting:
         self.parameter_50s       = parameter_50s
         self.parameter_MAP       = parameter_MAP
         self.fit_parameter_names = fit_parameter_names
+        self.discard             = discard
 
         # FIXME: put in the molecule name for column density.
         plot_names = {
@@ -70,7 +75,8 @@ class Plotting:
         Returns:
             None
         """
-        flat_samples = self.sampler.get_chain(discard=100, flat=True)
+        flat_samples = self.sampler.get_chain(discard=self.discard,
+                                              flat=True)
         fig = corner.corner(
             flat_samples, labels=self.plot_labels, #truths=self.parameter_50s,
             quantiles=(0.16, 0.84), levels=(1 - np.exp(-0.5),), smooth=True,
@@ -96,7 +102,8 @@ class Plotting:
                       line_strength_y,
                       line_strength_err,
                       constant_parameters,
-                      frequencies):
+                      frequencies,
+                      pool=None):
         """plot the observed data points, as well as the RADEX model
         spectrum for the best estimates and an "uncertainty" interval
         using 100 random MCMC results.
@@ -113,6 +120,10 @@ class Plotting:
             
             frequencies (nd.array): molfile frequencies matching user
                                     frequencies.
+            
+            pool (multiprocessing.Pool, optional): pool the random MCMC
+                                                   models are distributed
+                                                   over. Defaults to None.
 
 
         Returns:
@@ -131,16 +142,20 @@ class Plotting:
         
         # plot 100 randomly drawn RADEX models to showcase uncertainty
         # interval loosely.
-        flat_samples = self.sampler.get_chain(discard=100, flat=True)
+        flat_samples = self.sampler.get_chain(discard=self.discard,
+                                              flat=True)
         inds = randint(len(flat_samples), size=100)
-        for ind in inds:
-            sample = flat_samples[ind]
-            rnd_output = RADEX_model_plot(
-                self.fit_parameter_names, constant_parameters, sample
-            )
-            rnd_freqs          = rnd_output['freq']
-            rnd_line_strengths = rnd_output[unit_name]
-            frame.scatter(rnd_freqs, rnd_line_strengths, color='#4daf4a',
+        output_50 = RADEX_model_plot(
+            self.fit_parameter_names, constant_parameters,
+            self.parameter_50s
+        )
+        rnd_freqs = output_50['freq'].to_numpy()
+        rnd_line_strengths = RADEX_model_plot_batch(
+            self.fit_parameter_names, constant_parameters,
+            flat_samples[inds], unit_name, pool
+        )
+        for rnd_line_strength in rnd_line_strengths:
+            frame.scatter(rnd_freqs, rnd_line_strength, color='#4daf4a',
                           alpha=0.1, marker='s')
         # FIXME: add to legend without dummy plot.
         # a dummy plot to add MCMC "uncertainty interval" to legend.
@@ -151,10 +166,6 @@ class Plotting:
 
 
         # plot RADEX model for the median parameter estimates
-        output_50 = RADEX_model_plot(
-            self.fit_parameter_names, constant_parameters,
-            self.parameter_50s
-        )
         freq_50           = output_50['freq']
         line_strengths_50 = output_50[unit_name]
         frame.scatter(freq_50, line_strengths_50,
@@ -5,25 +5,41 @@
 from .save_plot_helper import RADEX_model_plot
 
 #module imports
+from emcee.backends import Backend
 from numpy import (
     percentile,
-    savetxt,
     array,
     diff,
     sort,
     full,
+    load,
+    save,
+    savez_compressed,
     NaN
 )
+from pathlib import Path
+import json
 import numpy as np
 from pandas import read_csv
 
 
+# files "SaveResults.save_MCMC_sampler()" writes to the output directory.
+SAMPLER_METADATA_FILE = 'sampler.json'
+SAMPLER_ARRAY_FILES = {
+    'chain':'chain.npy',
+    'log_prob':'log_prob.npy',
+    'acceptance_fraction':'acceptance_fraction.npy'
+}
+SAMPLER_COMPRESSED_FILE = 'sampler.npz'
+
+
 class SaveResults:
     def __init__(self,
                  sampler,
                  output_path,
                  constant_parameters,
-                 fit_parameters_names):
+                 fit_parameters_names,
+                 discard=0):
         """        
         Args:
             sampler (EnsambleSampler): emcee sampler object containing
@@ -37,6 +53,9 @@ class SaveResults:
             fit_parameters_names (list): parameter names of parameters
             to be fit.
 
+            discard (int): number of burn-in steps at the start of the
+            chain, see "run_monte_carlo()". Defaults to 0.
+
 
         Returns:
             None
@@ -46,6 +65,7 @@ class SaveResults:
         self.output_path          = output_path
         self.constant_parameters  = constant_parameters
         self.fit_parameters_names = fit_parameters_names
+        self.discard              = discard
         return
     
     
@@ -71,7 +91,7 @@ class SaveResults:
         # """
         
         # trace = self.sampler.get_chain(flat=True)[:,i]
-        trace = self.sampler.flatchain[:,i]
+        trace = self.sampler.get_chain(discard=self.discard, flat=True)[:,i]
         
         # Get sorted list
         d = np.sort(np.copy(trace))
@@ -93,7 +113,10 @@ class SaveResults:
         # in the corner plot? as in, the "truth" line is not at the maximum of
         # the histogram?
         # mode = self.sampler.get_chain(discard=100, flat=True) [np.argmax(self.sampler.get_log_prob(discard=100, flat=True))][i]
-        mode = self.sampler.flatchain[np.argmax(self.sampler.flatlnprobability), i]
+        mode = self.sampler.get_chain(discard=self.discard, flat=True)[
+            np.argmax(self.sampler.get_log_prob(discard=self.discard,
+                                                flat=True)), i
+        ]
         
         # Return interval
         return np.array([d[min_int], mode, d[min_int+n_samples]])
@@ -157,7 +180,7 @@ class SaveResults:
                 # obtaining the median and upper and lower uncertainties
                 # that enclose 1 sigma.
                 parameter_uncertainty_estimates = percentile(
-                    self.sampler.get_chain(discard=100, flat=True)[:, i],
+                    self.sampler.get_chain(discard=self.discard, flat=True)[:, i],
                     q=[16, 50, 84]
                 )
                 uncertainties = diff(parameter_uncertainty_estimates)
@@ -198,14 +221,51 @@ class SaveResults:
         return parameter_50s, parameter_MAP
 
 
-    def save_MCMC_sampler(self):
-        """save emcee EnsembleSampler.flatchain object.
+    def save_MCMC_sampler(self, compress=False):
+        """save the chain (steps, walkers, parameters), the log
+        probabilities (steps, walkers) and the acceptance fraction of every
+        walker of the emcee EnsembleSampler as binary .npy arrays, including
+        the burn-in, with a JSON metadata file (parameter names, shape and
+        the number of burn-in steps to discard). Load them with
+        "SavedSampler".
+
+        Args:
+            compress (bool): write one compressed sampler.npz instead, which
+            is smaller but cannot be memory-mapped when loaded. Defaults to
+            False.
+
+
+        Returns:
+            None
         """
 
-        savetxt(
-            f'{self.output_path}/sampler.dat',
-            self.sampler.get_chain(flat=True),
-            header=str(self.fit_parameters_names)[1:-1]
+        arrays = {
+            'chain':self.sampler.get_chain(),
+            'log_prob':self.sampler.get_log_prob(),
+            'acceptance_fraction':self.sampler.acceptance_fraction
+        }
+        steps, nwalkers, ndim = arrays['chain'].shape
+        
+        if compress:
+            savez_compressed(f'{self.output_path}/{SAMPLER_COMPRESSED_FILE}',
+                             **arrays)
+        else:
+            # the chain of a "ChainBackend" is memory-mapped and streamed
+            # to the file.
+            for name, values in arrays.items():
+                save(f'{self.output_path}/{SAMPLER_ARRAY_FILES[name]}',
+                     values)
+        
+        metadata = {
+            'fit_parameters_names':list(self.fit_parameters_names),
+            'steps':steps,
+            'nwalkers':nwalkers,
+            'ndim':ndim,
+            'discard':self.discard,
+            'compressed':compress
+        }
+        Path(self.output_path, SAMPLER_METADATA_FILE).write_text(
+            json.dumps(metadata, indent=4)
         )
         
         return
@@ -293,4 +353,55 @@ class SaveResults:
 
 
     
-        
\ No newline at end of file
+        
+
+
+class SavedSampler(Backend):
+    def __init__(self, output_path):
+        """a sampler saved by "SaveResults.save_MCMC_sampler()", read back
+        with the "get_chain()", "get_log_prob()", "get_autocorr_time()" and
+        "acceptance_fraction" of the emcee EnsembleSampler, so "SaveResults"
+        (e.g. "hpd()") and "Plotting" (e.g. "plot_corner()") can be used on
+        it. The uncompressed arrays are memory-mapped, only the parts of
+        the chain that are used are read from disk, so multi-gigabyte chains
+        do not have to fit in memory.
+
+        Args:
+            output_path (str): output directory of the run.
+
+
+        Returns:
+            None
+        """
+
+        super().__init__()
+        self.metadata = json.loads(
+            Path(output_path, SAMPLER_METADATA_FILE).read_text()
+        )
+        self.fit_parameters_names = self.metadata['fit_parameters_names']
+        # number of burn-in steps, pass on as "discard".
+        self.discard = self.metadata['discard']
+        
+        if self.metadata['compressed']:
+            with load(Path(output_path, SAMPLER_COMPRESSED_FILE)) as arrays:
+                self.chain = arrays['chain']
+                self.log_prob = arrays['log_prob']
+                acceptance_fraction = arrays['acceptance_fraction']
+        else:
+            self.chain, self.log_prob, acceptance_fraction = [
+                load(Path(output_path, SAMPLER_ARRAY_FILES[name]),
+                     mmap_mode='r')
+                for name in ['chain', 'log_prob', 'acceptance_fraction']
+            ]
+        
+        self.iteration, self.nwalkers, self.ndim = self.chain.shape
+        self.accepted = acceptance_fraction * self.iteration
+        self.initialized = True
+        
+        return
+
+
+    @property
+    def acceptance_fraction(self):
+        """acceptance fraction of every walker."""
+        return self.accepted / self.iteration
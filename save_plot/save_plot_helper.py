@@ -1,13 +1,19 @@
 #!/usr/bin/env python3
 
 #module imports
-from spectralradex.radex import run
-from numpy import array
+from spectralradex.radex import add_data_path, run
+from numpy import array, atleast_2d, full, nan
+
+#relative imports
+from fitting.fitting_helper_functions import RADEX_line_strengths
+from fitting.model_cache import process_model_cache
 
 
 def RADEX_model_plot(fit_parameter_names, parameters,
                      fit_parameters_values):
-    """calculate RADEX model.
+    """calculate RADEX model, or take it from the model cache if it was
+    calculated before (e.g. the median model, which is both saved and
+    plotted).
 
     Args:
         fit_parameter_names (list): list of names of parameters to fit.
@@ -30,7 +36,93 @@ def RADEX_model_plot(fit_parameter_names, parameters,
     parameters.update(variable_parameters)
     parameters['fmin']=0
     parameters['fmax']=3e7
+    parameters['molfile'] = add_data_path(parameters['molfile'])
+
+    cache_key = process_model_cache.key(
+        fit_parameter_names, fit_parameters_values, parameters, 'DataFrame'
+    )
+    radex_output = process_model_cache.get(cache_key)
+    if radex_output is None:
+        radex_output = run(parameters)
+        if radex_output is not None:
+            process_model_cache.put(cache_key, radex_output)
+    
+    # copy, so callers can not alter the cached model.
+    return None if radex_output is None else radex_output.copy()
+
+
+def RADEX_model_plot_task(arguments):
+    """line strengths of all lines of one RADEX model, taken from the model
+    cache of the (worker) process if it was calculated before, as a pool
+    task of "RADEX_model_plot_batch()".
+
+    Args:
+        arguments (tuple): list of names of parameters to fit, constants,
+        fitted parameters' values and dict key of units selected by user.
+        
+
+    Returns:
+        nd.array: line strengths of all lines, None if RADEX failed.
+    """
+    
+    (fit_parameter_names, parameters, fit_parameters_values,
+     unit_name) = arguments
+    variable_parameters = {
+        variable_parameter_name:variable_parameter_value
+        for variable_parameter_name, variable_parameter_value
+        in zip(fit_parameter_names, 10.0**array(fit_parameters_values))
+    }
+
+    parameters = dict(parameters, **variable_parameters)
+    parameters['fmin']=0
+    parameters['fmax']=3e7
+    parameters['molfile'] = add_data_path(parameters['molfile'])
+
+    cache_key = process_model_cache.key(
+        fit_parameter_names, fit_parameters_values, parameters, unit_name
+    )
+    model = process_model_cache.get(cache_key)
+    if model is None:
+        model = RADEX_line_strengths(parameters, unit_name)
+        if model is not None:
+            process_model_cache.put(cache_key, model)
+
+    return model
+
+
+def RADEX_model_plot_batch(fit_parameter_names, parameters,
+                           fit_parameters_values_2d, unit_name, pool=None):
+    """calculate the line strengths of all lines for a batch of RADEX
+    models, without building a DataFrame for every model.
+
+    Args:
+        fit_parameter_names (list): list of names of parameters to fit.
+        
+        parameters (dict): constants.
+        
+        fit_parameters_values_2d (nd.array): (N, ndim) fitted parameters'
+        values.
+        
+        unit_name (str): dict key of units selected by user.
+        
+        pool (multiprocessing.Pool, optional): pool the models are
+        distributed over. Defaults to None (calculated in this process).
+        
 
-    radex_output = run(parameters)
+    Returns:
+        nd.array: (N, n_lines) line strengths of all lines, NaN for the
+        models RADEX failed to calculate.
+    """
     
-    return radex_output
\ No newline at end of file
+    tasks = [(fit_parameter_names, parameters, fit_parameters_values,
+              unit_name)
+             for fit_parameters_values in atleast_2d(fit_parameters_values_2d)]
+    if pool is None:
+        line_strengths = list(map(RADEX_model_plot_task, tasks))
+    else:
+        line_strengths = pool.map(RADEX_model_plot_task, tasks)
+
+    number_of_lines = max((len(model) for model in line_strengths
+                           if model is not None), default=0)
+    return array([full(number_of_lines, nan) if model is None else model
+                  for model in line_strengths])
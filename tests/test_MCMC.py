@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+# module imports
+from numpy import array, array_equal, atleast_2d
+from numpy.random import seed
+import pytest
+
+from fitting import ChainBackend, run_monte_carlo
+
+
+BOUNDS = (array([-10.0, -10.0]), array([10.0, 10.0]))
+
+
+def gaussian_log_probability(fit_parameters_values_2d):
+    """vectorized log probability of a correlated 2D Gaussian."""
+
+    x = atleast_2d(fit_parameters_values_2d)
+    return -0.5 * (x[:, 0]**2 + (x[:, 1] - 0.5 * x[:, 0])**2 / 0.25)
+
+
+class Interrupted(Exception):
+    pass
+
+
+def run_chain(directory, log_probability_function=gaussian_log_probability,
+              **settings):
+    """a short vectorized chain on the ChainBackend of the directory."""
+
+    seed(1)
+    return run_monte_carlo(
+        array([0.1, 0.1]), log_probability_function, number_of_walkers=8,
+        number_of_burnin_steps=100, number_of_walker_steps=60, core_count=1,
+        vectorize=True, burn_in_block=10, parameter_bounds=BOUNDS,
+        backend=ChainBackend(directory), **settings
+    )
+
+
+@pytest.mark.parametrize('interrupt_after', [15, 150])
+@pytest.mark.parametrize('convergence_check_interval', [None, 20])
+def test_resumed_chain_equals_uninterrupted_chain(
+        tmp_path, interrupt_after, convergence_check_interval):
+    """a chain interrupted in the burn-in or the production and resumed is
+    the chain of an uninterrupted run."""
+
+    sampler, _, discard = run_chain(
+        tmp_path / 'uninterrupted',
+        convergence_check_interval=convergence_check_interval
+    )
+
+    calls = [0]
+    def interrupting_log_probability(fit_parameters_values_2d):
+        calls[0] += 1
+        if calls[0] > interrupt_after:
+            raise Interrupted
+        return gaussian_log_probability(fit_parameters_values_2d)
+
+    with pytest.raises(Interrupted):
+        run_chain(tmp_path / 'resumed', interrupting_log_probability,
+                  convergence_check_interval=convergence_check_interval)
+    interrupted_steps = ChainBackend(tmp_path / 'resumed').iteration
+    assert 0 < interrupted_steps < sampler.iteration
+
+    resumed_sampler, _, resumed_discard = run_chain(
+        tmp_path / 'resumed',
+        convergence_check_interval=convergence_check_interval
+    )
+
+    assert resumed_discard == discard
+    assert ChainBackend(tmp_path / 'resumed').attributes[
+        'initial_parameters'] == [0.1, 0.1]
+    assert array_equal(resumed_sampler.get_chain(), sampler.get_chain())
+    assert array_equal(resumed_sampler.get_log_prob(),
+                       sampler.get_log_prob())
+    assert array_equal(resumed_sampler.acceptance_fraction,
+                       sampler.acceptance_fraction)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+# module imports
+from emcee import EnsembleSampler
+from numpy import atleast_2d, inf, where
+from numpy.random import normal, seed
+
+from fitting import DelayedAcceptanceStretchMove
+
+
+def gaussian_log_probability(fit_parameters_values_2d):
+    """vectorized log probability of a 2D standard Gaussian."""
+
+    x = atleast_2d(fit_parameters_values_2d)
+    return -0.5 * (x**2).sum(axis=1)
+
+
+def surrogate_log_probability(fit_parameters_values_2d):
+    """the Gaussian, -inf for x < -2 (e.g. a failed emulator cell)."""
+
+    x = atleast_2d(fit_parameters_values_2d)
+    return where(x[:, 0] < -2, -inf, gaussian_log_probability(x))
+
+
+def test_walker_leaves_non_finite_surrogate():
+    """a walker that starts where the surrogate is -inf still moves."""
+
+    seed(0)
+    initial_positions = normal(scale=0.5, size=(8, 2))
+    initial_positions[0] = [-3.0, 0.0]
+
+    sampler = EnsembleSampler(
+        8, 2, gaussian_log_probability, vectorize=True,
+        moves=DelayedAcceptanceStretchMove(surrogate_log_probability)
+    )
+    sampler.run_mcmc(initial_positions, 200)
+
+    assert sampler.get_chain()[-1, 0, 0] > -2
+    assert (sampler.acceptance_fraction > 0.1).all()
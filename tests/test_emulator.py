@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+# module imports
+from types import SimpleNamespace
+
+from numpy import array, inf, isfinite, isneginf, linspace, meshgrid, nan
+from numpy import sum as np_sum, zeros
+
+from fitting import EmulatedLogProbability, RADEXEmulator
+
+
+def emulator_with_failed_model():
+    """emulator of 2 lines (10**x + 10**y and 1) on a 5x5 grid, with the
+    model at grid point (x, y) = (1, 1) failed."""
+
+    axis = linspace(0.0, 4.0, 5)
+    x, y = meshgrid(axis, axis, indexing='ij')
+    line_strengths = array([10.0**x + 10.0**y, x * 0 + 1.0]).transpose(1, 2, 0)
+    line_strengths[1, 1] = nan
+
+    return RADEXEmulator([axis, axis], line_strengths)
+
+
+def test_failed_models_are_not_interpolated():
+    """points in a grid cell of the failed model are NaN, the lines keep
+    their log10 interpolation elsewhere."""
+
+    emulator = emulator_with_failed_model()
+    assert emulator.positive_lines.all()
+
+    emulated = emulator.line_strengths_batch(array([[0.5, 0.5], [1.5, 1.5],
+                                                    [3.0, 3.5]]))
+    assert not isfinite(emulated[:2]).any()
+    # exact in log10 space along a grid line.
+    assert abs(emulated[2, 1] - 1.0) < 1e-12
+    assert abs(emulated[2, 0] / (10.0**3 + 10.0**3.5) - 1) < 0.2
+
+
+def test_emulated_log_probability_rejects_failed_cells():
+    """the emulated posterior is -inf next to a failed model and finite
+    elsewhere."""
+
+    alg_help = SimpleNamespace(
+        log_prior_batch=lambda values_2d: zeros(values_2d.shape[0]),
+        matching_lines=array([True, True]),
+        log_likelihood_batch=lambda y_2d: -0.5 * np_sum(y_2d**2, axis=1)
+    )
+    log_probability = EmulatedLogProbability(alg_help,
+                                             emulator_with_failed_model())
+
+    values = log_probability(array([[1.2, 0.8], [3.0, 3.5]]))
+    assert isneginf(values[0])
+    assert isfinite(values[1]) and values[1] > -inf
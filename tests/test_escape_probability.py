@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+# module imports
+from pathlib import Path
+import os
+
+from numpy import abs as np_abs, array
+import pytest
+import spectralradex
+from spectralradex.radex import from_dict, get_default_parameters
+
+from fitting import (EscapeProbabilitySolver, LINE_STRENGTH_UNITS,
+                     RADEX_OUTPUT_ROWS)
+
+
+MOLFILE = str(Path(os.path.dirname(spectralradex.__file__)) / 'radex' /
+              'data' / 'co.dat')
+
+# log10 of tkin, cdmol and n(H2): optically thin to thick, sub-thermal to
+# thermalized.
+SAMPLES = array([
+    [1.3, 14.0, 3.0],
+    [2.0, 16.0, 5.0],
+    [2.5, 15.0, 4.0],
+    [1.0, 17.0, 6.0]
+])
+
+
+@pytest.mark.parametrize('geometry', [1, 2, 3])
+def test_solver_matches_spectralradex(geometry):
+    """T_R and both fluxes of all CO lines brighter than 1e-6 times the
+    brightest line of the model agree with SpectralRadex to 1e-4."""
+
+    parameters = dict(get_default_parameters(), molfile=MOLFILE, fmin=0.0,
+                      fmax=3.0e7, geometry=geometry)
+    numpy_output = EscapeProbabilitySolver(MOLFILE).line_output_batch(
+        parameters, ['tkin', 'cdmol', 'h2'], SAMPLES
+    )
+
+    for sample, model_output in zip(SAMPLES, numpy_output):
+        success, number_of_lines, _, _, radex_output = from_dict(dict(
+            parameters, tkin=10.0**sample[0], cdmol=10.0**sample[1],
+            h2=10.0**sample[2]
+        ))
+        assert success == 1
+        assert model_output.shape[1] == number_of_lines
+
+        for row in [RADEX_OUTPUT_ROWS[unit_key]
+                    for unit_key in LINE_STRENGTH_UNITS]:
+            expected = radex_output[row, :number_of_lines]
+            significant = np_abs(expected) > 1.0e-6 * np_abs(expected).max()
+            assert model_output[row][significant] == pytest.approx(
+                expected[significant], rel=1.0e-4
+            )
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# module imports
+from numpy import arange, array, array_equal, exp, minimum, ndindex
+from numpy.random import default_rng
+import pytest
+
+from fitting import (adaptive_grid_search, particle_swarm_search,
+                     streaming_grid_search, well_separated_minima)
+
+
+def valley_and_well_chi2(grid_points):
+    """chi2 of a long shallow valley (x = 1), which holds the best coarse
+    grid points, and a deeper narrow minimum at (4.3, 4.7)."""
+
+    x, y = grid_points[:, 0], grid_points[:, 1]
+    return ((x - 1)**2 + 0.01 * y -
+            23 * exp(-((x - 4.3)**2 + (y - 4.7)**2) / (2 * 0.3**2)))
+
+
+def test_adaptive_grid_search_refines_every_coarse_cell():
+    """the minimum in a worse coarse cell is found, not only the valley of
+    the best coarse grid points."""
+
+    grid_points, chi2, _ = adaptive_grid_search(
+        array([0.0, 0.0]), array([6.0, 6.0]), valley_and_well_chi2
+    )
+
+    assert abs(grid_points[chi2.argmin()] - array([4.3, 4.7])).max() < 0.05
+
+
+@pytest.mark.parametrize('grid_shape', [(20, 25), (9, 8, 7)])
+@pytest.mark.parametrize('number_of_points', [1, 3, 6])
+def test_streaming_grid_search_keeps_the_well_separated_minima(
+        grid_shape, number_of_points):
+    """the well-separated minima of the kept grid points are those of the
+    whole grid, for a chi2 with many local minima and chunks much smaller
+    than the grid."""
+
+    chi2_table = default_rng(0).random(grid_shape)
+    grid_axes = [arange(float(length)) for length in grid_shape]
+
+    def table_chi2(grid_points):
+        return chi2_table[tuple(grid_points.astype(int).T)]
+
+    grid_points, chi2, grid_indices = streaming_grid_search(
+        grid_axes, table_chi2, number_of_points, chunk_size=7, report=False
+    )
+    assert chi2.shape[0] == number_of_points * 3**len(grid_shape)
+
+    all_indices = array(list(ndindex(*grid_shape)))
+    expected = all_indices[well_separated_minima(
+        chi2_table.ravel(), all_indices, number_of_points
+    )]
+    assert array_equal(
+        grid_points[well_separated_minima(chi2, grid_indices,
+                                          number_of_points)],
+        expected
+    )
+
+
+def test_particle_swarm_search_finds_the_global_minimum():
+    """a seeded swarm reaches the deeper of two minima within its
+    budget."""
+
+    global_minimum = array([1.5, 16.0, 4.2])
+    local_minimum  = array([2.5, 21.0, 6.5])
+
+    def two_minima_chi2(parameters):
+        return minimum(
+            ((parameters - global_minimum)**2).sum(axis=1),
+            0.5 + ((parameters - local_minimum)**2).sum(axis=1)
+        )
+
+    parameters, chi2, _ = particle_swarm_search(
+        array([0.7, 13.0, 2.0]), array([2.9, 24.0, 8.0]), two_minima_chi2,
+        max_evaluations=1000, seed=0
+    )
+
+    assert parameters.shape[0] <= 1000
+    assert abs(parameters[chi2.argmin()] - global_minimum).max() < 0.05
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+# module imports
+from numpy import array, float64, isnan, linspace, meshgrid, nan, stack
+
+from fitting import GridLibrary, LINE_STRENGTH_UNITS
+
+
+def grid_library(tmp_path):
+    """a library of 2 lines with tkin and cdmol as fit parameters."""
+
+    molfile = tmp_path / 'molecule.dat'
+    molfile.write_text('molecule')
+
+    return GridLibrary(tmp_path / 'library',
+                       {'molfile':str(molfile), 'tkin':None, 'cdmol':None},
+                       ['tkin', 'cdmol'], 2)
+
+
+def all_units(values):
+    """(N, 3, 2) line strengths of the points, a different value in every
+    unit."""
+
+    return stack([values + 10 * unit for unit in range(3)], axis=1)
+
+
+def test_insert_and_lookup(tmp_path):
+    """inserted points are found in all units by another library instance,
+    failed models and points already in the library are skipped."""
+
+    library = grid_library(tmp_path)
+    points = array([[1.0, 14.0], [2.0, 15.0], [3.0, 16.0]])
+    line_strengths = all_units(array([[1.0, 2.0], [3.0, 4.0], [nan, 6.0]]))
+    library.insert(points, line_strengths)
+    library.insert(points[:1], all_units(array([[7.0, 8.0]])))
+
+    reader = grid_library(tmp_path)
+    assert reader.number_of_points() == 2
+    for unit_index, unit_key in enumerate(LINE_STRENGTH_UNITS):
+        found, values = reader.lookup(points, unit_key)
+        assert found.tolist() == [True, True, False]
+        assert (values[:2] == line_strengths[:2, unit_index]).all()
+        assert isnan(values[2]).all()
+
+
+def test_insert_after_interrupted_write(tmp_path):
+    """line strengths and a partial parameter record of a writer that died
+    are overwritten by the next insert."""
+
+    library = grid_library(tmp_path)
+    library.insert(array([[1.0, 14.0]]), all_units(array([[1.0, 2.0]])))
+    with open(library.path / 'T_R.bin', 'ab') as column_file:
+        array([9.0, 9.0]).tofile(column_file)
+    with open(library.parameters_path, 'ab') as parameters_file:
+        parameters_file.write(array([3.0], dtype=float64).tobytes())
+
+    library.insert(array([[2.0, 15.0]]), all_units(array([[3.0, 4.0]])))
+
+    reader = grid_library(tmp_path)
+    found, values = reader.lookup(array([[1.0, 14.0], [2.0, 15.0]]),
+                                  'T_R (K)')
+    assert found.all()
+    assert (values == array([[1.0, 2.0], [3.0, 4.0]])).all()
+
+
+def test_covers_only_brute_searches(tmp_path):
+    """the bounds are covered by one or several earlier 'brute' searches
+    together, never by the points of the other searches."""
+
+    library = grid_library(tmp_path)
+    bounds_low, bounds_upp = array([0.0, 12.0]), array([2.0, 18.0])
+    # the coarse grid of an adaptive search, a point in every cell.
+    coarse_grid = array(meshgrid(linspace(0.2, 1.8, 5),
+                                 linspace(12.6, 17.4, 5),
+                                 indexing='ij')).reshape(2, -1).T
+    library.insert(coarse_grid, all_units(coarse_grid))
+    library.add_searched_bounds(bounds_low, bounds_upp, 'adaptive')
+    assert not library.covers(bounds_low, bounds_upp)
+
+    library.add_searched_bounds(array([0.0, 12.0]), array([1.2, 18.0]),
+                                'brute')
+    assert library.covers(array([0.5, 13.0]), array([1.0, 17.0]))
+    assert not library.covers(bounds_low, bounds_upp)
+
+    library.add_searched_bounds(array([1.2, 12.0]), array([2.0, 18.0]),
+                                'brute')
+    assert library.covers(bounds_low, bounds_upp)
+    assert not library.covers(bounds_low, array([2.5, 18.0]))
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+# module imports
+from pathlib import Path
+import os
+import shutil
+import subprocess
+import sys
+
+from numpy import array_equal, median
+import spectralradex
+
+from fitting import ChainBackend
+from save_plot import SavedSampler
+
+
+MAIN = Path(__file__).resolve().parents[1] / 'main.py'
+
+# CO lines of the example in the README (FLUX (K*km/s)).
+SPECTRUM = """#2
+115.271  1.8484e+01  1.8170e+00
+230.538  6.0571e+01  5.8181e+00
+461.041  1.0573e+02  1.0401e+01
+691.473  9.3562e+01  1.0008e+01
+1151.985  4.4683e+01  4.2748e+00
+1381.995  1.4112e+01  1.3804e+00
+1496.923  6.0484e+00  6.2152e-01
+"""
+
+CONFIG = """[PATHS]
+reverseradex_dir = {directory}
+MolecularFile = '%(reverseradex_dir)s/co.dat'
+SpectraFile = '%(reverseradex_dir)s/spectrum.dat'
+
+[CONSTANT_PARAMETERS]
+BackgroundTemperature = 2.73
+LineWidth = 1.0
+Geometry = [1, 'uniform sphere']
+
+[VARIABLE_PARAMETERS]
+Tkin = ['tkin', 100.0, (5.0, 750.0), True]
+Coldens = ['cdmol', 1e19, (1e13, 1e24), True]
+Voldens = {{'h2':(1e4, True),
+           'h':(0.0, False),
+           'e-':(0.0, False),
+           'p-h2':(0, False),
+           'o-h2':(0.0, False),
+           'h+':(0.0, False),
+           'he':(0.0, False),
+           'min_max':(1e2, 1e8)}}
+
+[MODEL]
+Solver = 'numpy'
+
+[GRID]
+Search = 'sobol'
+MaxEvaluations = 256
+Seed = 0
+
+[MCMC]
+Steps = 20
+BurnInSteps = 50
+"""
+
+
+def run_main(directory, *arguments):
+    """run main.py with the config in the directory, answering the
+    confirmation prompt."""
+
+    return subprocess.run(
+        [sys.executable, str(MAIN), '-config', 'config.ini', *arguments],
+        cwd=directory, input='y\n', capture_output=True, text=True,
+        timeout=1800
+    )
+
+
+def test_main_runs_to_the_end(tmp_path):
+    """the whole pipeline, grid search up to the saved results."""
+
+    shutil.copy(Path(os.path.dirname(spectralradex.__file__)) / 'radex' /
+                'data' / 'co.dat', tmp_path / 'co.dat')
+    (tmp_path / 'spectrum.dat').write_text(SPECTRUM)
+    (tmp_path / 'config.ini').write_text(CONFIG.format(directory=tmp_path))
+
+    result = run_main(tmp_path)
+    assert result.returncode == 0, result.stderr
+
+    assert 'Uncertainties from the Levenberg-Marquardt covariance' in \
+        result.stdout
+    assert "resulting from the 'sobol' search method" in result.stdout
+    output_path, = (tmp_path / 'output').glob('2*')
+    assert (output_path / 'MCMC_corner_plot.png').exists()
+    assert (output_path / 'chain' / 'checkpoint.pkl').exists()
+
+    # the saved chain is the chain of the run.
+    sampler = SavedSampler(output_path)
+    chain = ChainBackend(output_path / 'chain')
+    assert sampler.fit_parameters_names == ['tkin', 'cdmol', 'h2']
+    assert sampler.discard == chain.attributes['discard']
+    assert array_equal(sampler.get_chain(), chain.get_chain())
+    assert array_equal(sampler.get_log_prob(), chain.get_log_prob())
+    assert array_equal(sampler.acceptance_fraction,
+                       chain.accepted / chain.iteration)
+    medians = median(sampler.get_chain(discard=sampler.discard, flat=True),
+                     axis=0)
+    for name, value in zip(sampler.fit_parameters_names, medians):
+        assert f"log10({name}): {value:.5f} |" in result.stdout
+
+    # the chain of the finished run is continued, not started again, from
+    # the initial parameters stored with it.
+    result = run_main(tmp_path, '--resume', str(output_path))
+    assert result.returncode == 0, result.stderr
+    assert 'Resuming the MCMC chain' in result.stdout
+    assert 'Estimating initial parameters.' not in result.stdout
+    assert 'Refining parameter estimates.' not in result.stdout
+    assert 'The chain was already completed.' in result.stdout
+    assert [output_path] == list((tmp_path / 'output').glob('2*'))
+
+    result = run_main(tmp_path, '--resume', str(tmp_path / 'no_run'))
+    assert 'No MCMC chain to resume' in result.stderr
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# module imports
+import shutil
+
+from numpy import array, float64, full
+
+from fitting import ModelStore
+
+
+def store_bucket(tmp_path):
+    """a ModelStore bucket of 3 lines with tkin as fit parameter."""
+
+    molfile = tmp_path / 'molecule.dat'
+    molfile.write_text('molecule')
+    store = ModelStore(tmp_path / 'store')
+
+    return store.bucket({'molfile':str(molfile), 'tkin':None}, ['tkin'],
+                        'T_R (K)', 3)
+
+
+def test_insert_after_interrupted_values_write(tmp_path):
+    """values of a writer that died before its index record are not
+    mistaken for the values of the next model."""
+
+    bucket = store_bucket(tmp_path)
+    bucket.insert(array([[1.0]]), full((1, 3), 1.0))
+    with open(bucket.values_path, 'ab') as values_file:
+        full((1, 3), 9.0).tofile(values_file)
+
+    bucket.insert(array([[2.0]]), full((1, 3), 2.0))
+
+    reader = store_bucket(tmp_path)
+    found, line_strengths = reader.lookup(array([[1.0], [2.0]]))
+    assert found.all()
+    assert (line_strengths == array([[1.0] * 3, [2.0] * 3])).all()
+
+
+def test_insert_after_interrupted_index_write(tmp_path):
+    """a partial index record of a writer that died is overwritten."""
+
+    bucket = store_bucket(tmp_path)
+    bucket.insert(array([[1.0]]), full((1, 3), 1.0))
+    with open(bucket.values_path, 'ab') as values_file:
+        full((1, 3), 9.0).tofile(values_file)
+    with open(bucket.index_path, 'ab') as index_file:
+        index_file.write(array([3.0], dtype=float64).tobytes()[:4])
+
+    bucket.insert(array([[2.0]]), full((1, 3), 2.0))
+
+    reader = store_bucket(tmp_path)
+    found, line_strengths = reader.lookup(array([[1.0], [2.0], [3.0]]))
+    assert found.tolist() == [True, True, False]
+    assert (line_strengths[:2] == array([[1.0] * 3, [2.0] * 3])).all()
+
+
+def test_lookup_after_bucket_was_recreated(tmp_path):
+    """a bucket that another process evicted and filled again is not read
+    with the rows of the evicted one."""
+
+    reader = store_bucket(tmp_path)
+    writer = store_bucket(tmp_path)
+    writer.insert(array([[1.0], [2.0]]), array([[1.0] * 3, [2.0] * 3]))
+    assert reader.lookup(array([[1.0], [2.0]]))[0].all()
+
+    shutil.rmtree(writer.path)
+    writer = store_bucket(tmp_path)
+    writer.insert(array([[5.0], [6.0], [1.0]]),
+                  array([[50.0] * 3, [60.0] * 3, [10.0] * 3]))
+
+    found, line_strengths = reader.lookup(array([[1.0], [2.0]]))
+    assert found.tolist() == [True, False]
+    assert (line_strengths[0] == 10.0).all()
+
+
+def test_size_cap_is_checked_every_interval(tmp_path):
+    """the store is only measured every "size_check_interval" inserts, in
+    between the written bytes are added to the estimate."""
+
+    bucket = store_bucket(tmp_path)
+    store = bucket.store
+    store.size_check_interval = 3
+    measurements = []
+    size = store.size
+    store.size = lambda: measurements.append(None) or size()
+
+    for value in range(6):
+        bucket.insert(array([[float(value)]]), full((1, 3), 1.0))
+
+    assert len(measurements) == 2
+    assert store.size_estimate == size() == 6 * 8 * (3 + 1)
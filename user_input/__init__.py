@@ -1,3 +1,4 @@
 from .constant_input import *
 from .variable_input import *
-from .read_user_data import *
\ No newline at end of file
+from .read_user_data import *
+from .lamda_molecule import *
\ No newline at end of file
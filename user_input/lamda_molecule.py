@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+
+# module imports
+from hashlib import sha1
+import os
+
+from numpy import array, load, savez
+
+
+class LamdaMolecule:
+    def __init__(self, energies, weights, upper, lower, einstein_A,
+                 frequencies, collision_partners):
+        """levels, radiative transitions and collision rates of a molecular
+        data file in the LAMDA format, parsed once into contiguous arrays.
+        Use "load_lamda_molecule()" instead of creating one directly, it
+        keeps one parsed molecule per process and a binary sidecar file
+        next to the molfile.
+
+        Args:
+            energies (nd.array): (n_levels,) level energies [cm^-1].
+
+            weights (nd.array): (n_levels,) statistical weights.
+
+            upper (nd.array): (n_lines,) upper levels (0-indexed).
+
+            lower (nd.array): (n_lines,) lower levels (0-indexed).
+
+            einstein_A (nd.array): (n_lines,) Einstein A coefficients
+            [s^-1].
+
+            frequencies (nd.array): (n_lines,) frequencies [GHz].
+
+            collision_partners (dict): per LAMDA collision partner id its
+            temperatures [K], upper and lower levels (0-indexed) and
+            (n_transitions, n_temperatures) downward rates [cm^3 s^-1].
+
+
+        Returns:
+            None
+        """
+
+        self.energies           = energies
+        self.weights            = weights
+        self.upper              = upper
+        self.lower              = lower
+        self.einstein_A         = einstein_A
+        self.frequencies        = frequencies
+        self.collision_partners = collision_partners
+        self.number_of_levels   = energies.shape[0]
+        self.number_of_lines    = frequencies.shape[0]
+
+        return
+
+
+    @classmethod
+    def from_molfile(cls, molfile):
+        """parse a molecular data file in the LAMDA format.
+
+        Args:
+            molfile (str): file location on system of molecular file.
+
+
+        Returns:
+            LamdaMolecule: the parsed molecule.
+        """
+
+        # every line that is not a header (starting with "!").
+        with open(molfile) as molfile_contents:
+            rows = [row.split() for row in molfile_contents
+                    if row.strip() and not row.lstrip().startswith('!')]
+
+        number_of_levels = int(rows[2][0])
+        levels = rows[3:3 + number_of_levels]
+        row = 3 + number_of_levels
+
+        number_of_lines = int(rows[row][0])
+        lines = rows[row + 1:row + 1 + number_of_lines]
+        row += 1 + number_of_lines
+
+        collision_partners = {}
+        number_of_partners = int(rows[row][0])
+        row += 1
+        for _ in range(number_of_partners):
+            partner_id = int(rows[row][0])
+            number_of_transitions = int(rows[row + 1][0])
+            temperatures = array(rows[row + 3], dtype=float)
+            transitions = array(
+                [transition[:3 + temperatures.shape[0]]
+                 for transition
+                 in rows[row + 4:row + 4 + number_of_transitions]],
+                dtype=float
+            )
+            collision_partners[partner_id] = {
+                'temperatures':temperatures,
+                'upper':transitions[:, 1].astype(int) - 1,
+                'lower':transitions[:, 2].astype(int) - 1,
+                'rates':transitions[:, 3:].copy()
+            }
+            row += 4 + number_of_transitions
+
+        return cls(
+            energies=array([level[1] for level in levels], dtype=float),
+            weights=array([level[2] for level in levels], dtype=float),
+            upper=array([line[1] for line in lines], dtype=int) - 1,
+            lower=array([line[2] for line in lines], dtype=int) - 1,
+            einstein_A=array([line[3] for line in lines], dtype=float),
+            frequencies=array([line[4] for line in lines], dtype=float),
+            collision_partners=collision_partners
+        )
+
+
+    def save(self, sidecar_file, signature):
+        """save the molecule to a binary sidecar file (".npz").
+
+        Args:
+            sidecar_file (str): file location of the sidecar file.
+
+            signature (dict): modification time, size and sha1 of the
+            molfile the molecule was parsed from, see "molfile_signature()".
+
+
+        Returns:
+            None
+        """
+
+        partner_arrays = {}
+        for partner_id, partner in self.collision_partners.items():
+            for name, values in partner.items():
+                partner_arrays[f'partner_{partner_id}_{name}'] = values
+
+        # written to a temporary file first, so a worker never reads a
+        # half written sidecar file.
+        temporary_file = f'{sidecar_file}.{os.getpid()}.tmp.npz'
+        savez(temporary_file,
+              mtime_ns=signature['mtime_ns'], size=signature['size'],
+              sha1=signature['sha1'],
+              energies=self.energies, weights=self.weights,
+              upper=self.upper, lower=self.lower,
+              einstein_A=self.einstein_A, frequencies=self.frequencies,
+              partner_ids=array(sorted(self.collision_partners), dtype=int),
+              **partner_arrays)
+        os.replace(temporary_file, sidecar_file)
+
+        return
+
+
+    @classmethod
+    def load(cls, sidecar_file):
+        """load a molecule saved with "save()".
+
+        Args:
+            sidecar_file (str): file location of the sidecar file.
+
+
+        Returns:
+            LamdaMolecule, dict: the molecule and the signature of the
+            molfile it was parsed from.
+        """
+
+        with load(sidecar_file) as sidecar:
+            collision_partners = {
+                int(partner_id):{
+                    name:sidecar[f'partner_{partner_id}_{name}']
+                    for name in ('temperatures', 'upper', 'lower', 'rates')
+                }
+                for partner_id in sidecar['partner_ids']
+            }
+            signature = {'mtime_ns':int(sidecar['mtime_ns']),
+                         'size':int(sidecar['size']),
+                         'sha1':str(sidecar['sha1'])}
+            molecule = cls(
+                sidecar['energies'], sidecar['weights'], sidecar['upper'],
+                sidecar['lower'], sidecar['einstein_A'],
+                sidecar['frequencies'], collision_partners
+            )
+
+        return molecule, signature
+
+
+def molfile_signature(molfile, with_hash=True):
+    """modification time, size and (optionally) sha1 of the molfile
+    contents.
+
+    Args:
+        molfile (str): file location on system of molecular file.
+
+        with_hash (bool): also hash the molfile contents. Defaults to True.
+
+
+    Returns:
+        dict: mtime_ns, size and sha1 (None if not hashed) of the molfile.
+    """
+
+    status = os.stat(molfile)
+    signature = {'mtime_ns':status.st_mtime_ns, 'size':status.st_size,
+                 'sha1':None}
+    if with_hash:
+        with open(molfile, 'rb') as molfile_contents:
+            signature['sha1'] = sha1(molfile_contents.read()).hexdigest()
+
+    return signature
+
+
+def read_sidecar(molfile, sidecar_file):
+    """the molecule from the sidecar file, if it is still valid: the
+    molfile has the same modification time and size, or (e.g. after a
+    copy or "touch") the same contents.
+
+    Args:
+        molfile (str): file location on system of molecular file.
+
+        sidecar_file (str): file location of the sidecar file.
+
+
+    Returns:
+        LamdaMolecule: the molecule, None if there is no valid sidecar
+        file.
+    """
+
+    try:
+        molecule, stored = LamdaMolecule.load(sidecar_file)
+    # a missing, unreadable or outdated sidecar file is simply rebuilt.
+    except (OSError, KeyError, ValueError):
+        return None
+
+    current = molfile_signature(molfile, with_hash=False)
+    if (current['mtime_ns'], current['size']) == (stored['mtime_ns'],
+                                                   stored['size']):
+        return molecule
+    if molfile_signature(molfile)['sha1'] == stored['sha1']:
+        return molecule
+
+    return None
+
+
+# parsed molecules of this process by molfile (and its modification time
+# and size). Pool workers forked after the first "load_lamda_molecule()"
+# share the arrays of the main process (copy-on-write) instead of
+# re-reading the molfile, spawned workers read the sidecar file.
+lamda_molecules = {}
+
+
+def load_lamda_molecule(molfile, sidecar=True):
+    """the parsed molecule of a molfile, parsed at most once per process
+    and, once parsed, read from a binary sidecar file
+    ("<molfile>.lamda.npz") by later runs and spawned processes.
+
+    Args:
+        molfile (str): file location on system of molecular file.
+
+        sidecar (bool): read and write the sidecar file. Defaults to True.
+
+
+    Returns:
+        LamdaMolecule: the parsed molecule.
+    """
+
+    status = os.stat(molfile)
+    key = (os.path.abspath(molfile), status.st_mtime_ns, status.st_size)
+    if key in lamda_molecules:
+        return lamda_molecules[key]
+
+    sidecar_file = f'{molfile}.lamda.npz'
+    molecule = read_sidecar(molfile, sidecar_file) if sidecar else None
+    if molecule is None:
+        molecule = LamdaMolecule.from_molfile(molfile)
+        if sidecar:
+            try:
+                molecule.save(sidecar_file, molfile_signature(molfile))
+            # NOTE: e.g. a read-only molfile directory, the molecule is
+            # then parsed again by the next run.
+            except OSError:
+                pass
+
+    lamda_molecules[key] = molecule
+
+    return molecule
@@ -5,6 +5,7 @@ from numpy import loadtxt, ones
 
 # relative imports
 from user_input.input_functions import in_between_check
+from user_input.lamda_molecule import load_lamda_molecule
 
 
 class DataRetrieval:
@@ -116,36 +117,11 @@ class DataRetrieval:
             list: list of frequencies with float type.
         """
         
-        contents_molfile = self.get_file_lines(molecular_file)
-        # FIXME: this only works if all molfiles are structured the same way
-        # and some inconsistencies in LAMDA files definitley ocurred.
-        trans = ('!TRANS', '! TRANS')
-        numbr = ('!NUMBER', '! NUMBER')
-        index_lower = None
-        index_upper = None
-        for molfile_line in contents_molfile:
-            if molfile_line.startswith(trans):
-                index_lower = contents_molfile.index(molfile_line)
-            
-            if molfile_line.startswith(numbr):
-                index_upper = contents_molfile.index(molfile_line)
-            
-            # since we are after the first occurrence of '!TRANS' and
-            # subsequent '!NUMBER' in the molfile, this if statement
-            # should suffice in finding the indices
-            if ((index_lower and index_upper) != None
-                and index_upper > index_lower):
-                break
-        
-        radiative_transitions = contents_molfile[index_lower + 1:index_upper]
-        radiative_transitions_split = [split_line.split()
-                                       for split_line
-                                       in radiative_transitions]
-        
-        # "transposing" the list to select the column (now row) of frequencies.
-        # index 4 indicates the frequency column (now row) in the molfile.
-        molfile_frequencies = self.transpose_float_convert_list(
-            radiative_transitions_split, 4)
+        # the molfile is parsed once (and cached in a binary sidecar file),
+        # see "load_lamda_molecule()".
+        molfile_frequencies = load_lamda_molecule(
+            molecular_file
+        ).frequencies.tolist()
         
         return molfile_frequencies
 